@@ -0,0 +1,47 @@
+"""Admission control for the work which needs the database.
+The cache hits do not go through the limiter, so they are served at once even when the refills queue up"""
+
+import asyncio
+import async_timeout
+from contextlib import asynccontextmanager
+from config import settings
+from handlers import OverloadedError
+
+
+
+class AdmissionLimiter():
+
+    """At most limit calls run at once in this worker, the others wait in a queue.
+    A call with a budget is shed (OverloadedError, 503) when it can not start within budget seconds
+    or when settings.ADMISSION_MAX_QUEUE calls are already waiting. A call without a budget
+    (the write-back, its data would be lost otherwise) waits as long as needed"""
+
+    def __init__(self, limit: int):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.waiting = 0
+        self.shed = 0   #calls rejected since the start of the worker
+
+
+    @asynccontextmanager
+    async def slot(self, budget: float = None):
+        if budget is not None and self.waiting >= settings.ADMISSION_MAX_QUEUE:
+            self.shed += 1
+            raise OverloadedError()
+        self.waiting += 1
+        try:
+            async with async_timeout.timeout(budget):
+                await self.semaphore.acquire()
+        except asyncio.TimeoutError:
+            self.shed += 1
+            raise OverloadedError()
+        finally:
+            self.waiting -= 1
+        try:
+            yield
+        finally:
+            self.semaphore.release()
+
+
+
+db_limiter = AdmissionLimiter(settings.ADMISSION_MAX_CONCURRENT)   #refills and write-backs share the db pool
+search_limiter = AdmissionLimiter(settings.SEARCH_MAX_CONCURRENT)   #the searches of the editors have their own slots
@@ -0,0 +1,115 @@
+"""The answer statistics of the questions.
+Every answer increments the counters of its question in a Redis hash, so there is no db write per answer.
+A background task of every worker adds the counters to the question_stats table with one bulk upsert"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import List
+from quart import Quart
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from config import settings
+from const import TxtData
+from models import QuestionStats, get_async_session
+from cache_backends import CacheBackend
+from handlers import global_error_handler_async
+from breakers import db_breaker
+from admission import db_limiter
+
+
+
+class AnswerStats():
+
+    """The answer counters of all the workers, the fields {ID}:attempts and {ID}:correct of TxtData.AnswerStatsKey"""
+
+    def __init__(self, redis: CacheBackend):
+        self.redis = redis
+        self.ActiveFlusher = True
+
+
+    @global_error_handler_async
+    async def record(self, test_id: int, correct: bool):
+        await self.redis.hincrby(TxtData.AnswerStatsKey, TxtData.AttemptsField.format(test_id), 1)
+        if correct:
+            await self.redis.hincrby(TxtData.AnswerStatsKey, TxtData.CorrectField.format(test_id), 1)
+
+
+    @global_error_handler_async
+    async def flush(self) -> int:
+
+        """The counters are renamed to the flushing key (the new answers are counted in a new hash meanwhile),
+        added to the db and removed. The counters left by a failed flush are written first.
+        Only one worker flushes at a time. Returns the number of the questions written"""
+
+        if not await self.redis.set(TxtData.AnswerStatsLockKey, 1, nx=True, ex=settings.ANSWER_STATS_FLUSH_INTERVAL):
+            return 0   #another worker flushes now
+        try:
+            Counters = await self.redis.hgetall(TxtData.AnswerStatsFlushingKey)
+            if not Counters and await self.redis.hlen(TxtData.AnswerStatsKey):
+                await self.redis.rename(TxtData.AnswerStatsKey, TxtData.AnswerStatsFlushingKey)
+                Counters = await self.redis.hgetall(TxtData.AnswerStatsFlushingKey)
+            if not Counters:
+                return 0
+            Rows = _stats_rows(Counters)
+            async with db_limiter.slot():
+                await _upsert_stats(Rows)
+            await self.redis.delete(TxtData.AnswerStatsFlushingKey)
+        finally:
+            await self.redis.delete(TxtData.AnswerStatsLockKey)
+        logging.info(TxtData.AnswerStatsReport.format(len(Rows)))
+        return len(Rows)
+
+
+    @global_error_handler_async
+    async def flush_loop(self, app: Quart):
+
+        """the background task, the counters are written every settings.ANSWER_STATS_FLUSH_INTERVAL seconds"""
+
+        i = 0
+        while self.ActiveFlusher:
+            if getattr(app, 'shutdown_event', None) and app.shutdown_event.is_set():
+                break   #after_serving writes the last counters
+            if i >= settings.ANSWER_STATS_FLUSH_INTERVAL:
+                i = 0
+                await self.flush()
+            i += 1
+            await asyncio.sleep(1)
+
+
+
+def _stats_rows(Counters: dict) -> List[dict]:
+
+    """the rows of question_stats from the fields of the hash like {b'12:attempts': b'3', b'12:correct': b'1'}"""
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    Rows = {}
+    for field, value in Counters.items():
+        test_id, counter = field.decode('utf-8').split(':')
+        Row = Rows.setdefault(int(test_id), {"question_id": int(test_id), "attempts": 0, "correct": 0,
+                                             "updated_at": now})
+        Row[counter] = int(value)
+    return list(Rows.values())
+
+
+
+@db_breaker.guard(timeout=settings.DB_WRITE_TIMEOUT)
+async def _upsert_stats(Rows: List[dict]):
+
+    """one executemany insert, the counters of the existing rows are added up"""
+
+    StatsTable = QuestionStats.__table__
+    async for session in get_async_session():
+        if session.bind.dialect.name == 'mysql':
+            statement = mysql_insert(StatsTable)
+            statement = statement.on_duplicate_key_update(attempts=StatsTable.c.attempts + statement.inserted.attempts,
+                                                          correct=StatsTable.c.correct + statement.inserted.correct,
+                                                          updated_at=statement.inserted.updated_at)
+        else:
+            statement = sqlite_insert(StatsTable)
+            statement = statement.on_conflict_do_update(index_elements=[StatsTable.c.question_id],
+                                                        set_={"attempts": StatsTable.c.attempts + statement.excluded.attempts,
+                                                              "correct": StatsTable.c.correct + statement.excluded.correct,
+                                                              "updated_at": statement.excluded.updated_at})
+        await session.execute(statement, Rows)
+        await session.commit()
@@ -8,7 +8,14 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from config import settings
 from routes import eng_bp
+from profiling import admin_bp
+from sessions import session_bp
 from cache_utils import EngCache, CacheListener, initcache
+from cache_backends import CacheBackend, MemoryCache, GuardedCache
+from breakers import DependencyUnavailable, redis_breaker
+from content_store import ContentStore
+from answer_stats import AnswerStats
+from log_queue import QueueLogging
 from quart import Quart, redirect
 from quart_schema import QuartSchema
 import asyncio
@@ -18,10 +25,17 @@ from handlers import (
     handle_bad_request_error,
     handle_not_found_error,
     handle_no_tests_error,
+    handle_test_not_found_error,
+    TestNotFoundError,
     handle_internal_error,
     NoTestsError,
     WrongLevelError,
     handle_wrong_level_error,  
+    handle_profiler_busy_error,
+    ProfilerBusyError,
+    handle_dependency_unavailable_error,
+    handle_overloaded_error,
+    OverloadedError,
     global_error_handler_sync
 )
 
@@ -42,40 +56,70 @@ def create_app():
     app.errorhandler(400)(handle_bad_request_error)
     app.errorhandler(404)(handle_not_found_error)
     app.errorhandler(NoTestsError)(handle_no_tests_error)
+    app.errorhandler(TestNotFoundError)(handle_test_not_found_error)
     app.errorhandler(500)(handle_internal_error)
     app.errorhandler(WrongLevelError)(handle_wrong_level_error)
+    app.errorhandler(DependencyUnavailable)(handle_dependency_unavailable_error)
+    app.errorhandler(OverloadedError)(handle_overloaded_error)
 
 
     app.register_blueprint(eng_bp, url_prefix='')  #add routes
+    app.register_blueprint(session_bp, url_prefix='')  #the websocket of the quiz sessions
+
+    if settings.PROFILING_ENABLED:   #the admin routes exist only when profiling is switched on
+        app.errorhandler(ProfilerBusyError)(handle_profiler_busy_error)
+        app.register_blueprint(admin_bp, url_prefix='')
     
     return app
 
 
 @global_error_handler_sync
-def setup_cache(app: Quart):
-    """Initialize the cache classes for saving and reading to/from the cache and for cache listening"""
-
-    redis = initcache()
-    engcache = EngCache(redis)  #init the class for cache processing
-    cache_listener = CacheListener(redis, app)   #init a class to listen the cache
+def setup_cache(app: Quart, redis: CacheBackend = None):
+    """Initialize the cache classes for saving and reading to/from the cache and for cache listening.
+    redis replaces the backend from settings.CACHE_TYPE (the benchmarks use it for the stand-ins)"""
+
+    redis = redis or initcache()
+    content_store = ContentStore(settings.CONTENT_STORE_DIR) if settings.CONTENT_STORE_ENABLED else None
+    engcache = EngCache(GuardedCache(redis, redis_breaker), content_store)  #init the class for cache processing
+    fallback_redis = MemoryCache()   #small batches in the worker memory for the time when Redis is unavailable
+    cache_listener = CacheListener(redis, app, fallback_redis)   #init a class to listen the cache
     app.config['EngCache'] = engcache #config in order to pass EngCache class from cache_utils.py to routes.py
+    app.config['FallbackCache'] = EngCache(fallback_redis, number_of_tests=settings.FALLBACK_NUMBER_OF_TESTS)
+    app.config['AnswerStats'] = AnswerStats(engcache.redis)   #the answer counters are kept with the cache
     return cache_listener
 
 
 def run_app():
+    queue_logging = QueueLogging()
+    queue_logging.start()   #before the app, so Quart does not add its own handler
     app = create_app()
     cache_listener = setup_cache(app)
     
     @app.before_serving
     async def before_serving():
         """implement the background task"""
+        await cache_listener.register_worker()
         cache_listener.start_cache_listener() 
+        app.add_background_task(cache_listener.recover_checkpoint)
+        app.add_background_task(app.config['AnswerStats'].flush_loop, app)
 
     @app.after_serving
     async def after_serving():
-        """when clicking Ctrl+C in the terminal"""
-        await cache_listener.on_stop_app()
+        """when clicking Ctrl+C in the terminal or when a worker process of api/serve.py stops"""
         cache_listener.stop_cache_listener()
+        app.config['AnswerStats'].ActiveFlusher = False
+        try:
+            try:
+                await app.config['AnswerStats'].flush()   #the counters of the last interval
+            finally:
+                LastWorker = True   #when the registry can not be read, the cache is saved anyway
+                try:
+                    LastWorker = await cache_listener.unregister_worker()   #the cache is shared, so only the last worker saves it
+                finally:
+                    if LastWorker:
+                        await cache_listener.on_stop_app()
+        finally:
+            queue_logging.stop()   #the records of the stop are written too
     return app
 
     
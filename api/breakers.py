@@ -0,0 +1,123 @@
+"""Circuit breakers for the dependencies of the app (Redis and the database).
+Every guarded call has a timeout. After settings.BREAKER_FAILURE_THRESHOLD failures in a row the circuit opens
+and the calls fail at once without waiting for the dependency. After settings.BREAKER_RECOVERY_TIMEOUT seconds
+one call is let through (half-open): if it succeeds the circuit closes, otherwise it opens again"""
+
+import asyncio
+import functools
+import logging
+import time
+import aioredis
+import async_timeout
+from sqlalchemy import exc
+from config import settings
+from const import TxtData
+
+
+
+class DependencyUnavailable(Exception):
+
+    """A dependency failed, timed out or its circuit is open. The routes handle it with the fallbacks"""
+
+    def __init__(self, name: str, reason: str):
+        super().__init__(TxtData.DependencyUnavailable.format(name, reason))
+        self.name = name
+
+
+
+class CircuitBreaker():
+
+    """The breaker of one dependency. Only the exceptions from failures count, the others
+    (like a wrong query) are raised as they are and do not open the circuit"""
+
+    Closed = 'closed'
+    Open = 'open'
+    HalfOpen = 'half_open'
+
+    def __init__(self, name: str, timeout: float, failures: tuple):
+        self.name = name
+        self.timeout = timeout
+        self.failures = failures + (asyncio.TimeoutError,)
+        self.state = self.Closed
+        self.failed_calls = 0   #failures in a row
+        self.opened_at = None
+        self._probing = False   #the half-open call is running
+
+
+    def state_info(self) -> dict:
+        return {"state": self.state,
+                "failed_calls": self.failed_calls,
+                "open_seconds": round(time.monotonic() - self.opened_at, 3) if self.opened_at else 0}
+
+
+    def _allow(self) -> bool:
+        if self.state == self.Open and time.monotonic() - self.opened_at >= settings.BREAKER_RECOVERY_TIMEOUT:
+            self._change_state(self.HalfOpen)
+        if self.state == self.Closed:
+            return True
+        if self.state == self.HalfOpen and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+
+    def _change_state(self, state: str):
+        if state != self.state:
+            logging.warning(TxtData.BreakerStateChanged.format(self.name, self.state, state))
+        self.state = state
+        if state == self.Open:
+            self.opened_at = time.monotonic()
+        elif state == self.Closed:
+            self.opened_at = None
+
+
+    def _on_failure(self):
+        self.failed_calls += 1
+        if self.state == self.HalfOpen or self.failed_calls >= settings.BREAKER_FAILURE_THRESHOLD:
+            self._change_state(self.Open)
+
+
+    def _on_success(self):
+        self.failed_calls = 0
+        self._change_state(self.Closed)
+
+
+    async def call(self, func, *args, timeout: float = None, **kwargs):
+
+        """await func(*args, **kwargs) through the breaker. timeout replaces the default one of the breaker"""
+
+        if not self._allow():
+            raise DependencyUnavailable(self.name, TxtData.CircuitIsOpen)
+        try:
+            async with async_timeout.timeout(timeout or self.timeout):
+                result = await func(*args, **kwargs)
+        except self.failures as e:
+            self._on_failure()
+            raise DependencyUnavailable(self.name, repr(e)) from e
+        finally:
+            self._probing = False
+        self._on_success()
+        return result
+
+
+    def guard(self, func=None, *, timeout: float = None):
+
+        """the decorator version of call: @breaker.guard or @breaker.guard(timeout=...)"""
+
+        if func is None:
+            return functools.partial(self.guard, timeout=timeout)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await self.call(func, *args, timeout=timeout, **kwargs)
+        return wrapper
+
+
+
+redis_breaker = CircuitBreaker(TxtData.RedisDependency, settings.REDIS_TIMEOUT,
+                               failures=(aioredis.RedisError, OSError))
+db_breaker = CircuitBreaker(TxtData.DBDependency, settings.DB_TIMEOUT,
+                            failures=(exc.OperationalError, exc.InterfaceError, exc.TimeoutError, OSError))
+#every worker process has its own breakers
+
+Breakers = {b.name: b for b in (redis_breaker, db_breaker)}
@@ -0,0 +1,401 @@
+"""The cache backends. settings.CACHE_TYPE selects one of them:
+    'redis' - the aioredis client (the cache is shared by all workers and survives restarts of the app)
+    'memory' - the in-process cache for single-node deployments without the network hop to Redis
+Both implement the CacheBackend interface, so EngCache and CacheListener work with either.
+GuardedCache wraps one of them with a circuit breaker"""
+
+import asyncio
+import fnmatch
+import functools
+import math
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Protocol, Union
+
+
+class CacheBackend(Protocol):
+
+    """The part of the Redis commands which the app uses. aioredis.Redis implements it as it is"""
+
+    async def get(self, name: str) -> Optional[bytes]: ...
+    async def set(self, name: str, value, ex: Optional[int] = None, nx: bool = False,
+                  keepttl: bool = False) -> Optional[bool]: ...
+    async def delete(self, *names: str) -> int: ...
+    async def expire(self, name: str, time: int) -> bool: ...
+    async def ttl(self, name: str) -> int: ...
+    async def keys(self, pattern: str = '*') -> List[bytes]: ...
+    async def incr(self, name: str, amount: int = 1) -> int: ...
+    async def zadd(self, name: str, mapping: Dict[str, float]) -> int: ...
+    async def zrem(self, name: str, *values: str) -> int: ...
+    async def zremrangebyscore(self, name: str, min: float, max: float) -> int: ...
+    async def zcard(self, name: str) -> int: ...
+    async def hset(self, name: str, mapping: Dict[str, str]) -> int: ...
+    def bitfield(self, name: str): ...   #the builder of one BITFIELD command: get(fmt, offset), set(fmt, offset, value), execute()
+    async def hget(self, name: str, key: str) -> Optional[bytes]: ...
+    async def hsetnx(self, name: str, key: str, value) -> int: ...
+    async def hgetall(self, name: str) -> Dict[bytes, bytes]: ...
+    async def hdel(self, name: str, *keys: str) -> int: ...
+    async def hincrby(self, name: str, key: str, amount: int = 1) -> int: ...
+    async def hlen(self, name: str) -> int: ...
+    async def rename(self, src: str, dst: str) -> bool: ...
+    async def close(self) -> None: ...
+
+
+
+def _command(func):
+
+    """Like in the redis client, a command is a plain method which returns an awaitable
+    (a finished future here), so the cache can be used and mocked the same way as aioredis"""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    return wrapper
+
+
+
+class MemoryCache():
+
+    """The in-process cache with the same commands and return values as Redis (values are bytes).
+    Every command runs synchronously, so it is atomic for the other tasks of the event loop.
+    A key with a ttl is removed by a timer of the event loop. If an expiry callback is set,
+    it gets the key and the last value, so the data can be saved before it is lost"""
+
+    def __init__(self):
+        self._data: Dict[str, Union[bytes, dict]] = {}
+        self._deadlines: Dict[str, float] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._on_expire: Optional[Callable[[str, bytes], Awaitable]] = None
+        self._tasks = set()
+
+
+    def set_expiry_callback(self, callback: Callable[[str, bytes], Awaitable]):
+        self._on_expire = callback
+
+
+    @staticmethod
+    def _encode(value) -> bytes:
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode('utf-8')
+
+
+    def _alive(self, name: str) -> bool:
+        deadline = self._deadlines.get(name)
+        if deadline is not None and deadline <= time.monotonic():
+            self._expire_now(name)   #the timer did not run yet (a busy loop), the key is dead anyway
+        return name in self._data
+
+
+    def _forget_ttl(self, name: str):
+        self._deadlines.pop(name, None)
+        timer = self._timers.pop(name, None)
+        if timer:
+            timer.cancel()
+
+
+    def _expire_now(self, name: str):
+        self._forget_ttl(name)
+        value = self._data.pop(name, None)
+        if value is not None and self._on_expire and isinstance(value, bytes):
+            task = asyncio.get_running_loop().create_task(self._on_expire(name, value))
+            self._tasks.add(task)   #keep a reference until the write-back finishes
+            task.add_done_callback(self._tasks.discard)
+
+
+    def _set_ttl(self, name: str, seconds: float):
+        self._forget_ttl(name)
+        self._deadlines[name] = time.monotonic() + seconds
+        self._timers[name] = asyncio.get_running_loop().call_later(seconds, self._expire_now, name)
+
+
+    @_command
+    def get(self, name: str) -> Optional[bytes]:
+        if not self._alive(name):
+            return None
+        value = self._data[name]
+        return value if isinstance(value, bytes) else None
+
+
+    @_command
+    def set(self, name: str, value, ex: Optional[int] = None, nx: bool = False,
+            keepttl: bool = False) -> Optional[bool]:
+        if nx and self._alive(name):
+            return None
+        self._data[name] = self._encode(value)
+        if ex is not None:
+            self._set_ttl(name, ex)
+        elif not keepttl:
+            self._forget_ttl(name)   #like in Redis, SET removes the ttl
+        return True
+
+
+    @_command
+    def delete(self, *names: str) -> int:
+        deleted = 0
+        for name in names:
+            if self._alive(name):
+                self._forget_ttl(name)
+                del self._data[name]
+                deleted += 1
+        return deleted
+
+
+    @_command
+    def expire(self, name: str, time: int) -> bool:
+        if not self._alive(name):
+            return False
+        if time <= 0:
+            self._expire_now(name)
+        else:
+            self._set_ttl(name, time)
+        return True
+
+
+    @_command
+    def ttl(self, name: str) -> int:
+        if not self._alive(name):
+            return -2
+        deadline = self._deadlines.get(name)
+        if deadline is None:
+            return -1
+        return math.ceil(deadline - time.monotonic())
+
+
+    @_command
+    def keys(self, pattern: str = '*') -> List[bytes]:
+        return [name.encode('utf-8') for name in list(self._data)
+                if self._alive(name) and fnmatch.fnmatchcase(name, pattern)]
+
+
+    @_command
+    def incr(self, name: str, amount: int = 1) -> int:
+        value = int(self._data[name]) + amount if self._alive(name) else amount
+        self._data[name] = self._encode(value)
+        return value
+
+
+    def _members(self, name: str) -> dict:   #the members of a sorted set or the fields of a hash
+        if not self._alive(name):
+            self._data[name] = {}
+        return self._data[name]
+
+
+    @_command
+    def zadd(self, name: str, mapping: Dict[str, float]) -> int:
+        ZSet = self._members(name)
+        added = len([member for member in mapping if member not in ZSet])
+        ZSet.update(mapping)
+        return added
+
+
+    @_command
+    def zrem(self, name: str, *values: str) -> int:
+        return self._remove_members(name, *values)
+
+
+    def _remove_members(self, name: str, *values: str) -> int:
+        ZSet = self._members(name)
+        removed = len([ZSet.pop(member) for member in values if member in ZSet])
+        if not ZSet:
+            self._forget_ttl(name)
+            del self._data[name]
+        return removed
+
+
+    @_command
+    def zremrangebyscore(self, name: str, min: float, max: float) -> int:
+        ZSet = self._members(name)
+        return self._remove_members(name, *[member for member, score in ZSet.items() if min <= score <= max])
+
+
+    @_command
+    def zcard(self, name: str) -> int:
+        return len(self._data[name]) if self._alive(name) else 0
+
+
+    def bitfield(self, name: str) -> 'MemoryBitField':
+        return MemoryBitField(self, name)
+
+
+    @_command
+    def _bitfield(self, name: str, Operations: list) -> List[int]:
+        Bitmap = bytearray(self._data[name]) if self._alive(name) else bytearray()
+        Values = []
+        for width, offset, value in Operations:
+            if value is not None and (offset + width + 7) >> 3 > len(Bitmap):
+                Bitmap.extend(bytes(((offset + width + 7) >> 3) - len(Bitmap)))
+            old = 0
+            for bit in range(offset, offset + width):   #like in Redis, the bit 0 is the most significant bit of the first byte
+                byte, mask = bit >> 3, 1 << (7 - (bit & 7))
+                old = old << 1 | (byte < len(Bitmap) and bool(Bitmap[byte] & mask))
+                if value is not None:
+                    on = value >> (offset + width - 1 - bit) & 1
+                    Bitmap[byte] = Bitmap[byte] | mask if on else Bitmap[byte] & ~mask
+            Values.append(old)
+        if any(value is not None for _, _, value in Operations):
+            self._data[name] = bytes(Bitmap)
+        return Values
+
+
+    @_command
+    def hset(self, name: str, mapping: Dict[str, str]) -> int:
+        Hash = self._members(name)
+        added = len([key for key in mapping if key not in Hash])
+        Hash.update({key: self._encode(value) for key, value in mapping.items()})
+        return added
+
+
+    @_command
+    def hget(self, name: str, key: str) -> Optional[bytes]:
+        return self._data[name].get(key) if self._alive(name) else None
+
+
+    @_command
+    def hsetnx(self, name: str, key: str, value) -> int:
+        Hash = self._members(name)
+        if key in Hash:
+            return 0
+        Hash[key] = self._encode(value)
+        return 1
+
+
+    @_command
+    def hgetall(self, name: str) -> Dict[bytes, bytes]:
+        if not self._alive(name):
+            return {}
+        return {key.encode('utf-8'): value for key, value in self._data[name].items()}
+
+
+    @_command
+    def hdel(self, name: str, *keys: str) -> int:
+        return self._remove_members(name, *keys)
+
+
+    @_command
+    def hincrby(self, name: str, key: str, amount: int = 1) -> int:
+        Hash = self._members(name)
+        value = int(Hash.get(key, 0)) + amount
+        Hash[key] = self._encode(value)
+        return value
+
+
+    @_command
+    def hlen(self, name: str) -> int:
+        return len(self._data[name]) if self._alive(name) else 0
+
+
+    @_command
+    def rename(self, src: str, dst: str) -> bool:
+        if not self._alive(src):
+            raise KeyError(src)   #Redis answers "no such key"
+        self._forget_ttl(dst)
+        self._data[dst] = self._data.pop(src)
+        deadline = self._deadlines.get(src)
+        self._forget_ttl(src)
+        if deadline is not None:
+            self._set_ttl(dst, deadline - time.monotonic())
+        return True
+
+
+    @_command
+    def close(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+
+
+
+class MemoryBitField():
+
+    """BITFIELD of MemoryCache with the builder of aioredis: the unsigned fields (u1, u8, ...) are read with get
+    and written with set, execute runs them at once and returns the old values"""
+
+    def __init__(self, cache: MemoryCache, name: str):
+        self.cache = cache
+        self.name = name
+        self.Operations = []
+
+    @staticmethod
+    def _width(fmt: str) -> int:
+        if not fmt.startswith('u'):
+            raise ValueError(fmt)   #the signed fields are not used by the app
+        return int(fmt[1:])
+
+    def get(self, fmt: str, offset: int) -> 'MemoryBitField':
+        self.Operations.append((self._width(fmt), offset, None))
+        return self
+
+    def set(self, fmt: str, offset: int, value: int) -> 'MemoryBitField':
+        self.Operations.append((self._width(fmt), offset, value))
+        return self
+
+    def execute(self) -> asyncio.Future:
+        Operations, self.Operations = self.Operations, []
+        return self.cache._bitfield(self.name, Operations)
+
+
+
+class SeenTests():
+
+    """The questions seen by one user, a bitmap in the cache for every level (key is the key template of the level).
+    The bit number ID - base is 1 when the question ID was seen, base is the first ID of the level (level_base).
+    The IDs of a level are one range, so a bitmap takes about the number of the questions of the level / 8 bytes.
+    Only the bits of the asked IDs are read, with one BITFIELD.
+    BatchIDs and batch_seen are the result of the last check of a cached batch: all its IDs
+    and whether the user saw every test left in it"""
+
+    def __init__(self, redis: CacheBackend = None, key: str = None,
+                 level_base: Callable[[str], Awaitable[int]] = None):
+        self.redis = redis
+        self.key = key
+        self.level_base = level_base
+        self.BatchIDs = set()
+        self.batch_seen = False
+
+    async def among(self, level: str, IDs: List[int]) -> set:
+
+        """the IDs of the level which the user saw"""
+
+        if self.redis is None or not IDs:
+            return set()
+        base = await self.level_base(level)
+        Checked = [test_id for test_id in IDs if test_id >= base]   #the IDs added under the base are not kept
+        if not Checked:
+            return set()
+        Bits = self.redis.bitfield(self.key.format(level))
+        for test_id in Checked:
+            Bits.get('u1', test_id - base)
+        return {test_id for test_id, bit in zip(Checked, await Bits.execute()) if bit}
+
+
+
+class GuardedCache():
+
+    """A cache backend behind a circuit breaker (see breakers.py): every command has a timeout,
+    and breaker.call raises DependencyUnavailable when the backend fails or its circuit is open"""
+
+    def __init__(self, redis: CacheBackend, breaker):
+        self.redis = redis
+        self.breaker = breaker
+
+
+    def bitfield(self, name: str):
+
+        """the BITFIELD builder of the backend, only its execute goes to the backend and through the breaker"""
+
+        operation = self.redis.bitfield(name)
+        operation.execute = functools.partial(self.breaker.call, operation.execute)
+        return operation
+
+
+    def __getattr__(self, name: str):
+        command = getattr(self.redis, name)
+
+        async def guarded(*args, **kwargs):
+            return await self.breaker.call(command, *args, **kwargs)
+        return guarded
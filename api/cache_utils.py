@@ -2,15 +2,25 @@
 
 from config import settings
 from typing import List, Union
-from schemas import CachedTests
+from schemas import CachedTests, Levels
+from const import TxtData
 from models import Questions, get_async_session
 from quart import Quart
-from sqlalchemy import update
+from sqlalchemy import update, select, func, bindparam, or_
 import aioredis
 import json
 import asyncio
-from datetime import datetime
+import logging
+import time
+import math
+from uuid import uuid4
+from datetime import datetime, timezone
 from handlers import global_error_handler_async, global_error_handler_sync
+from content_store import ContentStore, add_content
+from cache_backends import CacheBackend, MemoryCache, SeenTests
+from breakers import db_breaker, DependencyUnavailable
+from admission import db_limiter
+from show_events import write_show_events
 
 
 
@@ -35,10 +45,14 @@ CachedList = [{
 ...]
 """
 @global_error_handler_sync
-def initcache() -> aioredis.Redis:
+def initcache() -> CacheBackend:
 
-    """init cache for the app"""
+    """init cache for the app. settings.CACHE_TYPE selects the backend"""
 
+    if settings.CACHE_TYPE == 'memory':
+        return MemoryCache()
+    if settings.CACHE_TYPE != 'redis':
+        raise ValueError(TxtData.WrongCacheTypeError.format(settings.CACHE_TYPE))
 
     redis_async = aioredis.from_url(
         f'redis://{settings.CACHE_REDIS_HOST}:{settings.CACHE_REDIS_PORT}/{settings.CACHE_REDIS_DB}'
@@ -46,52 +60,139 @@ def initcache() -> aioredis.Redis:
     return redis_async
 
 
+def key_level(key: str) -> Union[str, None]:
+
+    """the level of a batch key (a level or a level with a tag like B1:past-tenses), None for the service keys"""
+
+    level = key.split(':', 1)[0]
+    return level if level in Levels._value2member_map_ else None
+
+
+async def cached_batch_keys(redis: CacheBackend) -> List[str]:
+
+    """the batch keys (of the levels and of the tags) which are in the cache now.
+    Service keys (like the workers registry) are skipped"""
+
+    keys = await redis.keys('*')    
+    decoded_keys = [key.decode('utf-8') for key in keys]  
+                        #originally keys are bytes like [b'key1', b'key2', b'key3']
+    return [k for k in decoded_keys if key_level(k)]
+
+
     
 class EngCache():
 
     """The class for cache processing"""
 
-    def __init__(self, redis):
+    def __init__(self, redis: CacheBackend, content_store: ContentStore = None, number_of_tests: int = None):
         self.redis = redis
+        self.content_store = content_store   #when it is set, the cache keeps only IDs and the state of the tests
+        self.number_of_tests = number_of_tests   #the batch size of a refill, settings.NUMBER_OF_TESTS if None
+        self.StaleTests = {}   #the last finished batch of every level, it is served again while the db is unavailable
+        self.StaleIndex = {}
+        self.RefillLocks = {}
+        self.LevelStats = {}   #{level: {"shown", "refilled_at", "rate", "size", "refills"}} of this worker
+        self.LevelBases = {}   #the base of the seen bitmaps of every level, it never changes
 
-    @global_error_handler_async
-    async def set_key_with_ttl(self, key: str):
+    @staticmethod
+    def batch_key(level, tag: str = None) -> str:
+
+        """the cache key of the rotation batch of the level, every tag of a level has its own batch"""
+
+        return TxtData.TagBatchKey.format(level, tag) if tag else level
+
+
+    @staticmethod
+    def lookahead_key(key) -> str:
+
+        """the cache key of the look-ahead batch of a batch key, it is written back like the batch"""
+
+        return TxtData.LookaheadKey.format(key)
+
+
+    def refill_lock(self, level) -> asyncio.Lock:
+        return self.RefillLocks.setdefault(level, asyncio.Lock())
+
+
+    def next_batch_size(self, level) -> int:
+
+        """The size of the next batch of the level. The rate (tests shown per second) is measured between two refills
+        and averaged, and the batch should be used up in settings.BATCH_TTL_SHARE of the cache ttl: busy levels
+        get big batches and refill less often, rare levels get small ones and write back less unshown tests.
+        A worker sees only its share of the requests, so the rate is multiplied by the number of workers"""
+
+        if self.number_of_tests:
+            return self.number_of_tests
+        now = time.monotonic()
+        Stats = self.LevelStats.get(level)
+        rate, size, refills = None, settings.NUMBER_OF_TESTS, 0
+        if Stats is not None:   #the first batch of a level has the configured size
+            elapsed = max(now - Stats["refilled_at"], 1)
+            new_rate = Stats["shown"] * settings.SERVER_WORKERS / elapsed
+            rate = new_rate if Stats["rate"] is None else (settings.BATCH_RATE_SMOOTHING * new_rate
+                                                           + (1 - settings.BATCH_RATE_SMOOTHING) * Stats["rate"])
+            refills = Stats["refills"]
+            if settings.BATCH_ADAPTIVE:
+                size = math.ceil(rate * settings.CACHE_DEFAULT_TIMEOUT * settings.BATCH_TTL_SHARE)
+                size = min(max(size, settings.BATCH_MIN_TESTS), settings.BATCH_MAX_TESTS)
+        self.LevelStats[level] = {"shown": 0, "refilled_at": now, "rate": rate, "size": size, "refills": refills + 1}
+        return size
 
-        """init expiration time for our keys"""
 
-        await self.redis.expire(key, settings.CACHE_DEFAULT_TIMEOUT)
-        
     @global_error_handler_async
     async def addtocache(self, Tests_list: List[dict], level):
 
-        """adding data from database to cache"""
+        """adding data from database to cache.
+        The batch is serialized once and written with its ttl by one SET, so the readers
+        never see a part of the batch or a level key without the expiration time"""
+
         ToCache = []
         for k in Tests_list:
             newcachedtest = CachedTests(**k)  #we use pydantic in order to avoide text in code
             if newcachedtest.datetime_shown != None:
                 newcachedtest.datetime_shown = newcachedtest.datetime_shown.isoformat()  #from datetime to string because otherwise json.dumps(To Cache) will not work
             ToCache.append(newcachedtest.model_dump())
-            await self.redis.set(level, json.dumps(ToCache))
-            await self.set_key_with_ttl(level)
+        await self.redis.set(level, json.dumps(ToCache), ex=settings.CACHE_DEFAULT_TIMEOUT)
 
 
     @global_error_handler_async
-    async def get_cached_test(self, level) -> Union[dict, None]:
+    async def get_cached_test(self, level, Seen: SeenTests = None) -> Union[dict, None]:
 
-        """retrieving data from cache"""
+        """retrieving data from cache.
+        With Seen (the questions seen by the user) the tests which the user saw are skipped, only their bits are read.
+        When the user saw every test left in the batch, None is returned and Seen.batch_seen is set:
+        the batch is shared by all the users, so it is not refilled for one of them"""
 
+        if Seen:
+            Seen.batch_seen = False
         GottenData = await self.redis.get(level)
         if GottenData:
             CachedList = json.loads(GottenData)
             Cached_Models = [CachedTests(**onetest) for onetest in CachedList]
             Filtered_Models = [m for m in Cached_Models if not m.shown] #just that tests which were not shown
-            if Filtered_Models:
-                return Filtered_Models[0].model_dump()
-            
-            else:    #the case when all tests in cache were already shown
+            if Seen and Filtered_Models:
+                SeenIDs = await Seen.among(key_level(level), [m.ID for m in Filtered_Models])
+                Seen.BatchIDs = {m.ID for m in Cached_Models}
+                Filtered_Models = [m for m in Filtered_Models if m.ID not in SeenIDs]
+                if not Filtered_Models:
+                    Seen.batch_seen = True
+                    return None
+            for m in Filtered_Models:
+                if not self.content_store:
+                    return m.model_dump()
+                OneTest = await add_content(self.content_store, m.model_dump())
+                if OneTest:   #None if the test was deleted from the db
+                    return OneTest
+
+            if not Filtered_Models:    #the case when all tests in cache were already shown
                 
-                await send_cach_to_db(CachedList) #save data to db
-                await self.redis.delete(level)  #clear cache
+                self.StaleTests[level] = CachedList
+                await self.redis.delete(level)  #clear cache first, so a new batch written meanwhile by another request stays
+                try:
+                    await send_cach_to_db(CachedList) #save data to db
+                except DependencyUnavailable:
+                    await self.redis.set(level, GottenData, nx=True, ex=settings.CACHE_DEFAULT_TIMEOUT)
+                    raise   #the batch is back in the cache, so it is saved later
                 return None
         else:
             return None
@@ -99,51 +200,309 @@ class EngCache():
         
 
     @global_error_handler_async
+    async def flush_batch(self, key):
+
+        """the batch is written back to the db and removed from the cache"""
+
+        GottenData = await self.redis.get(key)
+        if not GottenData:
+            return
+        await self.redis.delete(key)
+        try:
+            await send_cach_to_db(json.loads(GottenData))
+        except DependencyUnavailable:
+            await self.redis.set(key, GottenData, nx=True, ex=settings.CACHE_DEFAULT_TIMEOUT)
+            raise   #the batch is back in the cache, so it is saved later
+
+
+    @global_error_handler_async
+    async def find_cached_test(self, level, test_id) -> Union[dict, None]:
+
+        """the test with the ID from the cached batch of the level, None when it is not there"""
+
+        GottenData = await self.redis.get(level)
+        if GottenData:
+            for onetest in json.loads(GottenData):
+                if onetest["ID"] == test_id:
+                    return await add_content(self.content_store, onetest) if self.content_store else onetest
+        return None
+
+
+    async def get_stale_test(self, level) -> Union[dict, None]:
+
+        """an already shown test of the last finished batch of the level, one after another"""
+
+        StaleList = self.StaleTests.get(level)
+        if not StaleList:
+            return None
+        i = self.StaleIndex.get(level, 0) % len(StaleList)
+        self.StaleIndex[level] = i + 1
+        OneTest = CachedTests(**StaleList[i]).model_dump()
+        if self.content_store:
+            return await add_content(self.content_store, OneTest)
+        return OneTest
+
+
     async def update_cached_tests(self, level, test_id, datetime_shown) -> bool:
 
         """updating Shown checkmark and datetime_shown in the cache"""
 
+        return bool(await self.update_cached_batch(level, {test_id: datetime_shown}))
+
+
+    @global_error_handler_async
+    async def update_cached_batch(self, level, Shown: dict) -> int:
+
+        """updating Shown checkmark and datetime_shown of several tests ({ID: datetime_shown}) with one read
+        and one write of the cached batch. Returns the number of the tests found in the cache"""
+
         GottenData = await self.redis.get(level)
-        if GottenData:
-            CachedList = json.loads(GottenData)
-            i = 0
-            for i, onetest in enumerate(CachedList):
+        if not GottenData:
+            return 0
+        CachedList = json.loads(GottenData)
+        updated = 0
+        for i, onetest in enumerate(CachedList):
+            if onetest["ID"] in Shown:   #Find the tests with the required IDs
                 testclass = CachedTests(**onetest)
-                if testclass.ID == test_id:   #Find the test with the required ID
-                    testclass.datetime_shown = datetime_shown
-                    testclass.shown = True
-                    CachedList[i] = testclass.model_dump()
-                    await self.redis.set(level, json.dumps(CachedList))
-                    return True, ''
-                i += 1
-        return False
-        
+                testclass.datetime_shown = Shown[testclass.ID]
+                testclass.shown = True
+                CachedList[i] = testclass.model_dump()
+                updated += 1
+        if updated:
+            await self.redis.set(level, json.dumps(CachedList))
+            if level in self.LevelStats:
+                self.LevelStats[level]["shown"] += updated
+        return updated
+
+
+    def seen_tests(self, user: str) -> SeenTests:
+
+        """the questions seen by the user, the bits are read when a batch is checked"""
+
+        return SeenTests(self.redis, TxtData.SeenKey.format(user, '{}'), self.level_base)
+
+
+    @global_error_handler_async
+    async def level_base(self, level) -> int:
+
+        """The base of the seen bitmaps of the level: its first ID. The first worker which needs it reads it
+        from the db and writes it to the cache without an expiration time, the others take it from there,
+        so all the workers use the same bits. The IDs imported later under the base are not kept in the bitmaps"""
+
+        base = self.LevelBases.get(level)
+        if base is None:
+            GottenData = await self.redis.hget(TxtData.SeenBaseKey, level)
+            if GottenData is None:
+                await self.redis.hsetnx(TxtData.SeenBaseKey, level, await _level_first_id(level) or 0)
+                GottenData = await self.redis.hget(TxtData.SeenBaseKey, level)
+            base = self.LevelBases[level] = int(GottenData)
+        return base
+
+
+    @global_error_handler_async
+    async def mark_seen(self, user: str, level, *test_ids: int):
+
+        """the questions are marked in the bitmap of the user and of the level with one BITFIELD. The bitmap
+        expires settings.SEEN_TTL seconds after the last update, so only the active users take memory"""
+
+        base = await self.level_base(level)
+        key = TxtData.SeenKey.format(user, level)
+        Bits = self.redis.bitfield(key)
+        for test_id in test_ids:
+            if test_id >= base:
+                Bits.set('u1', test_id - base, 1)
+        await Bits.execute()
+        await self.redis.expire(key, settings.SEEN_TTL)
+
+
+    async def get_test_content(self, test_id: int) -> Union[dict, None]:
+
+        """The content of the test for the route by ID, None when it is not cached.
+        With the content store it is read from the store, otherwise from the key of the test"""
+
+        if self.content_store:
+            await self.content_store.ensure_current(self.redis)
+            Content = self.content_store.get(test_id)
+            return {"ID": test_id, **Content} if Content else None
+        GottenData = await self.redis.get(TxtData.TestContentKey.format(test_id))
+        return json.loads(GottenData) if GottenData else None
+
+
+    @global_error_handler_async
+    async def set_test_content(self, OneTest: dict):
+
+        """the content read from the db is kept for settings.TEST_CONTENT_TTL seconds, the importer deletes
+        the keys of the tests it changes. The content store is rebuilt by the importer itself"""
+
+        if not self.content_store:
+            await self.redis.set(TxtData.TestContentKey.format(OneTest["ID"]), json.dumps(OneTest),
+                                 ex=settings.TEST_CONTENT_TTL)
+
+
+    @global_error_handler_async
+    async def refresh_cached_tests(self, level, Tests: dict) -> int:
+
+        """replacing the content of cached tests which were changed in the db. level is a batch key.
+        Tests is a dict {ID: ImportedTests dict}. Shown checkmark and datetime_shown stay as they are.
+        A test which was moved to another level is removed from the cache of this level"""
+
+        GottenData = await self.redis.get(level)
+        if not GottenData:
+            return 0
+        CachedList = json.loads(GottenData)
+        NewList = []
+        MovedList = []
+        refreshed = 0
+        for onetest in CachedList:
+            newtest = Tests.get(onetest["ID"])
+            if newtest is None:
+                NewList.append(onetest)
+            elif newtest["Level"] != key_level(level):
+                MovedList.append(onetest)
+                refreshed += 1
+            else:
+                testclass = CachedTests(**onetest)
+                testclass.Question = newtest["Question"]
+                testclass.Options = newtest["Options"]
+                testclass.correct_option_id = newtest["correct_option_id"]
+                testclass.explanation = newtest["explanation"]
+                NewList.append(testclass.model_dump())
+                refreshed += 1
+
+        if refreshed:
+            if MovedList:
+                await send_cach_to_db(MovedList)  #keep datetime_shown of the moved tests
+            await self.redis.set(level, json.dumps(NewList), keepttl=True)
+        return refreshed
+
     
 class CacheListener():
 
     """"The cache listener in order to make necessary operations with cache before it cleared automatically"""
 
-    def __init__(self, redis, app: Quart):
+    def __init__(self, redis: CacheBackend, app: Quart, fallback_redis: MemoryCache = None):
         self.redis = redis
         self.app = app
+        self.fallback_redis = fallback_redis   #the in-process batches which are used while Redis is unavailable
         self.ActiveListener = True
+        self.WorkerID = None   #is set when the app works in one of several server processes
+        for backend in (redis, fallback_redis):
+            if hasattr(backend, 'set_expiry_callback'):
+                backend.set_expiry_callback(self.on_key_expired)
+                #the in-process cache tells us about every expired key, so nothing is lost between the checks
+
+
+    @global_error_handler_async
+    async def on_key_expired(self, key: str, GottenData: bytes):
+
+        """the write-back of an expired batch key of the in-process cache"""
+
+        if key_level(key):
+            CachedList = json.loads(GottenData)
+            await send_cach_to_db(CachedList)
         
+
+    async def cached_levels(self, redis: CacheBackend = None) -> List[str]:
+
+        """the batch keys which are in the cache now"""
+
+        return await cached_batch_keys(redis or self.redis)
+
+
+    @global_error_handler_async
+    async def register_worker(self):
+
+        """The worker process announces itself in the workers registry (a sorted set: worker id -> last heartbeat).
+        The workers share the cache, so it should be saved to the db only when the last worker stops"""
+
+        self.WorkerID = uuid4().hex
+        await self.heartbeat()
+
+
+    async def heartbeat(self):
+        await self.redis.zadd(TxtData.WorkersKey, {self.WorkerID: time.time()})
+
+
+    @global_error_handler_async
+    async def unregister_worker(self) -> bool:
+
+        """The worker leaves the registry. Returns True when there are no other live workers,
+        so this worker is responsible for saving the cache. The workers which did not send
+        a heartbeat for settings.SERVER_WORKER_HEARTBEAT_TIMEOUT seconds are considered dead"""
+
+        await self.redis.zrem(TxtData.WorkersKey, self.WorkerID)
+        await self.redis.zremrangebyscore(TxtData.WorkersKey, 0, time.time() - settings.SERVER_WORKER_HEARTBEAT_TIMEOUT)
+        self.WorkerID = None
+        return await self.redis.zcard(TxtData.WorkersKey) == 0
+
         
     @global_error_handler_async
     async def on_stop_app(self):
 
         """It works when the app was stopped manually (like Ctrl+C in terminal)
-        We should write the new datetime_shown to the database and after that clear cache"""
-        
-        keys = await self.redis.keys('*')    
-        decoded_keys = [key.decode('utf-8') for key in keys]  
-                            #originally keys are bytes like [b'key1', b'key2', b'key3']
-        for k in decoded_keys:
-            GottenData = await self.redis.get(k)
-            if GottenData:
-                CachedList = json.loads(GottenData)
-                await send_cach_to_db(CachedList)
-            await self.redis.delete(k)
+        We should write the new datetime_shown to the database and after that clear cache.
+        settings.SHUTDOWN_FLUSH_CONCURRENCY levels are saved at once. The levels which are not saved
+        in settings.SHUTDOWN_FLUSH_TIMEOUT seconds are checkpointed, the next worker saves them"""
+
+        Batches = {}
+        for redis in (self.redis, self.fallback_redis):
+            if redis is None:
+                continue
+            for k in await self.cached_levels(redis):
+                GottenData = await redis.get(k)
+                if GottenData:
+                    Batches[f"{k}:{uuid4().hex}"] = json.loads(GottenData)
+                await redis.delete(k)
+        if not Batches:
+            return
+
+        semaphore = asyncio.Semaphore(settings.SHUTDOWN_FLUSH_CONCURRENCY)
+        async def flush(CachedList):
+            async with semaphore:
+                return await send_cach_to_db(CachedList)
+
+        Tasks = {asyncio.create_task(flush(CachedList)): field for field, CachedList in Batches.items()}
+        done, pending = await asyncio.wait(Tasks, timeout=settings.SHUTDOWN_FLUSH_TIMEOUT)
+        for task in pending:
+            task.cancel()   #the transaction is rolled back, the checkpoint has the same tests
+        await asyncio.gather(*pending, return_exceptions=True)
+        Leftovers = {Tasks[task]: Batches[Tasks[task]] for task in Tasks
+                     if task in pending or task.exception() is not None}   #send_cach_to_db raised, it logged the error
+        if Leftovers:
+            await self.checkpoint(Leftovers)
+
+
+    async def checkpoint(self, Leftovers: dict):
+
+        """the shown tests of the unsaved levels are kept in Redis without an expiration time"""
+
+        Checkpoint = {field: json.dumps(ShownList) for field, CachedList in Leftovers.items()
+                      if (ShownList := [t for t in CachedList if t.get("shown")])}
+        if not Checkpoint:
+            return
+        await self.redis.hset(TxtData.FlushCheckpointKey, mapping=Checkpoint)
+        logging.warning(TxtData.FlushCheckpointed.format(len(Checkpoint),
+                                                          sum(len(json.loads(v)) for v in Checkpoint.values())))
+
+
+    @global_error_handler_async
+    async def recover_checkpoint(self):
+
+        """the background task of a starting worker: the write-backs checkpointed by a stopped worker are saved.
+        A write-back is removed from the checkpoint only after it is saved. Two workers may save
+        the same one, it is harmless because an older datetime_shown is not written over a newer one"""
+
+        Checkpoint = await self.redis.hgetall(TxtData.FlushCheckpointKey)
+        Saved = []
+        for field, GottenData in Checkpoint.items():
+            try:
+                await send_cach_to_db(json.loads(GottenData))
+            except Exception:   #logged by send_cach_to_db, the write-back stays in the checkpoint
+                continue
+            Saved.append(field.decode('utf-8'))
+        if Saved:
+            await self.redis.hdel(TxtData.FlushCheckpointKey, *Saved)
+            logging.warning(TxtData.FlushCheckpointRecovered.format(len(Saved)))
 
 
     @global_error_handler_async
@@ -154,22 +513,31 @@ class CacheListener():
 
         i = 0
         while self.ActiveListener:
+            if getattr(self.app, 'shutdown_event', None) and self.app.shutdown_event.is_set():
+                break   #the server stops. Quart waits for background tasks before after_serving runs
             #settings.CACHE_DEFAULT_TIMEOUT - the expiration time in sec
             #settings.CACHE_CHECK_TIMEOUT - the interval after which we check the cache
-            if i >= settings.CACHE_DEFAULT_TIMEOUT/settings.CACHE_CHECK_TIMEOUT:
-                i = 0
-                
-                keys = await self.redis.keys('*')
-                decoded_keys = [key.decode('utf-8') for key in keys]
-                for k in decoded_keys:
-                    ttl = await self.redis.ttl(k)  #ttl seconds left before the key will be deleted
-                    if ttl <= settings.CACHE_CHECK_TIMEOUT:  
-                        GottenData = await self.redis.get(k)
-                        
-                        if GottenData:
-                            CachedList = json.loads(GottenData)
-                            await send_cach_to_db(CachedList)
-                            await self.redis.delete(k)
+            try:
+                if self.WorkerID:
+                    await self.heartbeat()
+                if i >= settings.CACHE_DEFAULT_TIMEOUT/settings.CACHE_CHECK_TIMEOUT:
+                    i = 0
+                    if self.WorkerID and not await self.redis.set(TxtData.ListenerLockKey, self.WorkerID, 
+                                                                  nx=True, ex=settings.CACHE_CHECK_TIMEOUT):
+                        await asyncio.sleep(1)
+                        continue   #another worker checks the cache this time
+                    
+                    for k in await self.cached_levels():
+                        ttl = await self.redis.ttl(k)  #ttl seconds left before the key will be deleted
+                        if ttl <= settings.CACHE_CHECK_TIMEOUT:  
+                            GottenData = await self.redis.get(k)
+                            
+                            if GottenData:
+                                CachedList = json.loads(GottenData)
+                                await send_cach_to_db(CachedList)
+                                await self.redis.delete(k)
+            except Exception as e:   #Redis or the db is unavailable, the listener tries again with the next check
+                logging.warning(TxtData.ListenerIterationError.format(repr(e)))
             i += 1                 
             await asyncio.sleep(1)
 
@@ -188,18 +556,75 @@ class CacheListener():
 
 
 @global_error_handler_async
-async def send_cach_to_db(Tests_List):
+async def send_cach_to_db(Tests_List) -> dict:
+
+    """the function for sending the new datetime_shown to the database.
+    Only the tests shown while they were cached (shown = True) are written, every test once with its
+    latest datetime_shown. Returns the write volume of the flush"""
+
+    DirtyTests = {}
+    for k in Tests_List:
+        onetest = CachedTests(**k)
+        if not onetest.shown or onetest.datetime_shown is None:
+            continue   #the db already has this datetime_shown
+        date_time_in_format = _to_db_datetime(onetest.datetime_shown)
+        if onetest.ID not in DirtyTests or DirtyTests[onetest.ID] < date_time_in_format:
+            DirtyTests[onetest.ID] = date_time_in_format
+    FlushStats = {"cached": len(Tests_List), "dirty": len(DirtyTests), "written": 0}
+    if DirtyTests:
+        async with db_limiter.slot():   #waits without a budget, the new datetime_shown must not be lost
+            FlushStats["written"] = await _write_tests(DirtyTests)
+    logging.info(TxtData.WriteBackReport.format(FlushStats["cached"], FlushStats["dirty"], FlushStats["written"],
+                                                FlushStats["dirty"] - FlushStats["written"]))
+    return FlushStats
+
 
-    """the function for sending the new datetime_shown to the database"""
 
+def _to_db_datetime(datetime_shown: Union[str, datetime]) -> datetime:
+
+    """datetime_shown as the naive UTC datetime, so the values of all the clients can be compared in the db"""
+
+    if isinstance(datetime_shown, str):
+        datetime_shown = datetime.fromisoformat(datetime_shown)
+    if datetime_shown.tzinfo is not None:
+        datetime_shown = datetime_shown.astimezone(timezone.utc).replace(tzinfo=None)
+    return datetime_shown
+
+
+
+LevelFirstIDStmt = select(func.min(Questions.id)).where(Questions.level == bindparam("level"))
+
+
+
+@db_breaker.guard
+async def _level_first_id(level) -> Union[int, None]:
     async for session in get_async_session():
-        for k in Tests_List:       
-            onetest = CachedTests(**k)
-            date_time_in_format = None
-            if onetest.datetime_shown != None:
-                date_time_in_format = datetime.fromisoformat(onetest.datetime_shown)
-            statement = update(Questions).where(Questions.id == onetest.ID).values(datetime_shown = date_time_in_format)
-            await session.execute(statement)
-            await session.commit()
+        Result = await session.execute(LevelFirstIDStmt, {"level": level})
+    return Result.scalar()
 
 
+
+QuestionsTable = Questions.__table__   #the core table, the orm bulk update by id does not take the where
+WriteTestsStmt = (update(QuestionsTable)
+                  .where(QuestionsTable.c.id == bindparam('test_id'),
+                         or_(QuestionsTable.c.datetime_shown.is_(None),
+                             QuestionsTable.c.datetime_shown < bindparam('shown_at')))
+                  .values(datetime_shown=bindparam('shown_at')))
+
+
+
+@db_breaker.guard(timeout=settings.DB_WRITE_TIMEOUT)
+async def _write_tests(DirtyTests: dict) -> int:
+
+    """one executemany update for the flush. A row is written only if the new datetime_shown is newer than
+    the one in the db, so a stale flush of another worker can not overwrite it. Returns the written rows.
+    Every show is added to show_events after the update is committed, so the rows of questions are not
+    locked while the history is written. The timeout of the breaker does not include the wait for the slot"""
+
+    Rows = [{"test_id": test_id, "shown_at": shown_at} for test_id, shown_at in DirtyTests.items()]
+    async for session in get_async_session():
+        Result = await session.execute(WriteTestsStmt, Rows)
+        await session.commit()
+        await write_show_events(session, DirtyTests)
+        await session.commit()
+    return Result.rowcount
@@ -5,15 +5,32 @@ class TxtData():
     RoutesDescription = "Tests operations"
     GetTestRoute = '/gettests'
     UpdateTestRoute = '/updatestatus'
+    ExportRoute = '/export'
+    AnswerRoute = '/answer'
+    SearchRoute = '/search'
+    TestByIDRoute = '/tests/<int:test_id>'
+    SessionRoute = '/session'
+    SessionTest = 'test'   #the types of the messages of the session websocket
+    SessionResult = 'result'
+    SessionError = 'error'
+    SessionUnknownTest = "The test with ID = {} was not sent in this session"
+    SessionIDRequired = "ID is required for the message {}"
+    SearchFTSTable = 'questions_fts'   #the FTS5 table of the search on SQLite
+    NDJSONMimetype = 'application/x-ndjson'
     GeneralRoutePath = '/testroutes'
     DocRoutePath = '/docs'
     Level_name = "Level"
+    User_name = "User"
+    Tag_name = "Tag"
+    TagBatchKey = '{0}:{1}'   #the cache key of the batch of a tag in a level
+    LookaheadKey = '{0}:+next'   #the tests after the batch for the users who saw the batch, '+' is not allowed in a tag
     WrongLevelError = "Level should be one of the following: {}"
     LevelDescription = "English Level"
     NoTestsError = "There are no tests in the database"
     NoNewTestError = "A new test was not found in the database"
     SuccessfulUpdate = "Successful"
     NonSuccessfulUpdate = "The test with ID = {0} with the level {1} was not updated."
+    SeenNotMarked = "The tests with IDs = {0} were not marked as seen by the user {1}."
     CanNotConvertError = "Can not convert models: {}"
     GetTestsDescription = "This route retrieves 1 test from the database or cache"
     UpdateStatusDescription = "This route updates the datetime_shown value for the tests that were shown. If the ID is an integer but does not exist, a 200 status will still be returned."
@@ -23,8 +40,48 @@ class TxtData():
     NoneValueError = 'The value {} can not be None'
     ServerStopped = 'Server stopped by user'
     DictConvertError = "Error in to_dict function: Can not convert query to the dict"
+    LogSuppressed = "{0} more records like this were not logged: {1}"
+    LogQueueDropped = "{0} records were dropped, the log queue was full"
     ErrorArose = "Error arose in the function {0}, module {1}. The error: {2}"
     LoggerError = "Failed to log error: {0}. Logger error: {1}"
+    WrongCorrectOptionError = "correct_option_id {} is not one of the options"
+    ImportSkippedRecord = "Record {0} was skipped: {1}"
+    ImportProgress = "Committed {0} tests ({1} skipped), refreshed {2} cached tests"
+    ImportUnsupportedDialect = "The import supports MySQL and SQLite, not {}"
+    WrongCacheTypeError = "CACHE_TYPE should be 'redis' or 'memory', not {}"
+    WorkersKey = 'engram:workers'
+    ListenerLockKey = 'engram:listener_lock'
+    ContentVersionKey = 'engram:content_version'
+    TestContentKey = 'engram:test:{}'   #the content of one test for the route by ID
+    SeenKey = 'engram:seen:{0}:{1}'   #the bitmap of the questions of a level seen by a user, the bit of ID is ID - the base
+    SeenBaseKey = 'engram:seen_base'   #the base of the seen bitmaps of every level: the first ID of the level
+    AnswerStatsKey = 'engram:answer_stats'   #the answer counters, fields {ID}:attempts and {ID}:correct
+    AnswerStatsFlushingKey = 'engram:answer_stats:flushing'   #the counters which are being written to the db
+    AnswerStatsLockKey = 'engram:answer_stats_lock'
+    AttemptsField = '{}:attempts'
+    CorrectField = '{}:correct'
+    FlushCheckpointKey = 'engram:flush_checkpoint'   #the write-backs not finished on stop, field -> cached tests
+    ContentStoreFile = 'engram_content_{}.bin'
+    ContentStoreBroken = "The content store file {} is broken"
+    NoUvloopWarning = "uvloop is not installed, the asyncio event loop is used"
+    ProfileCpuRoute = '/admin/profile/cpu'
+    ProfileMemoryRoute = '/admin/profile/memory'
+    ProfilingKey = 'profiling:{}'
+    BreakersRoute = '/health/breakers'
+    BatchSizesRoute = '/health/batches'
+    RedisDependency = 'redis'
+    DBDependency = 'db'
+    DependencyUnavailable = "The dependency {0} is unavailable: {1}"
+    CircuitIsOpen = "the circuit is open"
+    BreakerStateChanged = "The circuit breaker of {0} changed its state from {1} to {2}"
+    ServedFromFallback = "{0} is unavailable, the test of the level {1} is served from the {2}"
+    ListenerIterationError = "The cache listener skipped the check of the cache: {}"
+    FlushCheckpointed = "The save of the cache on stop did not finish in time, {0} levels with {1} shown tests are kept in Redis"
+    FlushCheckpointRecovered = "{0} write-backs left by a stopped worker were saved to the db"
+    AnswerStatsReport = "The answer statistics of {0} questions were saved to the db"
+    ShowEventsPartition = 'p{:%Y%m}'   #the partition of show_events with the shows of the month
+    ShowEventsRotated = "show_events: added the partitions {0}, dropped the partitions {1}, deleted {2} rows"
+    WriteBackReport = "Write-back of {0} cached tests: {1} shown, {2} written, {3} skipped (the db has a newer datetime_shown)"
 
 
 
@@ -36,11 +93,23 @@ class BadRequestErrorInfo():
     ErrorText = "Bad Request"
     ErrorCode = 400
 
+class ConflictErrorInfo():
+    ErrorText = "Conflict"
+    ProfilerBusyText = "A profiling session is already running in this worker"
+    ErrorCode = 409
+
+class ServiceUnavailableErrorInfo():
+    ErrorText = "Service Unavailable"
+    DependencyText = "The service is temporarily unavailable, please retry later"
+    OverloadedText = "Too many requests are waiting for the database, please retry later"
+    ErrorCode = 503
+
 class NotFoundErrorInfo():
     ErrorText = "Not Found"
     LoggerDBError = "Unexpected Result from the database query: {0}. Level {1}"
     LoggerError = "The test was not found in either the cache or the database. Level {0}"
     NoTestsText = "There are no tests in the database"
+    NoTestText = "The test with this ID was not found"
     ErrorCode = 404
 
 
@@ -0,0 +1,169 @@
+"""The shared content store.
+The text of the tests (question, options, correct option, explanation) does not change between imports,
+so it is written once per content version into a file which every worker process maps into memory.
+The pages of the file are shared by all workers on the host, and the cache in Redis keeps only
+the IDs and the datetime_shown of the tests"""
+
+import os
+import json
+import mmap
+import time
+import asyncio
+import struct
+from array import array
+from bisect import bisect_left
+from typing import Union
+from config import settings
+from const import TxtData
+from routes import _iter_tests, _get_test
+from handlers import global_error_handler_async
+
+
+
+class ContentStore():
+
+    """The content of all tests in one read-only file:
+        header (magic, number of tests, index offset) | json of every test | IDs (int64) | offsets (int64, n + 1)
+    The IDs are sorted, so a test is found with a binary search without reading the other tests"""
+
+    Magic = b'ENGRAMCS'
+    Header = struct.Struct('<8sQQ')
+    ContentFields = {"Question", "Options", "correct_option_id", "explanation"}
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.version = None
+        self._file = None
+        self._mmap = None
+        self._ids = None
+        self._offsets = None
+
+
+    def path(self, version: str) -> str:
+        return os.path.join(self.directory, TxtData.ContentStoreFile.format(version))
+
+
+    @global_error_handler_async
+    async def ensure_current(self, redis):
+
+        """Switch to the current content version (the importer changes it).
+        The file of the version is built by the first worker which needs it, the others wait for it"""
+
+        version = await redis.get(TxtData.ContentVersionKey)
+        version = version.decode('utf-8') if version else '0'
+        if version == self.version:
+            return
+        path = self.path(version)
+        if not os.path.exists(path):
+            await self._build_once(path)
+        old_path = self.path(self.version) if self.version is not None else None
+        self._open(path, version)
+        if old_path:
+            try:
+                os.remove(old_path)   #other workers which still use it keep their mapping (not possible on Windows)
+            except OSError:
+                pass
+
+
+    def get(self, test_id: int) -> Union[dict, None]:
+
+        """the content of the test or None if the test is not in this version"""
+
+        if self._ids is None:
+            return None
+        i = bisect_left(self._ids, test_id)
+        if i == len(self._ids) or self._ids[i] != test_id:
+            return None
+        return json.loads(self._mmap[self._offsets[i]:self._offsets[i + 1]])
+
+
+    def close(self):
+        if self._mmap is not None:
+            self._ids.release()
+            self._offsets.release()
+            self._mmap.close()
+            self._file.close()
+        self._file = self._mmap = self._ids = self._offsets = None
+
+
+    def _open(self, path: str, version: str):
+        self.close()
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, index_offset = self.Header.unpack_from(self._mmap, 0)
+        if magic != self.Magic:
+            raise ValueError(TxtData.ContentStoreBroken.format(path))
+        View = memoryview(self._mmap)
+        self._ids = View[index_offset:index_offset + 8 * count].cast('q')   #no copy, the pages stay shared
+        self._offsets = View[index_offset + 8 * count:index_offset + 8 * (2 * count + 1)].cast('q')
+        View.release()
+        self.version = version
+
+
+    async def _build_once(self, path: str):
+
+        """only one worker on the host builds the file, a lock file marks that it is being built"""
+
+        lock_path = path + '.lock'
+        deadline = time.monotonic() + settings.CONTENT_STORE_BUILD_TIMEOUT
+        while True:
+            try:
+                os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                if os.path.exists(path):
+                    return
+                if time.monotonic() > deadline:   #the worker which was building it died
+                    os.remove(lock_path)
+                    deadline = time.monotonic() + settings.CONTENT_STORE_BUILD_TIMEOUT
+                await asyncio.sleep(0.2)
+        try:
+            if not os.path.exists(path):
+                await build_content_file(path)
+        finally:
+            os.remove(lock_path)
+
+
+
+async def build_content_file(path: str):
+
+    """Write the content of all tests from the db to the file (to a temporary one first, so readers never see a half-written file)"""
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    Ids = array('q')
+    Offsets = array('q')
+    with open(tmp_path, 'wb') as f:
+        f.write(ContentStore.Header.pack(ContentStore.Magic, 0, 0))
+        offset = ContentStore.Header.size
+        async for onetest in _iter_tests():
+            payload = onetest.model_dump_json(include=ContentStore.ContentFields).encode('utf-8')
+            Ids.append(onetest.ID)
+            Offsets.append(offset)
+            f.write(payload)
+            offset += len(payload)
+        Offsets.append(offset)
+        index_offset = offset + (-offset % 8)   #the index is aligned for the int64 view
+        f.write(b'\0' * (index_offset - offset))
+        f.write(Ids.tobytes())
+        f.write(Offsets.tobytes())
+        f.seek(0)
+        f.write(ContentStore.Header.pack(ContentStore.Magic, len(Ids), index_offset))
+    os.replace(tmp_path, path)
+
+
+
+async def add_content(content_store: ContentStore, onetest: dict) -> Union[dict, None]:
+
+    """Add the content to a test from the cache which has only the ID and the state.
+    A test which is newer than the content version is read from the db"""
+
+    if onetest["Question"] is not None:   #the content was refreshed in the cache after an import
+        return onetest
+    Content = content_store.get(onetest["ID"])
+    if Content is None:
+        Content = await _get_test(onetest["ID"])
+        if Content is None:
+            return None
+    for field in ContentStore.ContentFields:
+        onetest[field] = Content[field]
+    return onetest
@@ -1,8 +1,10 @@
 import logging
-from const import TxtData, NotFoundErrorInfo, InternalErrorInfo, BadRequestErrorInfo, NotFoundErrorInfo
+from const import TxtData, NotFoundErrorInfo, InternalErrorInfo, BadRequestErrorInfo, NotFoundErrorInfo, ConflictErrorInfo, ServiceUnavailableErrorInfo
+from config import settings
 from werkzeug.exceptions import HTTPException
 import functools
 from schemas import Message, Levels
+from log_queue import log_event
 
 def global_error_handler_async(func):
 
@@ -39,7 +41,8 @@ def log_raise_error(exception, func):
         function_name = func.__name__ 
         error_text = TxtData.ErrorArose.format(function_name, module_name, str(exception))
         try:
-            logging.error(error_text)
+            log_event(logging.ERROR, error_text, event=f"{module_name}.{function_name}:{type(exception).__name__}",
+                      function=function_name, module=module_name, error=type(exception).__name__)
 
         except Exception as e:  #if smth happend with the logger
             print(TxtData.LoggerError.format(error_text, str(e)))
@@ -59,6 +62,14 @@ class NoTestsError(HTTPException):
     description = NotFoundErrorInfo.NoTestsText 
 
 
+class TestNotFoundError(HTTPException):
+
+    """404 error for the case when the test with the ID is neither in the cache nor in the db"""
+
+    code = NotFoundErrorInfo.ErrorCode
+    description = NotFoundErrorInfo.NoTestText
+
+
 class WrongLevelError(HTTPException):
 
     """400 error for the case when wrong level"""
@@ -67,6 +78,21 @@ class WrongLevelError(HTTPException):
     description = BadRequestErrorInfo.ErrorText
 
 
+class OverloadedError(HTTPException):
+
+    """503 error for the case when a refill waited for the database longer than its budget"""
+
+    code = ServiceUnavailableErrorInfo.ErrorCode
+    description = ServiceUnavailableErrorInfo.OverloadedText
+
+
+class ProfilerBusyError(HTTPException):
+
+    """409 error for the case when a profiling session is already running"""
+
+    code = ConflictErrorInfo.ErrorCode
+    description = ConflictErrorInfo.ProfilerBusyText
+
     
 
 
@@ -109,6 +135,39 @@ async def handle_no_tests_error(error):
 
 
 
+async def handle_test_not_found_error(error):
+
+    """404. We detail the error that arises when the answered test does not exist"""
+
+    return Message(message=NotFoundErrorInfo.NoTestText), NotFoundErrorInfo.ErrorCode
+
+
+
+async def handle_profiler_busy_error(error):
+
+    """409. We detail the error that arises when a profiling session is already running"""
+
+    return Message(message=ConflictErrorInfo.ProfilerBusyText), ConflictErrorInfo.ErrorCode
+
+
+
+async def handle_dependency_unavailable_error(error):
+
+    """503. Redis or the db is unavailable and there is no fallback for the request"""
+
+    return Message(message=ServiceUnavailableErrorInfo.DependencyText), ServiceUnavailableErrorInfo.ErrorCode
+
+
+
+async def handle_overloaded_error(error):
+
+    """503. The request was shed, the client is told when to retry"""
+
+    return (Message(message=ServiceUnavailableErrorInfo.OverloadedText), ServiceUnavailableErrorInfo.ErrorCode,
+            {"Retry-After": str(settings.ADMISSION_RETRY_AFTER)})
+
+
+
 async def handle_internal_error(error):
 
     """500. We change the format of 500 error"""
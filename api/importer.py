@@ -0,0 +1,245 @@
+"""Streaming import of tests from JSONL or CSV files.
+
+Every record is validated with the ImportedTests model (GettedTests + Level) and the records are
+inserted chunk by chunk, one transaction per chunk, so memory does not depend on the file size.
+With --upsert the questions and options which already exist (the same question ID) are updated.
+After every committed chunk the affected tests in the cache are refreshed, so no restart or cache flush is needed.
+
+JSONL: one test per line, like the response of gettests plus "Level" and optional "Tags":
+    {"ID": 1, "Level": "B1", "Question": "...", "Options": [{"option_id": 1, "option_text": "..."}],
+     "correct_option_id": 1, "explanation": "...", "Tags": ["past-tenses"]}
+CSV: the columns ID, Level, Question, correct_option_id, explanation and option_<option_id> for every option,
+the optional column Tags has the tags separated by ;
+The tags of a question are replaced by the ones from the file, without "Tags" they stay as they are.
+
+    python api/importer.py new_tests.jsonl --upsert --chunk 1000
+"""
+
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import asyncio
+import csv
+import logging
+from datetime import datetime
+from typing import Iterator, List, Tuple
+from pydantic import ValidationError
+from sqlalchemy import insert, delete, select, tuple_, text
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.ext.asyncio import AsyncConnection
+from const import TxtData
+from schemas import ImportedTests
+from models import Questions, Options, Tags, QuestionTags
+import models
+from cache_utils import EngCache, initcache, cached_batch_keys
+from handlers import global_error_handler_async
+
+
+CsvOptionPrefix = 'option_'
+
+
+
+def read_jsonl(path: str) -> Iterator[Tuple[int, dict]]:
+
+    """(line number, raw record) for every non-empty line"""
+
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, start=1):
+            if line.strip():
+                yield number, line
+
+
+
+def read_csv(path: str) -> Iterator[Tuple[int, dict]]:
+
+    """(line number, raw record) for every row. The option_<id> columns become the Options list"""
+
+    with open(path, encoding='utf-8', newline='') as f:
+        for number, row in enumerate(csv.DictReader(f), start=2):
+            record = {k: v for k, v in row.items() if not k.startswith(CsvOptionPrefix)}
+            record["Options"] = [{"option_id": int(k[len(CsvOptionPrefix):]), "option_text": v}
+                                 for k, v in row.items() if k.startswith(CsvOptionPrefix) and v]
+            record["datetime_shown"] = record.get("datetime_shown") or None
+            if "Tags" in record:
+                record["Tags"] = [t for t in (record["Tags"] or '').split(';') if t] if record["Tags"] else None
+            yield number, record
+
+
+
+def validated_chunks(Records: Iterator[Tuple[int, dict]], chunk: int, stats: dict) -> Iterator[List[ImportedTests]]:
+
+    """validate the records and group them into chunks. Invalid records are logged and skipped"""
+
+    Chunk = []
+    for number, record in Records:
+        try:
+            if isinstance(record, str):
+                onetest = ImportedTests.model_validate_json(record)
+            else:
+                onetest = ImportedTests(**record)
+        except (ValidationError, ValueError) as e:
+            stats["skipped"] += 1
+            logging.warning(TxtData.ImportSkippedRecord.format(number, str(e)))
+            continue
+        Chunk.append(onetest)
+        if len(Chunk) >= chunk:
+            yield Chunk
+            Chunk = []
+    if Chunk:
+        yield Chunk
+
+
+
+def _to_rows(Chunk: List[ImportedTests]) -> Tuple[List[dict], List[dict]]:
+
+    """the questions and options rows of a chunk"""
+
+    QuestionRows = []
+    OptionRows = []
+    for onetest in Chunk:
+        date_time_in_format = onetest.datetime_shown
+        if isinstance(date_time_in_format, str):
+            date_time_in_format = datetime.fromisoformat(date_time_in_format)
+        QuestionRows.append({"id": onetest.ID,
+                             "level": onetest.Level.value,
+                             "question": onetest.Question,
+                             "correct_id": onetest.correct_option_id,
+                             "explanation": onetest.explanation,
+                             "datetime_shown": date_time_in_format})
+        for o in onetest.Options:
+            OptionRows.append({"question_id": onetest.ID, "option_id": o.option_id, "option_text": o.option_text})
+    return QuestionRows, OptionRows
+
+
+
+def _upsert_statement(conn: AsyncConnection, model, update_columns: List[str]):
+
+    """multi-row INSERT which updates the given columns when the primary key already exists"""
+
+    if conn.dialect.name == 'mysql':
+        statement = mysql.insert(model)
+        return statement.on_duplicate_key_update({c: statement.inserted[c] for c in update_columns})
+    if conn.dialect.name == 'sqlite':
+        statement = sqlite.insert(model)
+        return statement.on_conflict_do_update(index_elements=[c.name for c in model.__table__.primary_key],
+                                               set_={c: statement.excluded[c] for c in update_columns})
+    raise ValueError(TxtData.ImportUnsupportedDialect.format(conn.dialect.name))
+
+
+
+def _insert_ignore_statement(conn: AsyncConnection, model):
+
+    """multi-row INSERT which skips the rows with an existing unique key"""
+
+    if conn.dialect.name == 'mysql':
+        return mysql.insert(model).prefix_with('IGNORE')
+    if conn.dialect.name == 'sqlite':
+        return sqlite.insert(model).on_conflict_do_nothing()
+    raise ValueError(TxtData.ImportUnsupportedDialect.format(conn.dialect.name))
+
+
+
+async def write_tags(conn: AsyncConnection, Chunk: List[ImportedTests]):
+
+    """replace the tags of the questions which have Tags in the file. New tag names are added to tags"""
+
+    TaggedTests = [onetest for onetest in Chunk if onetest.Tags is not None]
+    if not TaggedTests:
+        return
+    Names = {name for onetest in TaggedTests for name in onetest.Tags}
+    TagIDs = {}
+    if Names:
+        await conn.execute(_insert_ignore_statement(conn, Tags), [{"name": name} for name in Names])
+        Result = await conn.execute(select(Tags.id, Tags.name).where(Tags.name.in_(Names)))
+        TagIDs = {row.name: row.id for row in Result}
+    await conn.execute(delete(QuestionTags).where(QuestionTags.question_id.in_([onetest.ID for onetest in TaggedTests])))
+    TagRows = [{"question_id": onetest.ID, "tag_id": TagIDs[name]}
+               for onetest in TaggedTests for name in set(onetest.Tags)]
+    if TagRows:
+        await conn.execute(insert(QuestionTags), TagRows)
+
+
+
+async def write_chunk(conn: AsyncConnection, Chunk: List[ImportedTests], upsert: bool):
+
+    """insert (or upsert) one chunk in one transaction"""
+
+    QuestionRows, OptionRows = _to_rows(Chunk)
+    async with conn.begin():
+        if not upsert:
+            await conn.execute(insert(Questions), QuestionRows)
+            await conn.execute(insert(Options), OptionRows)
+            await write_tags(conn, Chunk)
+            return
+
+        await conn.execute(_upsert_statement(conn, Questions, ["level", "question", "correct_id", "explanation"]),
+                           QuestionRows)  #datetime_shown of the existing questions is kept for the rotation
+        await conn.execute(_upsert_statement(conn, Options, ["option_text"]), OptionRows)
+        await conn.execute(delete(Options).where(
+            Options.question_id.in_([onetest.ID for onetest in Chunk]),
+            tuple_(Options.question_id, Options.option_id).notin_(
+                [(r["question_id"], r["option_id"]) for r in OptionRows])))
+        #the options which are not in the file anymore
+        await write_tags(conn, Chunk)
+
+
+
+@global_error_handler_async
+async def import_tests(Records: Iterator[Tuple[int, dict]], engcache: EngCache, chunk: int = 1000,
+                       upsert: bool = False) -> dict:
+
+    """The function for importing of the tests. Returns the statistics of the import"""
+
+    stats = {"imported": 0, "skipped": 0, "refreshed": 0}
+    async with models.engine.connect() as conn:
+        if conn.dialect.name == 'mysql':
+            await conn.execute(text("SET FOREIGN_KEY_CHECKS = 0"))
+            #questions and options reference each other (fk_correct_option_id), validated chunks are consistent anyway
+            await conn.commit()
+        try:
+            for Chunk in validated_chunks(Records, chunk, stats):
+                await write_chunk(conn, Chunk, upsert)
+                stats["imported"] += len(Chunk)
+
+                if upsert:   #new tests can not be in the cache yet
+                    await engcache.redis.delete(*[TxtData.TestContentKey.format(onetest.ID) for onetest in Chunk])
+                    Tests = {onetest.ID: onetest.model_dump(mode='json') for onetest in Chunk}
+                    for key in await cached_batch_keys(engcache.redis):   #the batches of the levels and of the tags
+                        stats["refreshed"] += await engcache.refresh_cached_tests(key, Tests)
+                logging.info(TxtData.ImportProgress.format(stats["imported"], stats["skipped"], stats["refreshed"]))
+        finally:
+            if conn.dialect.name == 'mysql':   #the connection goes back to the pool, its next user needs the checks
+                await conn.execute(text("SET FOREIGN_KEY_CHECKS = 1"))
+                await conn.commit()
+    if stats["imported"]:
+        await engcache.redis.incr(TxtData.ContentVersionKey)   #the workers build the new content store on the next refill
+    return stats
+
+
+
+async def main(args):
+    Records = read_csv(args.path) if args.path.lower().endswith('.csv') else read_jsonl(args.path)
+    redis = initcache()
+    try:
+        stats = await import_tests(Records, EngCache(redis), args.chunk, args.upsert)
+        print(TxtData.ImportProgress.format(stats["imported"], stats["skipped"], stats["refreshed"]))
+    finally:
+        await redis.close()
+        await models.engine.dispose()
+
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='a .jsonl or .csv file')
+    parser.add_argument('--chunk', type=int, default=1000, help='tests per transaction')
+    parser.add_argument('--upsert', action='store_true', help='update the tests with existing IDs')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(parse_args()))
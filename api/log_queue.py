@@ -0,0 +1,147 @@
+"""Logging which does not block the event loop.
+The records are put to a bounded queue and written by a thread of the QueueListener, so a slow log sink
+does not stall the requests. Every record is one json line with the structured fields of log_event.
+The repeated records (the same event) are limited, the dropped ones are counted and reported"""
+
+import json
+import logging
+import queue
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from config import settings
+from const import TxtData
+
+
+
+def log_event(level: int, message: str, **fields):
+
+    """a record with the structured fields, like test_id=8. The field event is the kind of the record
+    for the limit of the repeated records, the message is used without it"""
+
+    logging.log(level, message, extra={"fields": fields}, stacklevel=2)
+
+
+
+class StructuredFormatter(logging.Formatter):
+
+    """one json line: time, level, message, the function and the module of the call and the fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        Line = {"time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+                "level": record.levelname,
+                "message": record.getMessage(),
+                "function": record.funcName,
+                "module": record.module,
+                **getattr(record, 'fields', {})}
+        return json.dumps(Line, default=str, ensure_ascii=False)
+
+
+
+class RepeatFilter(logging.Filter):
+
+    """At most limit records of one kind in window seconds. The next record of the kind after the window
+    has the number of the dropped ones in the field suppressed"""
+
+    MaxKinds = 1024   #the expired windows are removed when there are more kinds
+
+    def __init__(self, limit: int, window: float):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.Windows = {}   #kind -> [started, passed, suppressed]
+
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        fields = getattr(record, 'fields', {})
+        kind = (record.levelno, fields.get('event') or record.msg)
+        now = time.monotonic()
+        Window = self.Windows.get(kind)
+        if Window is None or now - Window[0] >= self.window:
+            if Window and Window[2]:
+                record.fields = {**fields, "suppressed": Window[2]}
+            if Window is None and len(self.Windows) >= self.MaxKinds:
+                self.Windows = {k: w for k, w in self.Windows.items() if now - w[0] < self.window or w[2]}
+            Window = self.Windows[kind] = [now, 0, 0]
+        if Window[1] >= self.limit:
+            Window[2] += 1
+            return False
+        Window[1] += 1
+        return True
+
+
+    def pop_suppressed(self) -> dict:
+
+        """the kinds with dropped records which were not reported yet, kind -> number"""
+
+        Suppressed = {kind: w[2] for kind, w in self.Windows.items() if w[2]}
+        self.Windows = {}
+        return Suppressed
+
+
+
+class DroppingQueueHandler(QueueHandler):
+
+    """When the queue is full (the log thread does not keep up) the record is dropped and counted,
+    the event loop does not wait for it"""
+
+    def __init__(self, Queue: queue.Queue):
+        super().__init__(Queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+
+class QueueLogging():
+
+    """The handlers of the root logger are moved behind the queue while the app is running.
+    Without handlers the records are written to stderr"""
+
+    def __init__(self):
+        self.handler = None
+        self.listener = None
+        self.repeat_filter = None
+        self.Handlers = []
+
+
+    def start(self):
+        root = logging.getLogger()
+        self.Handlers = root.handlers[:]
+        if not self.Handlers:
+            stream_handler = logging.StreamHandler()
+            stream_handler.setFormatter(StructuredFormatter())
+            self.Handlers = [stream_handler]
+        for handler in self.Handlers:
+            root.removeHandler(handler)
+        self.handler = DroppingQueueHandler(queue.Queue(settings.LOG_QUEUE_SIZE))
+        self.repeat_filter = RepeatFilter(settings.LOG_RATE_LIMIT, settings.LOG_RATE_WINDOW)
+        self.handler.addFilter(self.repeat_filter)
+        root.addHandler(self.handler)
+        root.setLevel(settings.LOG_LEVEL)
+        self.listener = QueueListener(self.handler.queue, *self.Handlers, respect_handler_level=True)
+        self.listener.start()
+
+
+    def stop(self):
+
+        """the dropped records are reported, the queue is written out and the handlers are given back to the root logger"""
+
+        if self.listener is None:
+            return
+        root = logging.getLogger()
+        Suppressed = self.repeat_filter.pop_suppressed()
+        self.handler.removeFilter(self.repeat_filter)
+        for (levelno, kind), number in Suppressed.items():
+            log_event(levelno, TxtData.LogSuppressed.format(number, kind), event=kind, suppressed=number)
+        if self.handler.dropped:
+            log_event(logging.WARNING, TxtData.LogQueueDropped.format(self.handler.dropped), dropped=self.handler.dropped)
+        self.listener.stop()   #waits until the thread writes every record from the queue
+        root.removeHandler(self.handler)
+        for handler in self.Handlers:
+            root.addHandler(handler)
+        self.listener = None
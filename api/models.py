@@ -1,8 +1,8 @@
 """The models of the api tables"""
 
 from sqlalchemy.orm import Mapped, mapped_column, declarative_base
-from sqlalchemy import Integer, String, Text, Index, Enum, ForeignKey, DateTime
-from sqlalchemy.ext.asyncio import AsyncSession,  create_async_engine, async_sessionmaker
+from sqlalchemy import Integer, String, Text, Index, Enum, ForeignKey, DateTime, event
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncEngine, create_async_engine, async_sessionmaker
 from schemas import Levels
 from const import TxtData
 from config import settings
@@ -12,9 +12,38 @@ from handlers import global_error_handler_sync
 #here we create engine and a session. Also we create a function 
 #which will open and will close the session before and after the app working
 
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+
+    """The settings of every new SQLite connection. WAL lets the readers work while one writer commits,
+    synchronous=NORMAL is safe with WAL and does not sync on every commit. Questions and options
+    reference each other, so foreign keys are checked at the end of a transaction (see the migration)"""
+
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT}")
+    cursor.execute(f"PRAGMA cache_size=-{settings.SQLITE_CACHE_SIZE}")   #negative means KiB, not pages
+    cursor.execute(f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+
+
+def create_db_engine(url: str) -> AsyncEngine:
+
+    """the engine for MySQL or for the embedded SQLite store"""
+
+    engine = create_async_engine(url)
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine.sync_engine, "connect", set_sqlite_pragmas)
+    return engine
+
+
+
 @global_error_handler_sync
 def init_db_engine_and_session():
-    engine = create_async_engine(settings.DB_URL)
+    engine = create_db_engine(settings.DB_URL)
     async_session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
     return engine, async_session_maker
 
@@ -69,6 +98,11 @@ class Questions(BaseModel):
     explanation: Mapped[Text] = mapped_column(String(500))
     datetime_shown: Mapped[DateTime] = mapped_column(DateTime, default=None, nullable=True)
 
+    __table_args__ = (
+        Index('ix_questions_fulltext', 'question', 'explanation', mysql_prefix='FULLTEXT').ddl_if(dialect='mysql'),
+        #the search route. SQLite uses the FTS5 table questions_fts from the migration
+    )
+
     def to_dict(self):
         d = super().to_dict()
         d["level"] = self.level.value  #because otherwise enum will not be JSON serializable
@@ -88,3 +122,53 @@ class Options(BaseModel):
     __table_args__ = (
         Index('ix_question_option', 'question_id', 'option_id', unique=True),
     )
+
+
+
+class Tags(BaseModel):
+
+    """the topics of the questions, like past-tenses"""
+
+    __tablename__ = 'tags'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    name: Mapped[Text] = mapped_column(String(50), nullable=False, unique=True)
+
+
+class QuestionTags(BaseModel):
+
+    """the tags of every question. The index by tag_id serves the rotation query of a level and a tag"""
+
+    __tablename__ = 'question_tags'
+
+    question_id: Mapped[int] = mapped_column(Integer, ForeignKey('questions.id', ondelete='CASCADE'), primary_key=True)
+    tag_id: Mapped[int] = mapped_column(Integer, ForeignKey('tags.id', ondelete='CASCADE'), primary_key=True)
+
+    __table_args__ = (
+        Index('ix_question_tags_tag', 'tag_id', 'question_id'),
+    )
+
+
+class QuestionStats(BaseModel):
+
+    """the answers to every question, the counters from Redis are added here by the answer statistics flush.
+    There is no foreign key, so the counters of a deleted question can not fail the whole flush"""
+
+    __tablename__ = 'question_stats'
+
+    question_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    correct: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    updated_at: Mapped[DateTime] = mapped_column(DateTime, default=None, nullable=True)
+
+
+class ShowEvents(BaseModel):
+
+    """every show of a question, written by the cache flush next to the update of questions.datetime_shown.
+    The key (question_id, shown_at) makes a repeated flush harmless. In MySQL the table is partitioned
+    by month of shown_at (see api/show_events.py), there is no foreign key as partitioned tables can not have it"""
+
+    __tablename__ = 'show_events'
+
+    question_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    shown_at: Mapped[DateTime] = mapped_column(DateTime, primary_key=True)
@@ -0,0 +1,146 @@
+"""The admin routes for profiling of a running worker.
+The blueprint is registered only when settings.PROFILING_ENABLED is True, so nothing here costs anything by default"""
+
+import sys
+import asyncio
+import threading
+import tracemalloc
+from collections import Counter
+from config import settings
+from const import TxtData, BadRequestErrorInfo, ConflictErrorInfo
+from schemas import ToProfileCpu, ToProfileMemory, MemoryStat, MemoryReport, Message, Levels
+from routes import _get_tests
+from quart import Blueprint, current_app, Response
+from quart_schema import validate_querystring, validate_response
+from handlers import ProfilerBusyError, WrongLevelError, log_raise_error
+
+
+admin_bp = Blueprint('admin_bp', __name__)
+
+profiling_lock = asyncio.Lock()  #only one profiling session per worker at a time
+
+
+
+class StackSampler():
+
+    """Sampling CPU profiler. A background thread reads the stack of the event loop thread
+    every settings.PROFILING_SAMPLE_INTERVAL seconds and counts the collapsed stacks.
+    The result is in the format which flamegraph.pl, speedscope and inferno understand:
+        root_func (file:line);child_func (file:line) <number of samples>"""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.Stacks = Counter()
+        self.Samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+
+    def start(self):
+        self._thread.start()
+
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            Stack = []
+            while frame is not None:
+                code = frame.f_code
+                Stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            Stack.reverse()   #collapsed stacks go from the root to the leaf
+            self.Stacks[';'.join(Stack)] += 1
+            self.Samples += 1
+
+
+    def collapsed(self) -> str:
+
+        """the samples in the collapsed stack format"""
+
+        return '\n'.join(f"{stack} {count}" for stack, count in self.Stacks.most_common()) + '\n'
+
+
+
+@admin_bp.route(TxtData.ProfileCpuRoute, methods=["GET"])
+@validate_querystring(ToProfileCpu)
+@validate_response(Message, ConflictErrorInfo.ErrorCode)
+@validate_response(Message, BadRequestErrorInfo.ErrorCode)
+async def ProfileCpu(query_args: ToProfileCpu):
+    """The route for CPU profiling of the worker.
+    This route samples the event loop thread for N seconds and returns a flamegraph-compatible dump"""
+
+    try:
+        if profiling_lock.locked():
+            raise ProfilerBusyError()
+        async with profiling_lock:
+            seconds = min(query_args.seconds, settings.PROFILING_MAX_SECONDS)
+            sampler = StackSampler(threading.get_ident(), settings.PROFILING_SAMPLE_INTERVAL)
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)   #the worker keeps serving other requests while we sample it
+            finally:
+                sampler.stop()
+        return Response(sampler.collapsed(), mimetype='text/plain')
+
+    except Exception as e:
+        log_raise_error(e, ProfileCpu)
+        raise e
+
+
+
+@admin_bp.route(TxtData.ProfileMemoryRoute, methods=["GET"])
+@validate_querystring(ToProfileMemory)
+@validate_response(MemoryReport, 200)
+@validate_response(Message, ConflictErrorInfo.ErrorCode)
+@validate_response(Message, BadRequestErrorInfo.ErrorCode)
+async def ProfileMemory(query_args: ToProfileMemory):
+    """The route for memory profiling of a refill.
+    This route compares tracemalloc snapshots taken before and after a cache refill of the level"""
+
+    # The refill goes to a separate cache key, so the tests which are cached
+    # for users (and their not yet saved datetime_shown) are not touched.
+
+    try:
+        level = query_args.Level
+        if not level in Levels._value2member_map_:
+            raise WrongLevelError()
+        if profiling_lock.locked():
+            raise ProfilerBusyError()
+        async with profiling_lock:
+            EngCache = current_app.config['EngCache']
+            scratch_key = TxtData.ProfilingKey.format(level)
+            started_here = not tracemalloc.is_tracing()
+            if started_here:
+                tracemalloc.start(settings.PROFILING_TRACEBACK_DEPTH)
+            try:
+                before = tracemalloc.take_snapshot()
+                TestsList = await _get_tests(level)
+                await EngCache.addtocache(TestsList, scratch_key)
+                await EngCache.get_cached_test(scratch_key)
+                after = tracemalloc.take_snapshot()
+            finally:
+                if started_here:
+                    tracemalloc.stop()   #no tracing overhead after the request
+                await EngCache.redis.delete(scratch_key)
+
+        Filters = (tracemalloc.Filter(False, tracemalloc.__file__),
+                   tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                   tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"))
+        Stats = after.filter_traces(Filters).compare_to(before.filter_traces(Filters), 'lineno')
+        TopStats = [MemoryStat(file=s.traceback[0].filename,
+                               line=s.traceback[0].lineno,
+                               size_diff=s.size_diff,
+                               count_diff=s.count_diff) for s in Stats[:query_args.top]]
+        return MemoryReport(level=level, tests=len(TestsList or []), stats=TopStats)
+
+    except Exception as e:
+        log_raise_error(e, ProfileMemory)
+        raise e
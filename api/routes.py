@@ -1,14 +1,25 @@
-from schemas import TestsToDB, GettedTests, Message, OptionsTest, ToValidateLevel
-from models import Options, Questions, Levels, get_async_session
-from sqlalchemy.orm import aliased
-from sqlalchemy import select
+from schemas import (TestsToDB, GettedTests, Message, OptionsTest, ToValidateLevel, ImportedTests, BreakersStates,
+                     LevelBatch, BatchSizes, AnswerToCheck, AnswerResult, ToSearch, SearchHit, SearchResult,
+                     TestContent)
+from models import Options, Questions, Tags, QuestionTags, Levels, get_async_session
+from sqlalchemy import select, table, literal_column, bindparam, Integer
+from sqlalchemy.dialects.mysql import match
+import asyncio
+import async_timeout
+import hashlib
 import logging
-from typing import List
-from const import TxtData, BadRequestErrorInfo, NotFoundErrorInfo, InternalErrorInfo
+import re
+from typing import List, AsyncGenerator, Union
+from const import TxtData, BadRequestErrorInfo, NotFoundErrorInfo, InternalErrorInfo, ServiceUnavailableErrorInfo
 import config
-from quart import Blueprint, request, current_app
-from quart_schema import validate_request, validate_response, validate_querystring
-from handlers import global_error_handler_async, NoTestsError, WrongLevelError, log_raise_error
+from quart import Blueprint, Response, request, current_app
+from quart_schema import validate_request, validate_response, validate_querystring, document_response
+from handlers import (global_error_handler_async, NoTestsError, WrongLevelError, TestNotFoundError, OverloadedError,
+                      log_raise_error)
+from breakers import DependencyUnavailable, Breakers, db_breaker
+from admission import db_limiter, search_limiter
+from log_queue import log_event
+from cache_backends import SeenTests
 from datetime import datetime, timezone
 
 
@@ -29,6 +40,7 @@ eng_bp = Blueprint('eng_bp', __name__)
 @validate_response(Message, NotFoundErrorInfo.ErrorCode)
 @validate_response(Message, InternalErrorInfo.ErrorCode)
 @validate_response(Message, BadRequestErrorInfo.ErrorCode)
+@validate_response(Message, ServiceUnavailableErrorInfo.ErrorCode)
 async def GetTests(query_args: ToValidateLevel):
     """The route for a test retrieving.
     This route retrieves 1 test from the database or cache"""
@@ -42,20 +54,104 @@ async def GetTests(query_args: ToValidateLevel):
         level = data.get(TxtData.Level_name)
         if not level in Levels._value2member_map_:     #a list of available levels in the enum
             raise WrongLevelError()
+        user = data.get(TxtData.User_name)
+        tag = data.get(TxtData.Tag_name)
         EngCache = current_app.config['EngCache']  #get cache from the app.py
-        OneTest = await EngCache.get_cached_test(level)  #try to take a test from the cache
+        Seen = EngCache.seen_tests(user) if user else None
+        try:
+            OneTest = await _take_test(EngCache, level, Seen, tag)
+            if not OneTest and Seen and Seen.batch_seen:
+                OneTest = await _take_unseen_test(EngCache, level, Seen, tag)
+        except DependencyUnavailable as e:   #Redis or the db is down, slow or its circuit is open
+            OneTest = await _take_test_degraded(level, e, tag)
         if not OneTest:
-            TestsList = await _get_tests(level)   #try to take from the db
-            await EngCache.addtocache(TestsList, level)
-            OneTest = await EngCache.get_cached_test(level)
-            if not OneTest:
-                raise NoTestsError()
+            raise NoTestsError()
         return OneTest
     
     except Exception as e:
         log_raise_error(e, GetTests)
         raise e
 
+
+
+async def _take_test(EngCache, level, Seen: SeenTests = None, tag: str = None) -> Union[dict, None]:
+
+    """The function for taking of a test from the cache. When the cache of the level is exhausted,
+    the next batch is read from the db and written to the cache. Only one request of the worker refills
+    a level, the others wait for it and take their tests from the new batch.
+    Seen are the questions seen by the user, they are skipped. When the user saw every test left in the batch,
+    None is returned with Seen.batch_seen and the batch is not refilled (see _take_unseen_test).
+    A tag of the level has its own batch in the cache, so it costs the same as the level"""
+
+    key = EngCache.batch_key(level, tag)
+    OneTest = await EngCache.get_cached_test(key, Seen)  #try to take a test from the cache
+    if OneTest or Seen and Seen.batch_seen:
+        return OneTest
+    async with EngCache.refill_lock(key):
+        OneTest = await EngCache.get_cached_test(key, Seen)   #the batch could be written while we waited for the lock
+        if not OneTest and not (Seen and Seen.batch_seen):
+            await EngCache.flush_batch(EngCache.lookahead_key(key))   #its shows go to the db before the next batch is read
+            TestsList = await _read_batch(EngCache, level, EngCache.next_batch_size(key), tag)
+            await EngCache.addtocache(TestsList, key)
+            OneTest = await EngCache.get_cached_test(key, Seen)
+    return OneTest
+
+
+
+async def _take_unseen_test(EngCache, level, Seen: SeenTests, tag: str = None) -> Union[dict, None]:
+
+    """The user saw every test left in the cached batch, so the test is taken from the look-ahead batch:
+    the next settings.NUMBER_OF_TESTS tests after the batch in the rotation. It is cached and shared by all
+    the users who saw the batch, its shows are written back like the ones of the batch, and it is
+    written back before the batch is refilled, so the next batch follows it"""
+
+    key = EngCache.lookahead_key(EngCache.batch_key(level, tag))
+    BatchIDs = Seen.BatchIDs   #the check of the look-ahead batch replaces them
+    OneTest = await EngCache.get_cached_test(key, Seen)
+    if OneTest or Seen.batch_seen:
+        return OneTest
+    async with EngCache.refill_lock(key):
+        OneTest = await EngCache.get_cached_test(key, Seen)
+        if not OneTest and not Seen.batch_seen:
+            TestsList = await _read_batch(EngCache, level, len(BatchIDs) + config.settings.NUMBER_OF_TESTS, tag)
+            await EngCache.addtocache([t for t in TestsList if t["ID"] not in BatchIDs], key)
+            #the tests of the batch are first, their shows are not in the db yet
+            OneTest = await EngCache.get_cached_test(key, Seen)
+    return OneTest
+
+
+
+async def _read_batch(EngCache, level, number_of_tests: int, tag: str = None) -> List[dict]:
+
+    """the next tests of the rotation from the db, only IDs when the content is in the content store"""
+
+    async with db_limiter.slot(config.settings.ADMISSION_QUEUE_TIMEOUT):   #503 if the db is overloaded
+        if EngCache.content_store:   #the content is in the shared store, only IDs are needed from the db
+            await EngCache.content_store.ensure_current(EngCache.redis)
+            return await _get_test_ids(level, number_of_tests, tag)
+        return await _get_tests(level, number_of_tests, tag)   #try to take from the db
+
+
+
+async def _take_test_degraded(level, error: DependencyUnavailable, tag: str = None) -> Union[dict, None]:
+
+    """While Redis is unavailable, the tests are taken from a small batch in the memory of the worker.
+    While the db is unavailable, the already shown tests of the last batch are served again.
+    When there is nothing to serve, the error becomes 503"""
+
+    EngCache = current_app.config['EngCache']
+    FallbackCache = current_app.config['FallbackCache']
+    if error.name == TxtData.RedisDependency:
+        try:
+            return await _take_test(FallbackCache, level, tag=tag)
+        except DependencyUnavailable as e:
+            error = e
+    for cache in (EngCache, FallbackCache):
+        OneTest = await cache.get_stale_test(EngCache.batch_key(level, tag))
+        if OneTest:
+            return OneTest
+    raise error
+
     
 
 
@@ -66,6 +162,7 @@ async def GetTests(query_args: ToValidateLevel):
 @validate_response(Message, 200)
 @validate_response(Message, InternalErrorInfo.ErrorCode)
 @validate_response(Message, BadRequestErrorInfo.ErrorCode)
+@validate_response(Message, ServiceUnavailableErrorInfo.ErrorCode)
 async def UpdateStatus(data: TestsToDB):
     """The route for updating data in the cache/db.
     This route updates the datetime_shown value for the tests that were shown. 
@@ -77,9 +174,23 @@ async def UpdateStatus(data: TestsToDB):
         EngCache = current_app.config['EngCache']
         if not onetest.datetime_shown:
             onetest.datetime_shown = datetime.now(timezone.utc).isoformat()
-        result = await EngCache.update_cached_tests(onetest.Level.value, onetest.ID, onetest.datetime_shown)
+        key = EngCache.batch_key(onetest.Level.value, onetest.Tag)
+        try:
+            result = (await EngCache.update_cached_tests(key, onetest.ID, onetest.datetime_shown)
+                      or await EngCache.update_cached_tests(EngCache.lookahead_key(key), onetest.ID,
+                                                            onetest.datetime_shown))   #a user who saw the batch
+        except DependencyUnavailable:   #the test was served from the in-process batch
+            result = await current_app.config['FallbackCache'].update_cached_tests(key, onetest.ID,
+                                                                                   onetest.datetime_shown)
         if not result:
-            logging.warning(TxtData.NonSuccessfulUpdate.format(onetest.ID, onetest.Level.value))
+            log_event(logging.WARNING, TxtData.NonSuccessfulUpdate.format(onetest.ID, onetest.Level.value),
+                      event='NonSuccessfulUpdate', test_id=onetest.ID, test_level=onetest.Level.value)
+        if onetest.User:
+            try:
+                await EngCache.mark_seen(onetest.User, onetest.Level.value, onetest.ID)
+            except DependencyUnavailable:   #the show is saved, only the bitmap of the user misses it
+                log_event(logging.WARNING, TxtData.SeenNotMarked.format([onetest.ID], onetest.User),
+                          event='SeenNotMarked', test_ids=[onetest.ID])
 
         return Message(message=TxtData.SuccessfulUpdate).model_dump(), 200
         #we return Success for both cases: a test is in the cache or not. For the second case we show the warning in the terminal
@@ -88,85 +199,359 @@ async def UpdateStatus(data: TestsToDB):
         raise e
 
 
-@global_error_handler_async
-async def _get_tests(Level) -> List[dict]:
+@eng_bp.route(TxtData.AnswerRoute, methods=["POST"]) #/answer
+@validate_request(AnswerToCheck)
+@validate_response(AnswerResult, 200)
+@validate_response(Message, NotFoundErrorInfo.ErrorCode)
+@validate_response(Message, InternalErrorInfo.ErrorCode)
+@validate_response(Message, BadRequestErrorInfo.ErrorCode)
+@validate_response(Message, ServiceUnavailableErrorInfo.ErrorCode)
+async def CheckAnswer(data: AnswerToCheck):
+    """The route for checking of an answer.
+    The chosen option is compared with the correct one of the cached test and the answer is counted
+    in the statistics of the question. The db is read only when the test is not cached any more"""
 
-    """The function for tests retrieving from the db"""
+    try:
+        key = current_app.config['EngCache'].batch_key(data.Level.value, data.Tag)
+        try:
+            OneTest = await current_app.config['EngCache'].find_cached_test(key, data.ID)
+        except DependencyUnavailable:   #the test was served from the in-process batch
+            OneTest = await current_app.config['FallbackCache'].find_cached_test(key, data.ID)
+        if not OneTest:
+            OneTest = await _get_test(data.ID)   #the batch was finished after the test was shown
+        if not OneTest:
+            raise TestNotFoundError()
+        correct = data.option_id == OneTest["correct_option_id"]
+        await current_app.config['AnswerStats'].record(data.ID, correct)
+        return AnswerResult(correct=correct, correct_option_id=OneTest["correct_option_id"],
+                            explanation=OneTest.get("explanation")).model_dump(), 200
+    except Exception as e:
+        log_raise_error(e, CheckAnswer)
+        raise e
+
+
+@eng_bp.route(TxtData.TestByIDRoute, methods=["GET"]) #/tests/<id>
+@document_response(TestContent, 200)   #the body is built with the ETag in _conditional_response
+@validate_response(Message, NotFoundErrorInfo.ErrorCode)
+@validate_response(Message, InternalErrorInfo.ErrorCode)
+@validate_response(Message, ServiceUnavailableErrorInfo.ErrorCode)
+async def GetTestByID(test_id: int):
+    """The route for a test by its ID, for the clients which show the test again.
+    It does not take a test from the rotation. The response has a strong ETag of the content,
+    so the browsers and the CDN revalidate it with If-None-Match and get 304 without the body"""
+
+    try:
+        EngCache = current_app.config['EngCache']
+        try:
+            OneTest = await EngCache.get_test_content(test_id)
+        except DependencyUnavailable:   #Redis is unavailable, the test is read from the db
+            OneTest = None
+        if not OneTest:
+            async with db_limiter.slot(config.settings.ADMISSION_QUEUE_TIMEOUT):
+                OneTest = await _get_test(test_id)   #one row of questions with its options
+            if not OneTest:
+                raise TestNotFoundError()
+            OneTest = TestContent(**OneTest).model_dump()
+            try:
+                await EngCache.set_test_content(OneTest)
+            except DependencyUnavailable:   #Redis is unavailable, the test is served without caching it
+                pass
+        return _conditional_response(OneTest)
+    except Exception as e:
+        log_raise_error(e, GetTestByID)
+        raise e
+
+
+
+def _conditional_response(Content: dict) -> Response:
+
+    """The json of the content with a strong ETag (a hash of the json) and Cache-Control.
+    When If-None-Match has the ETag, 304 is returned without the body"""
+
+    Body = TestContent(**Content).model_dump_json().encode('utf-8')   #the same bytes for the same content
+    ETag = hashlib.sha256(Body).hexdigest()[:32]
+    if request.if_none_match.contains_weak(ETag):   #If-None-Match uses the weak comparison (RFC 9110)
+        response = Response(b'', status=304)
+    else:
+        response = Response(Body, content_type='application/json')
+    response.set_etag(ETag)
+    response.cache_control.public = True
+    response.cache_control.max_age = config.settings.TEST_MAX_AGE
+    return response
+
+
+
+@eng_bp.route(TxtData.BreakersRoute, methods=["GET"]) #/health/breakers
+@validate_response(BreakersStates, 200)
+async def BreakersState():
+    """The route for the state of the circuit breakers of this worker.
+    closed - the dependency works, open - the calls fail at once, half_open - a probe call is running"""
+
+    return BreakersStates(**{name: breaker.state_info() for name, breaker in Breakers.items()}), 200
+
+
+
+@eng_bp.route(TxtData.BatchSizesRoute, methods=["GET"]) #/health/batches
+@validate_response(BatchSizes, 200)
+async def BatchSizesState():
+    """The route for the batch sizes which this worker chose for the levels.
+    rate is the average number of tests shown per second (all workers), None before the second refill"""
+
+    EngCache = current_app.config['EngCache']
+    return BatchSizes(levels=[LevelBatch(level=level, size=Stats["size"], rate=Stats["rate"], refills=Stats["refills"])
+                              for level, Stats in sorted(EngCache.LevelStats.items())]), 200
+
+
+
+@eng_bp.route(TxtData.ExportRoute, methods=["GET"]) #/export
+@validate_querystring(ToValidateLevel)
+@validate_response(Message, BadRequestErrorInfo.ErrorCode)
+async def ExportTests(query_args: ToValidateLevel):
+    """The route for exporting of all tests of a level.
+    This route streams the tests as NDJSON (one test with its options per line)"""
+
+    # The rows are read with a server-side cursor and sent as soon as they are read,
+    # so the memory does not depend on the number of tests in the level.
+    # The next chunk is read from the db only when the previous one was sent to the client.
+    try:
+        level = query_args.Level
+        if not level in Levels._value2member_map_:
+            raise WrongLevelError()
+        return _stream_tests(level), 200, {"Content-Type": TxtData.NDJSONMimetype}
 
+    except Exception as e:
+        log_raise_error(e, ExportTests)
+        raise e
+
+
+
+@eng_bp.route(TxtData.SearchRoute, methods=["GET"]) #/search
+@validate_querystring(ToSearch)
+@validate_response(SearchResult, 200)
+@validate_response(Message, BadRequestErrorInfo.ErrorCode)
+@validate_response(Message, InternalErrorInfo.ErrorCode)
+@validate_response(Message, ServiceUnavailableErrorInfo.ErrorCode)
+async def SearchTests(query_args: ToSearch):
+    """The route for searching of the tests by the words of the question and of the explanation.
+    Every word should be found. The tests are ordered by ID, the next page starts after next_after"""
+
+    # A search has its own slots and its own timeout, so the searches of the editors
+    # can not take the db slots of the refills. A page has not more than SEARCH_MAX_LIMIT tests.
+    try:
+        Words = re.findall(r'\w+', query_args.q)   #the operators of the fulltext syntax are dropped
+        limit = min(query_args.limit, config.settings.SEARCH_MAX_LIMIT)
+        Hits = []
+        if Words:
+            async with search_limiter.slot(config.settings.ADMISSION_QUEUE_TIMEOUT):
+                try:
+                    async with async_timeout.timeout(config.settings.SEARCH_TIMEOUT):
+                        Hits = await _search_tests(Words, query_args.Level, query_args.after, limit + 1)
+                except asyncio.TimeoutError:
+                    raise OverloadedError()
+        next_after = Hits[limit - 1]["ID"] if len(Hits) > limit else None   #one more test shows the next page
+        return SearchResult(tests=Hits[:limit], next_after=next_after).model_dump(), 200
+
+    except Exception as e:
+        log_raise_error(e, SearchTests)
+        raise e
+
+
+
+async def _stream_tests(Level) -> AsyncGenerator[str, None]:
+
+    """The function for streaming of the tests of a level from the db as NDJSON chunks"""
+
+    batch = config.settings.EXPORT_BATCH_SIZE
+    Lines = []
+    async for onetest in _iter_tests(Level):
+        Lines.append(onetest.model_dump_json() + '\n')
+        if len(Lines) >= batch:
+            yield ''.join(Lines)
+            Lines = []
+    if Lines:
+        yield ''.join(Lines)
+
+
+
+async def _iter_tests(Level=None, batch: int = None) -> AsyncGenerator[ImportedTests, None]:
+
+    """The function for reading of the tests (of a level or of all levels) from the db one by one, ordered by ID.
+    The rows are read with a server-side cursor, batch rows at once"""
+
+    batch = batch or config.settings.EXPORT_BATCH_SIZE
     async for session in get_async_session():
-        SubqStmt = select(Questions).where(Questions.level == Level).order_by(Questions.datetime_shown).limit(config.settings.NUMBER_OF_TESTS) 
-        #select * from question order by datetime_shown limit config.settings.NUMBER_OF_TESTS
+        ResultStmt = (select(Questions.id, Questions.level, Questions.question, Questions.correct_id,
+                             Questions.explanation, Questions.datetime_shown,
+                             Options.option_id, Options.option_text)
+                      .join_from(Questions, Options, Questions.id == Options.question_id)
+                      .order_by(Questions.id, Options.option_id)
+                      .execution_options(yield_per=batch))
+        if Level is not None:
+            ResultStmt = ResultStmt.where(Questions.level == Level)
+        #rows of one question come one after another, so a question is complete when the next one starts
+
+        Result = await session.stream(ResultStmt)
+        current = None
+        async for row in Result:
+            if current is None or current.ID != row.id:
+                if current is not None:
+                    yield current
+                current = ImportedTests.model_construct(ID=row.id,
+                                                        Level=row.level,
+                                                        Question=row.question,
+                                                        Options=[],
+                                                        correct_option_id=row.correct_id,
+                                                        explanation=row.explanation,
+                                                        datetime_shown=row.datetime_shown)
+                #the data is from our db, so we skip the validation and use the model for the field names only
+            current.Options.append(OptionsTest.model_construct(option_id=row.option_id, option_text=row.option_text))
+        if current is not None:
+            yield current
+
+
+
+@global_error_handler_async
+async def _search_tests(Words: List[str], Level, after: int, limit: int) -> List[dict]:
 
-        Subquery = SubqStmt.subquery()
-        QuestionsAlias = aliased(Questions, Subquery) 
-        #apply Questions class to Subquery in order to create necessary structure
+    """The function for the search in the db: MySQL uses the FULLTEXT index, SQLite the FTS5 table.
+    It is not guarded by the db breaker, a slow search should not open the circuit of the refills"""
 
-        ResultStmt = select(QuestionsAlias, Options).join_from(QuestionsAlias, Options, QuestionsAlias.id == Options.question_id, isouter=False)
-        #select Q.*, options.* from (Subquery) as Q inner join Options on Q.id = options.question_id;
-        
+    async for session in get_async_session():
+        if session.bind.dialect.name == 'mysql':
+            Found = match(Questions.question, Questions.explanation,
+                          against=' '.join('+' + w for w in Words)).in_boolean_mode()
+        else:
+            Found = Questions.id.in_(select(literal_column('rowid'))
+                                     .select_from(table(TxtData.SearchFTSTable))
+                                     .where(literal_column(TxtData.SearchFTSTable).op('MATCH')(
+                                         ' '.join(f'"{w}"' for w in Words))))
+        ResultStmt = (select(Questions.id, Questions.level, Questions.question, Questions.explanation)
+                      .where(Found, Questions.id > after)
+                      .order_by(Questions.id)
+                      .limit(limit)
+                      .prefix_with(f"/*+ MAX_EXECUTION_TIME({int(config.settings.SEARCH_TIMEOUT * 1000)}) */",
+                                   dialect='mysql'))   #MySQL stops the query itself too
+        if Level is not None:
+            ResultStmt = ResultStmt.where(Questions.level == Level)
         Result = await session.execute(ResultStmt)
-    if not Result:
-        TestsList = [] 
-        raise NoTestsError()
+    return [SearchHit(ID=row.id, Level=row.level, Question=row.question, explanation=row.explanation).model_dump()
+            for row in Result.fetchall()]
+
+
+
+#The statements of the hot queries are built once. They select only the columns, so the rows are plain tuples
+#(no ORM objects), and the compiled SQL is taken from the statement cache of the engine on every call
+
+QuestionsTable, OptionsTable = Questions.__table__, Options.__table__
+TestColumns = (QuestionsTable.c.id, QuestionsTable.c.question, QuestionsTable.c.correct_id,
+               QuestionsTable.c.explanation, QuestionsTable.c.datetime_shown)   #the order of _group_tests
+
+
+def _next_questions(*Columns, tagged: bool = False):
 
+    """the next questions of the level (bindparam level) which were shown the longest time ago.
+    With tagged only the questions with the tag (bindparam tag): the tag is found by its unique name
+    and its questions by the (tag_id, question_id) index, the level is checked on the questions"""
 
-    QuestionsList = []   #Received questions models list
-    OptionsList = []    #Received options models list
-    TestsList = []   #json to return
-    idis = set()     #Received questions' IDs
+    Stmt = select(*Columns)
+    if tagged:
+        QuestionTagsTable, TagsTable = QuestionTags.__table__, Tags.__table__
+        Stmt = (Stmt.join(QuestionTagsTable, QuestionTagsTable.c.question_id == QuestionsTable.c.id)
+                    .join(TagsTable, TagsTable.c.id == QuestionTagsTable.c.tag_id)
+                    .where(TagsTable.c.name == bindparam('tag')))
+    return (Stmt.where(QuestionsTable.c.level == bindparam('level'))
+                .order_by(QuestionsTable.c.datetime_shown)
+                .limit(bindparam('number_of_tests', type_=Integer)))
 
 
-    """ Result.fetchall() returns a list of tuples filled out by SQLAlchemy models
-    We try to separate Questions from Options below 
-    Our goal - to have the following json:
+def _with_options(QuestionsStmt):
+
+    """select Q.*, options.option_id, options.option_text from (QuestionsStmt) as Q inner join options"""
+
+    Subquery = QuestionsStmt.subquery()
+    return (select(*(Subquery.c[column.name] for column in TestColumns), OptionsTable.c.option_id,
+                   OptionsTable.c.option_text)
+            .join_from(Subquery, OptionsTable, Subquery.c.id == OptionsTable.c.question_id))
+
+
+TestStmt = (select(*TestColumns, OptionsTable.c.option_id, OptionsTable.c.option_text)
+            .join_from(QuestionsTable, OptionsTable, QuestionsTable.c.id == OptionsTable.c.question_id)
+            .where(QuestionsTable.c.id == bindparam('test_id')))
+NextTestsStmts = {tagged: _with_options(_next_questions(*TestColumns, tagged=tagged)) for tagged in (False, True)}
+NextTestIDsStmts = {tagged: _next_questions(QuestionsTable.c.id, QuestionsTable.c.datetime_shown, tagged=tagged)
+                    for tagged in (False, True)}
+
+
+
+@global_error_handler_async
+@db_breaker.guard
+async def _get_test(test_id) -> Union[dict, None]:
+
+    """The function for retrieving of one test by its ID from the db"""
+
+    async for session in get_async_session():
+        Result = await session.execute(TestStmt, {"test_id": test_id})
+    TestsList = _group_tests(Result.all())
+    return TestsList[0] if TestsList else None
+
+
+
+@global_error_handler_async
+@db_breaker.guard
+async def _get_test_ids(Level, number_of_tests: int = None, tag: str = None) -> List[dict]:
+
+    """The function for retrieving of the next tests IDs (without the content) from the db.
+    It is used when the content is taken from the content store"""
+
+    async for session in get_async_session():
+        Result = await session.execute(NextTestIDsStmts[tag is not None],
+                                       {"level": Level, "tag": tag,
+                                        "number_of_tests": number_of_tests or config.settings.NUMBER_OF_TESTS})
+    return [{"ID": test_id, "datetime_shown": datetime_shown} for test_id, datetime_shown in Result.all()]
+
+
+
+@global_error_handler_async
+@db_breaker.guard
+async def _get_tests(Level, number_of_tests: int = None, tag: str = None) -> List[dict]:
+
+    """The function for tests retrieving from the db"""
+
+    async for session in get_async_session():
+        Result = await session.execute(NextTestsStmts[tag is not None],
+                                       {"level": Level, "tag": tag,
+                                        "number_of_tests": number_of_tests or config.settings.NUMBER_OF_TESTS})
+    return _group_tests(Result.all())
+
+
+
+def _group_tests(Rows) -> List[dict]:
+
+    """The function for joining questions with their options in one pass over the rows.
+    A row is (id, question, correct_id, explanation, datetime_shown, option_id, option_text),
+    the result is the json of GettedTests:
         {
             "ID": int,
             "Question": str,
-            "Options": [
-                {
-                    "option_id": int,
-                    "option_text": str
-                },
-                ...
-            ],
+            "Options": [{"option_id": int, "option_text": str}, ...],
             "correct_option_id": int,
             "explanation": str,
             "datetime_shown": datetime
-        }   
-    """
-
-    for q, o in Result.fetchall():  #separation
-        q: Questions
-        o: Options
-        
-        OptionsList.append(o)
-
-        if not q.id in idis:   #select only unique models without duplicates
-            QuestionsList.append(q)   
-        idis.add(q.id)
-    
-
-    for q in QuestionsList:   #joining together to the json
-        q: Questions
-        OptionsShortList = []  #short options list without question_id
-        for o in OptionsList:
-            o: Options
-            
-            if q.id == o.question_id:
-                OptionsModel = OptionsTest(option_id=o.option_id, option_text=o.option_text)
-                OptionsShortList.append(OptionsModel.model_dump())
-
-
-        newtest = GettedTests(ID=q.id,
-                            Question=q.question,
-                            Options=OptionsShortList,
-                            correct_option_id=q.correct_id,
-                            explanation= q.explanation,
-                            datetime_shown=q.datetime_shown                                        
-                            ) 
-
-        TestsList.append(newtest.model_dump())
-    return TestsList
+        }
+    The data is from our db, so it is not validated again"""
+
+    Tests = {}
+    for test_id, question, correct_id, explanation, datetime_shown, option_id, option_text in Rows:
+        onetest = Tests.get(test_id)
+        if onetest is None:
+            onetest = Tests[test_id] = {"ID": test_id,
+                                        "Question": question,
+                                        "Options": [],
+                                        "correct_option_id": correct_id,
+                                        "explanation": explanation,
+                                        "datetime_shown": datetime_shown}
+        onetest["Options"].append({"option_id": option_id, "option_text": option_text})
+    return list(Tests.values())
 
 
 
@@ -1,10 +1,11 @@
 """Pydantic models for data validation and improvement of the code structure"""
 
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
 from datetime import datetime, timezone
-from typing import Optional, Union, Any, List
+from typing import Optional, Union, Any, List, Literal
 from typing_extensions import Annotated
 import enum
+from const import TxtData
 
 
 class Levels(enum.Enum):
@@ -30,22 +31,50 @@ class GettedTests(BaseModel):   #the model for validation and processing of gett
 
 
 
+class ImportedTests(GettedTests):   #the model for validation of the tests from the import files
+    Level: Levels
+    Tags: Annotated[Optional[List[Annotated[str, Field(min_length=1, max_length=50, pattern=r'^[\w\-]+$')]]],
+                    Field(default=None)]   #None keeps the tags which the question has in the db
+
+    @model_validator(mode='after')
+    def check_correct_option(self):
+        if not self.Options:
+            raise ValueError(TxtData.EmptyOptionsError)
+        if not self.correct_option_id in [o.option_id for o in self.Options]:
+            raise ValueError(TxtData.WrongCorrectOptionError.format(self.correct_option_id))
+        return self
+
+
+
 class CachedTests(BaseModel):  #the model for tests in the cache
     ID: int
-    Question: str
-    Options: list
-    correct_option_id: int
-    explanation: str
+    Question: Annotated[Optional[str], Field(default=None)]    #the content is None when it is in the content store
+    Options: Annotated[Optional[list], Field(default=None)]
+    correct_option_id: Annotated[Optional[int], Field(default=None)]
+    explanation: Annotated[Optional[str], Field(default=None)]
     datetime_shown: Annotated[Union[str, datetime, None], Field(default=None)]
     shown: Annotated[Optional[bool], Field(default=False)]
 
 
 
+class TestContent(BaseModel):   #the model for the test by ID, only the content, so its ETag changes only with an import
+    ID: int
+    Question: str
+    Options: list[OptionsTest]
+    correct_option_id: int
+    explanation: Optional[str]
+
+
+
 
 class TestsToDB(BaseModel):    #the model for input data validation in the updatetests route
     Level: Levels
     ID: Annotated[int, Field(gt=0, examples=[8])]
     datetime_shown: Annotated[Optional[str], Field(default=None, examples=[datetime.now(timezone.utc).isoformat()])]
+    User: Annotated[Optional[str], Field(default=None, min_length=1, max_length=64, pattern=r'^[\w\-]+$',
+                                         examples=['learner-42'])]   #the test is marked as seen by the user
+    Tag: Annotated[Optional[str], Field(default=None, min_length=1, max_length=50, pattern=r'^[\w\-]+$',
+                                        examples=['past-tenses'])]   #the test was taken with this tag
 
     @field_validator('datetime_shown')
     def check_datetime_format(cls, value):
@@ -64,8 +93,59 @@ class TestsToDB(BaseModel):    #the model for input data validation in the updat
             return value
     
 
+class AnswerToCheck(BaseModel):    #the model for input data validation in the answer route
+    Level: Levels
+    ID: Annotated[int, Field(gt=0, examples=[8])]
+    option_id: Annotated[int, Field(ge=0, examples=[2])]
+    Tag: Annotated[Optional[str], Field(default=None, min_length=1, max_length=50, pattern=r'^[\w\-]+$')]
+
+
+class AnswerResult(BaseModel):    #the result of the answer route
+    correct: bool
+    correct_option_id: int
+    explanation: Optional[str]
+    
+
+class SessionMessage(BaseModel):    #the model for the messages of the client in the session websocket
+    type: Literal['shown', 'answer', 'next']
+    ID: Annotated[Optional[int], Field(default=None, gt=0, examples=[8])]
+    option_id: Annotated[Optional[int], Field(default=None, ge=0)]   #required for answer
+    datetime_shown: Annotated[Optional[datetime], Field(default=None)]   #the time of the message if None
+
+    @model_validator(mode='after')
+    def check_ack(self):
+        if self.type != 'next' and self.ID is None:
+            raise ValueError(TxtData.SessionIDRequired.format(self.type))
+        if self.type == 'answer' and self.option_id is None:
+            raise ValueError(TxtData.NoneValueError.format('option_id'))
+        return self
+
+
+class ToSearch(BaseModel):    #the model for input data validation in the search route
+    q: Annotated[str, Field(min_length=2, max_length=200, examples=['past simple'])]
+    Level: Annotated[Optional[Levels], Field(default=None)]
+    after: Annotated[int, Field(default=0, ge=0)]   #the cursor, the ID of the last test of the previous page
+    limit: Annotated[int, Field(default=20, ge=1)]   #not more than settings.SEARCH_MAX_LIMIT
+
+
+class SearchHit(BaseModel):    #one test found by the search route
+    ID: int
+    Level: Levels
+    Question: str
+    explanation: Optional[str]
+
+
+class SearchResult(BaseModel):    #one page of the search route
+    tests: List[SearchHit]
+    next_after: Optional[int]   #the cursor of the next page, None on the last page
+
+
 class ToValidateLevel(BaseModel):    #the model for input data validation in the gettests route
     Level: Annotated[str, Field(min_length=2)]
+    User: Annotated[Optional[str], Field(default=None, min_length=1, max_length=64, pattern=r'^[\w\-]+$')]
+    #the tests which the user did not see go first
+    Tag: Annotated[Optional[str], Field(default=None, min_length=1, max_length=50, pattern=r'^[\w\-]+$')]
+    #only the tests with the tag, they have their own rotation
 
 class DataTestsToDB(BaseModel):    #the model for testing 
     Level: Any
@@ -78,4 +158,42 @@ class ValidationErrorDetail(BaseModel):  #the model for pydantic error detailes
     details: str
 
 class Message(BaseModel):    #general model for errors and messages
-    message: Union[str, List[ValidationErrorDetail]]
\ No newline at end of file
+    message: Union[str, List[ValidationErrorDetail]]
+
+
+class ToProfileCpu(BaseModel):    #the model for input data validation in the cpu profiling route
+    seconds: Annotated[int, Field(default=10, ge=1)]
+
+class ToProfileMemory(BaseModel):    #the model for input data validation in the memory profiling route
+    Level: Annotated[str, Field(min_length=2)]
+    top: Annotated[int, Field(default=20, ge=1, le=200)]
+
+class MemoryStat(BaseModel):    #one allocation hot spot
+    file: str
+    line: int
+    size_diff: int
+    count_diff: int
+
+class MemoryReport(BaseModel):    #the result of the memory profiling
+    level: str
+    tests: int
+    stats: List[MemoryStat]
+
+
+class BreakerState(BaseModel):    #the state of the circuit breaker of one dependency
+    state: str
+    failed_calls: int
+    open_seconds: float
+
+class BreakersStates(BaseModel):    #the result of the breakers route
+    redis: BreakerState
+    db: BreakerState
+
+class LevelBatch(BaseModel):    #the batch size chosen for one level
+    level: str
+    size: int
+    rate: Optional[float]
+    refills: int
+
+class BatchSizes(BaseModel):    #the result of the batch sizes route
+    levels: List[LevelBatch]
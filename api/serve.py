@@ -0,0 +1,73 @@
+"""The production server.
+It runs settings.SERVER_WORKERS worker processes of the app with Hypercorn, uvloop (if installed)
+and the keep-alive, backlog and HTTP/2 settings from config.Settings:
+
+    python api/serve.py --workers 4
+
+Every worker creates its own app with run_app(), so every worker has its own db pool, cache client
+and cache listener. The cache itself is shared, that is why it is saved to the db only by the last stopped worker"""
+
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import logging
+from hypercorn.config import Config
+from hypercorn.run import run
+from config import settings
+from const import TxtData
+
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+
+
+def event_loop_worker_class(event_loop: str) -> str:
+
+    """the Hypercorn worker class for the event loop. uvloop is optional"""
+
+    if event_loop == 'uvloop':
+        try:
+            import uvloop
+        except ImportError:
+            logging.warning(TxtData.NoUvloopWarning)
+            return 'asyncio'
+    return event_loop
+
+
+
+def build_config(args) -> Config:
+    config = Config()
+    config.application_path = f"{os.path.relpath(APP_PATH)}:run_app()"
+    #a relative path because Hypercorn splits the path by ':' (the drive letter on Windows)
+    config.bind = [f"{args.host}:{args.port}"]
+    config.workers = args.workers
+    config.worker_class = event_loop_worker_class(args.loop)
+    config.keep_alive_timeout = settings.SERVER_KEEP_ALIVE_TIMEOUT
+    config.backlog = settings.SERVER_BACKLOG
+    config.graceful_timeout = settings.SERVER_GRACEFUL_TIMEOUT
+    config.h2_max_concurrent_streams = settings.SERVER_H2_MAX_CONCURRENT_STREAMS
+    config.alpn_protocols = ["h2", "http/1.1"] if settings.SERVER_HTTP2 else ["http/1.1"]
+    if settings.SERVER_CERTFILE:
+        config.certfile = settings.SERVER_CERTFILE
+        config.keyfile = settings.SERVER_KEYFILE
+    return config
+
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=settings.SERVER_HOST)
+    parser.add_argument('--port', type=int, default=settings.SERVER_PORT)
+    parser.add_argument('--workers', type=int, default=settings.SERVER_WORKERS)
+    parser.add_argument('--loop', choices=['uvloop', 'asyncio'], default=settings.SERVER_EVENT_LOOP)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    settings.SERVER_WORKERS = args.workers   #the batch sizes scale the rate of one worker by the number of workers
+    os.environ['SERVER_WORKERS'] = str(args.workers)   #the workers are spawned and read the settings again
+    sys.exit(run(build_config(args)))
@@ -0,0 +1,225 @@
+"""The quiz session over a websocket.
+An active session keeps one connection instead of a gettests and an updatestatus request per question.
+The server sends the next test, the client acks it on the same connection, the acks are written
+to the cache in batches and the next tests are taken ahead at the pace of the client"""
+
+import asyncio
+import async_timeout
+import logging
+import math
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import List, Union
+from pydantic import ValidationError
+from quart import Blueprint, websocket, current_app
+from config import settings
+from const import TxtData, NotFoundErrorInfo, ServiceUnavailableErrorInfo
+from schemas import SessionMessage, GettedTests, AnswerResult, Levels
+from routes import _take_test, _take_test_degraded, _take_unseen_test
+from breakers import DependencyUnavailable
+from cache_backends import SeenTests
+from handlers import OverloadedError, log_raise_error
+from log_queue import log_event
+
+
+session_bp = Blueprint('session_bp', __name__)
+
+
+
+class SessionSeen(SeenTests):
+
+    """the tests which the session should not take: the ones it already took and (with User) the ones the user saw"""
+
+    def __init__(self, Taken: set, UserSeen: SeenTests = None):
+        super().__init__()
+        self.Taken = Taken
+        self.UserSeen = UserSeen
+
+    async def among(self, level: str, IDs: List[int]) -> set:
+        Seen = self.Taken.intersection(IDs)
+        if self.UserSeen is not None:
+            Seen |= await self.UserSeen.among(level, IDs)
+        return Seen
+
+
+
+class QuizSession():
+
+    """The state of one websocket session.
+    The acks are kept in Pending and written with one update of the cached batch, when there are
+    settings.SESSION_ACK_BATCH of them, after settings.SESSION_ACK_INTERVAL seconds or when the session ends.
+    Until then the tests of the session are skipped with Seen, so the session does not get them again"""
+
+    def __init__(self, level: str, user: str = None, tag: str = None):
+        self.level = level
+        self.user = user
+        self.tag = tag
+        self.EngCache = current_app.config['EngCache']
+        self.key = self.EngCache.batch_key(level, tag)
+        self.Taken = set()     #the IDs taken by the session and not written to the cache as shown yet
+        self.Sent = {}         #the tests sent to the client and not acked, ID -> test
+        self.Ready = deque()   #the tests taken ahead
+        self.Pending = {}      #the acks, ID -> datetime_shown
+        self.Seen = SessionSeen(self.Taken, self.EngCache.seen_tests(user) if user else None)
+        self.flushed_at = time.monotonic()
+        self.acked_at = None
+        self.pace = None   #the average seconds between two acks of the client
+
+
+    def flush_timeout(self) -> Union[float, None]:
+
+        """seconds until the pending acks should be written, None when there are no acks"""
+
+        if not self.Pending:
+            return None
+        return max(0, self.flushed_at + settings.SESSION_ACK_INTERVAL - time.monotonic())
+
+
+    def prefetch_depth(self) -> int:
+
+        """the number of the tests taken ahead: the ones the client answers in settings.SESSION_PREFETCH_SECONDS"""
+
+        if not self.pace:
+            return 1
+        return max(1, min(settings.SESSION_MAX_PREFETCH, math.ceil(settings.SESSION_PREFETCH_SECONDS / self.pace)))
+
+
+    async def take(self) -> Union[dict, None]:
+
+        """the next test of the rotation which the session did not take yet"""
+
+        for _ in range(2):
+            try:
+                OneTest = await _take_test(self.EngCache, self.level, self.Seen, self.tag)
+            except DependencyUnavailable as e:
+                OneTest = await _take_test_degraded(self.level, e, self.tag)
+            if OneTest or not self.Seen.batch_seen or not self.Pending:
+                break
+            await self.flush_acks()   #the tests left in the batch can be the ones of the session, the acks move the rotation on
+        if not OneTest and self.Seen.batch_seen:
+            OneTest = await _take_unseen_test(self.EngCache, self.level, self.Seen, self.tag)
+        if OneTest and OneTest["ID"] in self.Taken:   #the in-process batch does not skip the tests of the session
+            return None
+        if OneTest:
+            self.Taken.add(OneTest["ID"])
+        return OneTest
+
+
+    async def prefetch(self):
+
+        """the next tests are taken while the client reads the current one"""
+
+        while len(self.Ready) < self.prefetch_depth():
+            try:
+                OneTest = await self.take()
+            except (OverloadedError, DependencyUnavailable):
+                break   #the test will be taken when it is needed
+            if not OneTest:
+                break
+            self.Ready.append(OneTest)
+
+
+    async def send_next(self):
+        try:
+            OneTest = self.Ready.popleft() if self.Ready else await self.take()
+        except OverloadedError:
+            return await send_error(ServiceUnavailableErrorInfo.OverloadedText)
+        except DependencyUnavailable:
+            return await send_error(ServiceUnavailableErrorInfo.DependencyText)
+        if not OneTest:
+            return await send_error(NotFoundErrorInfo.NoTestsText)
+        self.Sent[OneTest["ID"]] = OneTest
+        await websocket.send_json({"type": TxtData.SessionTest, "test": GettedTests(**OneTest).model_dump(mode='json')})
+        await self.prefetch()
+
+
+    async def ack(self, test_id: int, datetime_shown: str):
+        self.Sent.pop(test_id, None)
+        self.Pending[test_id] = datetime_shown
+        now = time.monotonic()
+        if self.acked_at is not None:
+            interval = now - self.acked_at
+            self.pace = interval if self.pace is None else 0.7 * self.pace + 0.3 * interval
+        self.acked_at = now
+        if len(self.Pending) >= settings.SESSION_ACK_BATCH:
+            await self.flush_acks()
+
+
+    async def flush_acks(self):
+
+        """the acks are written to the cached batch with one read and one write (and to the look-ahead batch
+        when some of them are not in the batch), and to the bitmap of the user with one BITFIELD"""
+
+        Pending, self.Pending = self.Pending, {}
+        self.flushed_at = time.monotonic()
+        if not Pending:
+            return
+        try:
+            if await self.EngCache.update_cached_batch(self.key, Pending) < len(Pending):
+                await self.EngCache.update_cached_batch(self.EngCache.lookahead_key(self.key), Pending)
+                #the tests taken from the look-ahead batch
+        except DependencyUnavailable:   #the tests were taken from the in-process batch
+            await current_app.config['FallbackCache'].update_cached_batch(self.key, Pending)
+        if self.user:
+            try:
+                await self.EngCache.mark_seen(self.user, self.level, *Pending)
+            except DependencyUnavailable:   #the shows are saved, only the bitmap of the user misses them
+                log_event(logging.WARNING, TxtData.SeenNotMarked.format(list(Pending), self.user),
+                          event='SeenNotMarked', test_ids=list(Pending))
+        self.Taken.difference_update(Pending)   #the cache skips them now
+
+
+    async def handle(self, Data: Union[str, bytes]):
+        try:
+            Received = SessionMessage.model_validate_json(Data)
+        except ValidationError as e:
+            return await send_error(e.errors(include_url=False, include_context=False, include_input=False))
+        if Received.type == 'next':
+            return await self.send_next()
+        OneTest = self.Sent.get(Received.ID)
+        if OneTest is None:
+            return await send_error(TxtData.SessionUnknownTest.format(Received.ID))
+        if Received.type == 'answer':
+            correct = Received.option_id == OneTest["correct_option_id"]
+            await current_app.config['AnswerStats'].record(Received.ID, correct)
+            await websocket.send_json({"type": TxtData.SessionResult, "ID": Received.ID,
+                                       **AnswerResult(correct=correct, correct_option_id=OneTest["correct_option_id"],
+                                                      explanation=OneTest.get("explanation")).model_dump()})
+        await self.ack(Received.ID, (Received.datetime_shown or datetime.now(timezone.utc)).isoformat())
+        await self.send_next()
+
+
+
+async def send_error(message):
+    await websocket.send_json({"type": TxtData.SessionError, "message": message})
+
+
+
+@session_bp.websocket(TxtData.SessionRoute) #/session
+async def QuizSessionStream():
+    """The websocket of a quiz session, /session?Level=B1 (User and Tag as in gettests).
+    The server sends {"type": "test", "test": {...}}. The client acks it with {"type": "shown", "ID": 8}
+    or {"type": "answer", "ID": 8, "option_id": 2} (the server sends {"type": "result", ...} back)
+    and gets the next test. {"type": "next"} asks for a test without an ack, for example after an error"""
+
+    level = websocket.args.get(TxtData.Level_name)
+    if not level in Levels._value2member_map_:
+        await send_error(TxtData.WrongLevelError.format(list(Levels._value2member_map_)))
+        return await websocket.close(1008)
+    Session = QuizSession(level, websocket.args.get(TxtData.User_name), websocket.args.get(TxtData.Tag_name))
+    try:
+        await Session.send_next()
+        while True:
+            try:
+                async with async_timeout.timeout(Session.flush_timeout()):
+                    Data = await websocket.receive()
+            except asyncio.TimeoutError:
+                await Session.flush_acks()   #the client is idle, its acks do not wait for the batch
+                continue
+            await Session.handle(Data)
+    except Exception as e:
+        log_raise_error(e, QuizSessionStream)
+        raise e
+    finally:
+        await asyncio.shield(Session.flush_acks())   #the client disconnected, the acks are written anyway
@@ -0,0 +1,107 @@
+"""The history of the shows of the questions.
+
+questions.datetime_shown keeps only the last show, so the cache flush also adds every show to show_events.
+The table only grows. In MySQL it is partitioned by the month of shown_at: the partitions of the next months
+are added ahead and the months older than settings.SHOW_EVENTS_RETENTION_MONTHS are dropped with
+DROP PARTITION, which does not touch the rows of the other months. SQLite has no partitions, the old rows
+are deleted there. Run it once a day, for example from cron:
+
+    python api/show_events.py
+"""
+
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+import logging
+from datetime import date, datetime, time, timezone
+from typing import List
+from sqlalchemy import text, delete
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncConnection
+from config import settings
+from const import TxtData
+from models import ShowEvents
+import models
+
+
+
+async def write_show_events(session: AsyncSession, DirtyTests: dict):
+
+    """The shows of the flush ({ID: shown_at}) as multi-row inserts of settings.SHOW_EVENTS_INSERT_BATCH rows.
+    The shows which an earlier flush already wrote are skipped by the primary key"""
+
+    if session.bind.dialect.name == 'mysql':
+        statement = mysql.insert(ShowEvents).prefix_with('IGNORE')
+    else:
+        statement = sqlite.insert(ShowEvents).on_conflict_do_nothing()
+    Rows = [{"question_id": test_id, "shown_at": shown_at} for test_id, shown_at in DirtyTests.items()]
+    for i in range(0, len(Rows), settings.SHOW_EVENTS_INSERT_BATCH):
+        await session.execute(statement, Rows[i:i + settings.SHOW_EVENTS_INSERT_BATCH])
+
+
+
+def _add_months(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+
+def _partition(month: date) -> str:
+
+    """PARTITION p202610 VALUES LESS THAN ('2026-11-01')"""
+
+    return (f"PARTITION {TxtData.ShowEventsPartition.format(month)} "
+            f"VALUES LESS THAN ('{_add_months(month, 1).isoformat()}')")
+
+
+
+async def rotate_partitions(conn: AsyncConnection, today: date = None) -> dict:
+
+    """Add the partitions of the current and the next settings.SHOW_EVENTS_PARTITIONS_AHEAD months
+    (they are split from pmax, which is empty when this runs regularly) and drop the ones older than
+    settings.SHOW_EVENTS_RETENTION_MONTHS. Returns the names of the added and the dropped partitions"""
+
+    current = (today or datetime.now(timezone.utc).date()).replace(day=1)
+    oldest = _add_months(current, -settings.SHOW_EVENTS_RETENTION_MONTHS)
+    Rotated = {"added": [], "dropped": [], "deleted_rows": 0}
+    if conn.dialect.name != 'mysql':
+        Result = await conn.execute(delete(ShowEvents).where(ShowEvents.shown_at < datetime.combine(oldest, time())))
+        await conn.commit()
+        Rotated["deleted_rows"] = Result.rowcount
+        return Rotated
+
+    Result = await conn.execute(text("SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+                                     "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name "
+                                     "AND PARTITION_NAME LIKE 'p2%'"), {"table_name": ShowEvents.__tablename__})
+    Months = sorted(datetime.strptime(row.PARTITION_NAME, 'p%Y%m').date() for row in Result)
+    NewMonths = [m for m in (_add_months(current, i) for i in range(settings.SHOW_EVENTS_PARTITIONS_AHEAD + 1))
+                 if not Months or m > Months[-1]]
+    if NewMonths:
+        await conn.execute(text(f"ALTER TABLE {ShowEvents.__tablename__} REORGANIZE PARTITION pmax INTO ("
+                                f"{', '.join(_partition(m) for m in NewMonths)}, "
+                                f"PARTITION pmax VALUES LESS THAN (MAXVALUE))"))
+    OldNames = [TxtData.ShowEventsPartition.format(m) for m in Months if m < oldest]
+    if OldNames:
+        await conn.execute(text(f"ALTER TABLE {ShowEvents.__tablename__} DROP PARTITION {', '.join(OldNames)}"))
+    Rotated["added"] = [TxtData.ShowEventsPartition.format(m) for m in NewMonths]
+    Rotated["dropped"] = OldNames
+    return Rotated
+
+
+
+async def main():
+    try:
+        async with models.engine.connect() as conn:
+            Rotated = await rotate_partitions(conn)
+        logging.info(TxtData.ShowEventsRotated.format(Rotated["added"], Rotated["dropped"], Rotated["deleted_rows"]))
+    finally:
+        await models.engine.dispose()
+
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+"""Throughput of the development entry point (python api/app.py, one process) vs the production one
+(python api/serve.py with several workers). Both servers use the database and Redis from .env,
+the same load from load_test.py is sent to each of them in turn:
+
+    python benchmarks/compare_servers.py --workers 4 --requests 5000 --concurrency 100 --levels B1
+"""
+
+import os
+
+SERVER_ENV = dict(os.environ)   #taken before stand_ins loads .test.env, the servers read .env like in production
+
+import argparse
+import asyncio
+import signal
+import socket
+import subprocess
+import sys
+import time
+from load_test import run_load
+from stand_ins import ROOT, Levels
+from httpx import AsyncClient
+
+
+
+def wait_for_port(host: str, port: int, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"The server did not start on {host}:{port}")
+
+
+
+async def measure_server(name: str, command: list, args) -> dict:
+
+    """start the server, load it and stop it the same way as Ctrl+C does"""
+
+    env = dict(SERVER_ENV, SERVER_HOST=args.host, SERVER_PORT=str(args.port))
+    server = subprocess.Popen(command, cwd=ROOT, env=env)
+    try:
+        wait_for_port(args.host, args.port, args.startup_timeout)
+        async with AsyncClient(base_url=f"http://{args.host}:{args.port}", timeout=30) as ac:
+            await run_load(ac, args.levels, len(args.levels) * 2, 1, 0)   #warm up the cache
+            Report = await run_load(ac, args.levels, args.requests, args.concurrency, args.update_ratio)
+    finally:
+        server.send_signal(signal.SIGINT)
+        server.wait(timeout=60)
+    Report["scenario"] = name
+    return Report
+
+
+
+async def main(args):
+    Servers = [("api/app.py", [sys.executable, 'api/app.py']),
+               (f"api/serve.py x{args.workers} {args.loop}",
+                [sys.executable, 'api/serve.py', '--workers', str(args.workers), '--loop', args.loop])]
+    Reports = [await measure_server(name, command, args) for name, command in Servers]
+    for Report in Reports:
+        print(f"\n== {Report['scenario']}: {Report['total_rps']} req/s, statuses {Report['statuses']}")
+        for route, Stats in Report["endpoints"].items():
+            print(f"   {route:<15} {Stats['rps']:>9} req/s  p50 {Stats['p50_ms']:>8} ms  "
+                  f"p95 {Stats['p95_ms']:>8} ms  p99 {Stats['p99_ms']:>8} ms")
+    if Reports[0]["total_rps"]:
+        print(f"\nspeedup: {Reports[1]['total_rps'] / Reports[0]['total_rps']:.2f}x")
+
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--loop', choices=['uvloop', 'asyncio'], default='uvloop')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--requests', type=int, default=5000, help='gettests calls per server')
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--update-ratio', type=float, default=1.0)
+    parser.add_argument('--levels', nargs='+', default=[l.value for l in Levels],
+                        help='levels which have tests in the database')
+    parser.add_argument('--startup-timeout', type=float, default=30)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,156 @@
+"""Generator of a synthetic question bank for scale testing.
+
+Questions and options are generated for every level with realistic text lengths and a skewed
+datetime_shown (most shown tests were shown recently, a long tail was shown long ago, some were never shown).
+Rows are produced chunk by chunk and every chunk is inserted with multi-row inserts in its own transaction,
+so memory stays flat for 1M-10M rows banks:
+
+    python benchmarks/generate_bank.py --per-level 1000000 --options 4 --chunk 5000
+"""
+
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'api'))
+
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Iterator, Tuple
+from config import settings
+from models import Base, Questions, Options, create_db_engine
+from schemas import Levels
+from sqlalchemy import insert, select, func, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+WORDS = ["she", "has", "been", "working", "here", "since", "they", "were", "going", "to", "the", "station",
+         "when", "it", "started", "raining", "would", "you", "mind", "if", "I", "opened", "window", "had",
+         "already", "left", "before", "arrived", "will", "have", "finished", "by", "tomorrow", "morning",
+         "usually", "goes", "school", "on", "foot", "never", "seen", "such", "a", "beautiful", "sunset"]
+
+
+
+def random_text(min_words: int, max_words: int, max_length: int, mode_words: int = None) -> str:
+
+    """the text of a realistic length (the number of words is triangular around mode_words)"""
+
+    words = round(random.triangular(min_words, max_words, mode_words or min_words))
+    text = ' '.join(random.choices(WORDS, k=max(words, 1)))
+    return text[:max_length]
+
+
+
+def random_datetime_shown(now: datetime, shown_share: float, mean_days: float):
+
+    """None for never shown tests, otherwise an exponentially distributed age: many recent, few old"""
+
+    if random.random() >= shown_share:
+        return None
+    return now - timedelta(days=random.expovariate(1 / mean_days))
+
+
+
+def generate_chunks(start_id: int, levels: list, per_level: int, options_per_question: int, chunk: int,
+                    shown_share: float = 0.0, mean_days: float = 30.0) -> Iterator[Tuple[list, list]]:
+
+    """yields (QuestionRows, OptionRows) with at most chunk questions in every pair"""
+
+    now = datetime.now()
+    question_id = start_id
+    QuestionRows = []
+    OptionRows = []
+    for level in levels:
+        for _ in range(per_level):
+            QuestionRows.append({"id": question_id,
+                                 "level": level,
+                                 "question": random_text(5, 60, 400, 14).replace(' ', ' ___ ', 1),
+                                 "correct_id": random.randint(1, options_per_question),
+                                 "explanation": random_text(6, 80, 500, 20),
+                                 "datetime_shown": random_datetime_shown(now, shown_share, mean_days)})
+            for option_id in range(1, options_per_question + 1):
+                OptionRows.append({"question_id": question_id,
+                                   "option_id": option_id,
+                                   "option_text": random_text(1, 6, 200, 2)})
+            question_id += 1
+            if len(QuestionRows) >= chunk:
+                yield QuestionRows, OptionRows
+                QuestionRows = []
+                OptionRows = []
+    if QuestionRows:
+        yield QuestionRows, OptionRows
+
+
+
+async def load_bank(engine: AsyncEngine, levels: list, per_level: int, options_per_question: int,
+                    chunk: int = 5000, shown_share: float = 0.0, mean_days: float = 30.0,
+                    verbose: bool = False) -> int:
+
+    """Insert the generated bank chunk by chunk. Returns the number of inserted questions"""
+
+    async with engine.connect() as conn:
+        if conn.dialect.name == 'mysql':
+            await conn.execute(text("SET FOREIGN_KEY_CHECKS = 0"))
+            #questions and options reference each other (fk_correct_option_id), the rows of a chunk are consistent anyway
+        await conn.commit()
+        inserted = 0
+        try:
+            start_id = (await conn.execute(select(func.max(Questions.id)))).scalar() or 0
+            await conn.commit()
+
+            started = time.perf_counter()
+            for QuestionRows, OptionRows in generate_chunks(start_id + 1, levels, per_level, options_per_question,
+                                                            chunk, shown_share, mean_days):
+                async with conn.begin():
+                    await conn.execute(insert(Questions), QuestionRows)
+                    await conn.execute(insert(Options), OptionRows)
+                inserted += len(QuestionRows)
+                if verbose:
+                    elapsed = time.perf_counter() - started
+                    print(f"{inserted} questions, {inserted * (options_per_question + 1) / elapsed:.0f} rows/sec", end='\r')
+        finally:
+            if conn.dialect.name == 'mysql':   #the connection goes back to the pool, its next user needs the checks
+                await conn.execute(text("SET FOREIGN_KEY_CHECKS = 1"))
+                await conn.commit()
+    if verbose:
+        print()
+    return inserted
+
+
+
+async def main(args):
+    engine = create_db_engine(args.db_url)
+    try:
+        if args.create_schema:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+        started = time.perf_counter()
+        inserted = await load_bank(engine, args.levels, args.per_level, args.options, args.chunk,
+                                   args.shown_share, args.mean_days, verbose=True)
+        print(f"Inserted {inserted} questions with {args.options} options each in "
+              f"{time.perf_counter() - started:.1f} sec")
+    finally:
+        await engine.dispose()
+
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--per-level', type=int, required=True, help='questions per level')
+    parser.add_argument('--options', type=int, default=4, help='options per question')
+    parser.add_argument('--levels', nargs='+', default=[l.value for l in Levels])
+    parser.add_argument('--chunk', type=int, default=5000, help='questions per insert transaction')
+    parser.add_argument('--shown-share', type=float, default=0.7, help='share of questions with datetime_shown')
+    parser.add_argument('--mean-days', type=float, default=30.0, help='mean age of datetime_shown in days')
+    parser.add_argument('--db-url', default=settings.DB_URL, help='by default the database from .env')
+    parser.add_argument('--create-schema', action='store_true',
+                        help='create the tables from the models (for an empty SQLite file, use alembic for MySQL)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
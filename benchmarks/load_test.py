@@ -0,0 +1,167 @@
+"""Async load test of the gettests and updatestatus endpoints.
+
+By default the app is driven through the ASGI transport (the same way as in tests/conftest.py)
+against the local stand-ins from stand_ins.py. With --url a running server is loaded over HTTP instead.
+
+    python benchmarks/load_test.py --scenario all --requests 5000 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from statistics import quantiles
+from datetime import datetime, timezone
+from stand_ins import (settings, Levels, use_embedded_db, seed_questions, create_app_with_stand_ins)
+from const import TxtData
+from httpx import AsyncClient, ASGITransport
+
+
+SCENARIOS = {
+    # name: (NUMBER_OF_TESTS, warm up the cache before measuring, BATCH_ADAPTIVE)
+    'cold': (settings.NUMBER_OF_TESTS, False, settings.BATCH_ADAPTIVE),   #every level starts with an empty cache
+    'steady': (200, True, settings.BATCH_ADAPTIVE),                       #big batches, almost every call is a cache hit
+    'exhaustion': (3, True, False),   #tiny fixed batches, the cache is refilled all the time
+}
+
+
+
+class LatencyRecorder():
+
+    """latencies and statuses per endpoint"""
+
+    def __init__(self):
+        self.Latencies = {TxtData.GetTestRoute: [], TxtData.UpdateTestRoute: []}
+        self.Statuses = {}
+
+    def add(self, route: str, seconds: float, status: int):
+        self.Latencies[route].append(seconds)
+        self.Statuses[status] = self.Statuses.get(status, 0) + 1
+
+    def report(self, elapsed: float) -> dict:
+        Report = {"elapsed_sec": round(elapsed, 3), "statuses": self.Statuses, "endpoints": {}}
+        Total = 0
+        for route, Values in self.Latencies.items():
+            Total += len(Values)
+            if not Values:
+                continue
+            if len(Values) > 1:
+                Cuts = quantiles(Values, n=100, method='inclusive')
+                p50, p95, p99 = Cuts[49], Cuts[94], Cuts[98]
+            else:
+                p50 = p95 = p99 = Values[0]
+            Report["endpoints"][route] = {"requests": len(Values),
+                                          "rps": round(len(Values) / elapsed, 1),
+                                          "p50_ms": round(p50 * 1000, 3),
+                                          "p95_ms": round(p95 * 1000, 3),
+                                          "p99_ms": round(p99 * 1000, 3)}
+        Report["total_rps"] = round(Total / elapsed, 1)
+        return Report
+
+
+
+async def virtual_user(ac: AsyncClient, recorder: LatencyRecorder, levels: list, budget: list, update_ratio: float,
+                       weights: list = None):
+
+    """One client: takes a test and (with the update_ratio probability) marks it as shown"""
+
+    while budget[0] > 0:
+        budget[0] -= 1
+        level = random.choices(levels, weights)[0]
+        started = time.perf_counter()
+        response = await ac.get(f"{TxtData.GetTestRoute}?{TxtData.Level_name}={level}")
+        recorder.add(TxtData.GetTestRoute, time.perf_counter() - started, response.status_code)
+        if response.status_code != 200 or random.random() >= update_ratio:
+            continue
+
+        testing_json = {"Level": level,
+                        "ID": response.json()["ID"],
+                        "datetime_shown": datetime.now(timezone.utc).isoformat()}
+        started = time.perf_counter()
+        response = await ac.post(TxtData.UpdateTestRoute, json=testing_json)
+        recorder.add(TxtData.UpdateTestRoute, time.perf_counter() - started, response.status_code)
+
+
+
+async def run_load(ac: AsyncClient, levels: list, requests: int, concurrency: int, update_ratio: float,
+                   weights: list = None) -> dict:
+    recorder = LatencyRecorder()
+    budget = [requests]   #shared between the virtual users, counts gettests calls
+    started = time.perf_counter()
+    await asyncio.gather(*[virtual_user(ac, recorder, levels, budget, update_ratio, weights) for _ in range(concurrency)])
+    return recorder.report(time.perf_counter() - started)
+
+
+
+async def run_scenario(name: str, args) -> dict:
+
+    """Prepare fresh stand-ins for the scenario and measure it"""
+
+    number_of_tests, warm_up, adaptive = SCENARIOS[name]
+    settings.NUMBER_OF_TESTS = number_of_tests
+    settings.BATCH_ADAPTIVE = adaptive   #the adaptive sizing would grow the batches of exhaustion after one refill
+    engine = await use_embedded_db()
+    await seed_questions(args.questions, args.options, args.levels)
+    app, cache_listener = create_app_with_stand_ins(args.cache)
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            if warm_up:
+                await run_load(ac, args.levels, len(args.levels) * 2, 1, 0)
+            Report = await run_load(ac, args.levels, args.requests, args.concurrency, args.update_ratio, args.weights)
+            Report["batches"] = (await ac.get(TxtData.BatchSizesRoute)).json()["levels"]
+    finally:
+        await cache_listener.on_stop_app()   #the same flush as in after_serving
+        await engine.dispose()
+    Report["scenario"] = name
+    Report["NUMBER_OF_TESTS"] = number_of_tests
+    Report["BATCH_ADAPTIVE"] = adaptive
+    return Report
+
+
+
+async def main(args):
+    Reports = []
+    if args.url:   #a real server, the stand-ins are not used
+        async with AsyncClient(base_url=args.url) as ac:
+            Report = await run_load(ac, args.levels, args.requests, args.concurrency, args.update_ratio, args.weights)
+        Report["scenario"] = args.url
+        Reports.append(Report)
+    else:
+        Scenarios = list(SCENARIOS) if args.scenario == 'all' else [args.scenario]
+        for name in Scenarios:
+            Reports.append(await run_scenario(name, args))
+
+    for Report in Reports:
+        print(f"\n== {Report['scenario']}: {Report['total_rps']} req/s, statuses {Report['statuses']}")
+        for route, Stats in Report["endpoints"].items():
+            print(f"   {route:<15} {Stats['requests']:>7} req  {Stats['rps']:>9} req/s  "
+                  f"p50 {Stats['p50_ms']:>8} ms  p95 {Stats['p95_ms']:>8} ms  p99 {Stats['p99_ms']:>8} ms")
+        for Batch in Report.get("batches", []):
+            print(f"   level {Batch['level']:<4} refills {Batch['refills']:>6}  last batch {Batch['size']:>6}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(Reports, f, indent=2)
+
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', choices=list(SCENARIOS) + ['all'], default='all')
+    parser.add_argument('--requests', type=int, default=2000, help='gettests calls per scenario')
+    parser.add_argument('--concurrency', type=int, default=20, help='simultaneous virtual users')
+    parser.add_argument('--update-ratio', type=float, default=1.0, help='share of gettests calls followed by updatestatus')
+    parser.add_argument('--questions', type=int, default=500, help='questions per level in the embedded store')
+    parser.add_argument('--options', type=int, default=4, help='options per question')
+    parser.add_argument('--levels', nargs='+', default=[l.value for l in Levels])
+    parser.add_argument('--weights', type=float, nargs='+', default=None,
+                        help='relative popularity of the levels, for example 1 1 8 2 0.2')
+    parser.add_argument('--cache', choices=['fakeredis', 'memory'], default='fakeredis',
+                        help='Redis stand-in or the in-process cache backend')
+    parser.add_argument('--url', default=None, help='load a running server instead of the stand-ins')
+    parser.add_argument('--output', default=None, help='save the report as json')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,190 @@
+"""Micro-benchmarks of the cache functions and of the grouping of the db rows vs the batch size.
+
+Every function is measured for each NUMBER_OF_TESTS in --sizes and each number of options in --options.
+When one size takes longer than --max-seconds, the bigger sizes of that function are skipped.
+Results are saved as json, so two runs (two commits) can be compared:
+
+    python benchmarks/micro_bench.py --output before.json
+    python benchmarks/micro_bench.py --output after.json --compare before.json
+
+The cache functions use the in-process Redis stand-in, with --redis-url they use a real server,
+so the round trips are measured too (the level key B1 of that server is overwritten).
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import time
+import aioredis
+from statistics import median
+from datetime import datetime, timezone
+from stand_ins import ROOT, use_embedded_db, seed_questions, random_text, FakeAsyncRedis, EngCache
+from cache_utils import send_cach_to_db
+from routes import _group_tests
+
+
+LEVEL = 'B1'
+
+
+
+def make_rows(number_of_tests: int, options_per_question: int) -> list:
+
+    """rows like the ones that the query in _get_tests returns:
+    (id, question, correct_id, explanation, datetime_shown, option_id, option_text)"""
+
+    Rows = []
+    for question_id in range(1, number_of_tests + 1):
+        question, explanation = random_text(6, 20, 400), random_text(8, 30, 500)
+        for option_id in range(1, options_per_question + 1):
+            Rows.append((question_id, question, 1, explanation, None, option_id, random_text(1, 4, 200)))
+    return Rows
+
+
+
+def cached_list(TestsList: list) -> list:
+
+    """the tests in the form they are stored in the cache"""
+
+    return [dict(t, shown=False) for t in TestsList]
+
+
+
+async def measure(func, repeat: int, prepare=None) -> list:
+
+    """run func repeat times and return the durations. prepare runs before every call and is not measured"""
+
+    Durations = []
+    for _ in range(repeat):
+        if prepare:
+            await prepare()
+        started = time.perf_counter()
+        await func()
+        Durations.append(time.perf_counter() - started)
+    return Durations
+
+
+
+async def bench_case(number_of_tests: int, options_per_question: int, repeat: int, skip: set,
+                     redis_url: str = None) -> list:
+    Rows = make_rows(number_of_tests, options_per_question)
+    TestsList = _group_tests(Rows)
+    Cached = cached_list(TestsList)
+    Payload = json.dumps(Cached)
+    redis = aioredis.from_url(redis_url) if redis_url else FakeAsyncRedis()
+    cache = EngCache(redis)
+    engine = None
+    if 'send_cach_to_db' not in skip:
+        engine = await use_embedded_db()
+        await seed_questions(number_of_tests, options_per_question, [LEVEL])
+
+    async def reset_level():
+        await redis.delete(LEVEL)
+
+    async def fill_level():
+        await redis.set(LEVEL, Payload)
+
+    async def group():
+        _group_tests(Rows)
+
+    Shown = []
+    async def show_all():   #every run writes a newer datetime_shown, an older one is skipped by the db
+        shown = datetime.now(timezone.utc).isoformat()
+        Shown[:] = [dict(t, datetime_shown=shown, shown=True) for t in Cached]
+
+    Benches = {
+        '_group_tests': (group, None),
+        'addtocache': (lambda: cache.addtocache(TestsList, LEVEL), reset_level),
+        'get_cached_test': (lambda: cache.get_cached_test(LEVEL), fill_level),
+        'update_cached_tests': (lambda: cache.update_cached_tests(LEVEL, TestsList[-1]['ID'],
+                                                                  datetime.now(timezone.utc).isoformat()), fill_level),
+        'send_cach_to_db': (lambda: send_cach_to_db(Shown), show_all),
+    }
+    Results = []
+    try:
+        for name, (func, prepare) in Benches.items():
+            if name in skip:
+                Results.append({"bench": name, "tests": number_of_tests, "options": options_per_question,
+                                "skipped": True})
+                continue
+            Durations = await measure(func, repeat, prepare)
+            Results.append({"bench": name, "tests": number_of_tests, "options": options_per_question,
+                            "min_sec": min(Durations), "median_sec": median(Durations), "runs": len(Durations)})
+    finally:
+        if engine is not None:
+            await engine.dispose()
+    return Results
+
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return ''
+
+
+
+def compare(Results: list, old_path: str):
+
+    """print the ratio new/old of the median time for every case which exists in both runs"""
+
+    with open(old_path) as f:
+        Old = {(r["bench"], r["tests"], r["options"]): r for r in json.load(f)["results"] if not r.get("skipped")}
+    print(f"\n{'bench':<22}{'tests':>8}{'options':>8}{'old ms':>12}{'new ms':>12}{'new/old':>9}")
+    for r in Results:
+        key = (r["bench"], r["tests"], r["options"])
+        if r.get("skipped") or key not in Old:
+            continue
+        old, new = Old[key]["median_sec"], r["median_sec"]
+        print(f"{r['bench']:<22}{r['tests']:>8}{r['options']:>8}{old * 1000:>12.3f}{new * 1000:>12.3f}"
+              f"{new / old if old else 0:>9.2f}")
+
+
+
+async def main(args):
+    Results = []
+    for options_per_question in args.options:
+        skip = set()   #the functions which became too slow for the bigger sizes
+        for number_of_tests in sorted(args.sizes):
+            CaseResults = await bench_case(number_of_tests, options_per_question, args.repeat, set(skip),
+                                           args.redis_url)
+            for r in CaseResults:
+                if r.get("skipped"):
+                    print(f"{r['bench']:<22} tests={number_of_tests:<7} options={options_per_question:<3} skipped")
+                    continue
+                print(f"{r['bench']:<22} tests={number_of_tests:<7} options={options_per_question:<3} "
+                      f"median {r['median_sec'] * 1000:>12.3f} ms")
+                if r["median_sec"] > args.max_seconds:
+                    skip.add(r["bench"])
+            Results += CaseResults
+
+    Report = {"meta": {"commit": git_commit(),
+                       "python": platform.python_version(),
+                       "created": datetime.now(timezone.utc).isoformat(),
+                       "repeat": args.repeat},
+              "results": Results}
+    with open(args.output, 'w') as f:
+        json.dump(Report, f, indent=2)
+    if args.compare:
+        compare(Results, args.compare)
+
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 5000, 10000, 50000],
+                        help='NUMBER_OF_TESTS values')
+    parser.add_argument('--options', type=int, nargs='+', default=[2, 4, 8], help='options per question')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, default=5.0,
+                        help='skip the bigger sizes of a function after a median above this')
+    parser.add_argument('--output', default='micro_bench.json')
+    parser.add_argument('--compare', default=None, help='a previous json report to compare with')
+    parser.add_argument('--redis-url', default=None, help='a scratch Redis server instead of the in-process stand-in')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,78 @@
+"""CPU time of one refill: the query of the next batch, the rows and the grouping of the options into the tests.
+
+_get_tests (the batch with the content) and _get_test_ids (the IDs for the content store) are called directly,
+so the HTTP layer and the cache are not measured. The store is the embedded SQLite, so the time of the
+database is in the same process: cpu_ms is the CPU of the whole call, wall_ms includes the waits.
+Results are saved as json, so two runs (two commits) can be compared:
+
+    python benchmarks/refill_bench.py --output before.json
+    python benchmarks/refill_bench.py --output after.json --compare before.json
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from statistics import median
+from stand_ins import use_embedded_db, seed_questions
+from routes import _get_tests, _get_test_ids
+
+
+LEVEL = 'B1'
+
+
+
+async def measure(func, repeat: int) -> dict:
+    Cpu, Wall = [], []
+    await func()   #the first call compiles the statements
+    for _ in range(repeat):
+        started_cpu, started = time.process_time(), time.perf_counter()
+        await func()
+        Cpu.append(time.process_time() - started_cpu)
+        Wall.append(time.perf_counter() - started)
+    return {"cpu_ms": round(median(Cpu) * 1000, 3), "wall_ms": round(median(Wall) * 1000, 3)}
+
+
+
+async def main(args):
+    engine = await use_embedded_db()
+    Results = []
+    try:
+        await seed_questions(max(args.sizes), args.options, [LEVEL])
+        for number_of_tests in sorted(args.sizes):
+            for name, func in (('_get_tests', lambda: _get_tests(LEVEL, number_of_tests)),
+                               ('_get_test_ids', lambda: _get_test_ids(LEVEL, number_of_tests))):
+                Result = {"bench": name, "tests": number_of_tests, **await measure(func, args.repeat)}
+                print(f"{name:<15} tests={number_of_tests:<6} cpu {Result['cpu_ms']:>10} ms  "
+                      f"wall {Result['wall_ms']:>10} ms")
+                Results.append(Result)
+    finally:
+        await engine.dispose()
+
+    with open(args.output, 'w') as f:
+        json.dump(Results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            Old = {(r["bench"], r["tests"]): r for r in json.load(f)}
+        print(f"\n{'bench':<15}{'tests':>8}{'old cpu ms':>12}{'new cpu ms':>12}{'new/old':>9}")
+        for r in Results:
+            old = Old.get((r["bench"], r["tests"]))
+            if old:
+                print(f"{r['bench']:<15}{r['tests']:>8}{old['cpu_ms']:>12.3f}{r['cpu_ms']:>12.3f}"
+                      f"{r['cpu_ms'] / old['cpu_ms'] if old['cpu_ms'] else 0:>9.2f}")
+
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5, 20, 50, 100, 200],
+                        help='batch sizes, the adaptive batches are between BATCH_MIN_TESTS and BATCH_MAX_TESTS')
+    parser.add_argument('--options', type=int, default=4, help='options per question')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', default='refill_bench.json')
+    parser.add_argument('--compare', default=None, help='a previous json report to compare with')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
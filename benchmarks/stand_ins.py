@@ -0,0 +1,73 @@
+"""Local stand-ins for MySQL and Redis, so the app can be measured without any external service.
+The SQL store is an embedded SQLite file (aiosqlite, with the pragmas of DB_ENGINE = sqlite), the cache is an in-process fakeredis client"""
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'api'))
+#the same trick as in api/app.py: the api modules import each other without the package name
+
+from dotenv import load_dotenv
+load_dotenv(os.path.join(ROOT, '.test.env'))   #settings are required on import, the testing ones are enough here
+
+from config import settings
+import models
+from models import Base, Questions, Options
+from schemas import Levels
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from fakeredis import FakeAsyncRedis
+from app import create_app, setup_cache
+from cache_utils import EngCache, CacheListener
+from cache_backends import MemoryCache
+from generate_bank import load_bank, random_text
+
+
+
+
+async def use_db(url: str):
+
+    """Create the schema of the app in the database and make the app use it. The tables are dropped first,
+    so the url should point to a scratch database. models.get_async_session reads the module level
+    async_session_maker on every call, so replacing it is enough for the routes and for the cache write-back"""
+
+    engine = models.create_db_engine(url)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    models.engine = engine
+    models.async_session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    return engine
+
+
+
+async def use_embedded_db(path: str = None):
+
+    """the same for an embedded SQLite store in a temporary directory"""
+
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(prefix='engram_bench_'), 'engram.db')
+    return await use_db(f"sqlite+aiosqlite:///{path}")
+
+
+
+async def seed_questions(questions_per_level: int, options_per_question: int = 4, levels: list = None):
+
+    """fill the embedded store with generated never shown tests for every level"""
+
+    levels = levels or [l.value for l in Levels]
+    return await load_bank(models.engine, levels, questions_per_level, options_per_question)
+
+
+
+def create_app_with_stand_ins(cache_type: str = 'fakeredis'):
+
+    """The app the same way as run_app creates it, but with the in-process cache:
+    fakeredis (behaves like Redis) or the app's own MemoryCache (CACHE_TYPE = 'memory').
+    Returns the app and the cache listener"""
+
+    app = create_app()
+    cache_listener = setup_cache(app, FakeAsyncRedis() if cache_type == 'fakeredis' else MemoryCache())
+    return app, cache_listener
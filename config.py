@@ -2,6 +2,9 @@
 
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
+from typing import Optional
+import os
+import tempfile
 
 class Settings(BaseSettings):
     DB_USER: str
@@ -9,20 +12,80 @@ class Settings(BaseSettings):
     DB_HOST: str
     DB_NAME: str
     DB_PORT: int
+    DB_ENGINE: str = 'mysql'  #'mysql' or 'sqlite' (the embedded store in SQLITE_PATH, no server is needed)
+    SQLITE_PATH: str = 'engram.db'
+    SQLITE_BUSY_TIMEOUT: int = 5000  #ms a connection waits for the write lock of another worker
+    SQLITE_CACHE_SIZE: int = 65536  #KiB of the page cache of every connection
+    SQLITE_MMAP_SIZE: int = 268435456  #bytes of the db file read through mmap
     MODE: str
     CACHE_REDIS_HOST: str
     CACHE_REDIS_PORT: int
     CACHE_REDIS_DB: int
-    CACHE_TYPE: str
+    CACHE_TYPE: str  #'redis' or 'memory' (the in-process cache of one worker)
     CACHE_DEFAULT_TIMEOUT: int  #ttl for cache
     CACHE_KEY_PREFIX: str
     CACHE_CHECK_TIMEOUT: int  #how frequently check the ttl of the cache
-    NUMBER_OF_TESTS: int
+    NUMBER_OF_TESTS: int  #the size of the first batch of a level (of every batch when BATCH_ADAPTIVE is False)
+    BATCH_ADAPTIVE: bool = True  #the next batch of a level is sized from the rate the level is shown
+    BATCH_MIN_TESTS: int = 5
+    BATCH_MAX_TESTS: int = 200  #every cache operation reads and writes the whole batch, so it should stay moderate
+    BATCH_TTL_SHARE: float = 0.8  #the part of CACHE_DEFAULT_TIMEOUT in which a batch should be used up
+    BATCH_RATE_SMOOTHING: float = 0.5  #the weight of the last refill in the average rate
     SERVER_HOST: str
     SERVER_PORT: int
+    SERVER_WORKERS: int = 1  #worker processes of api/serve.py
+    SERVER_EVENT_LOOP: str = 'uvloop'  #'uvloop' (if installed) or 'asyncio'
+    SERVER_KEEP_ALIVE_TIMEOUT: float = 5  #seconds an idle keep-alive connection stays open
+    SERVER_BACKLOG: int = 2048  #queue of not yet accepted connections
+    SERVER_HTTP2: bool = True  #offer h2 through ALPN when TLS is used
+    SERVER_H2_MAX_CONCURRENT_STREAMS: int = 100
+    SERVER_GRACEFUL_TIMEOUT: float = 30  #seconds for the workers to finish requests and save the cache on stop
+    SERVER_CERTFILE: Optional[str] = None
+    SERVER_KEYFILE: Optional[str] = None
+    SERVER_WORKER_HEARTBEAT_TIMEOUT: int = 30  #a worker without a heartbeat for this time is considered dead
+    CONTENT_STORE_ENABLED: bool = False  #the content of the tests is read from a shared file, Redis keeps only IDs
+    CONTENT_STORE_DIR: str = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    CONTENT_STORE_BUILD_TIMEOUT: int = 600  #seconds the other workers wait for the file to be built
+    REDIS_TIMEOUT: float = 0.5  #seconds for one cache command
+    DB_TIMEOUT: float = 5  #seconds for one refill query
+    DB_WRITE_TIMEOUT: float = 60  #seconds for the write-back of one batch
+    BREAKER_FAILURE_THRESHOLD: int = 5  #failures in a row which open the circuit of a dependency
+    BREAKER_RECOVERY_TIMEOUT: float = 10  #seconds before the open circuit lets one probe call through
+    ADMISSION_MAX_CONCURRENT: int = 8  #db refills and write-backs at once in one worker (less than the db pool)
+    ADMISSION_QUEUE_TIMEOUT: float = 1  #seconds a refill may wait for its turn before it is shed with 503
+    ADMISSION_MAX_QUEUE: int = 100  #refills waiting at once, the next ones are shed at once
+    ADMISSION_RETRY_AFTER: int = 1  #the Retry-After header of the shed requests, seconds
+    SEEN_TTL: int = 30 * 24 * 3600  #seconds the seen questions of a user are kept after the last update
+    ANSWER_STATS_FLUSH_INTERVAL: int = 60  #seconds between two writes of the answer counters to the db
+    TEST_CONTENT_TTL: int = 3600  #seconds the content of a test read by its ID is kept in the cache
+    TEST_MAX_AGE: int = 300  #Cache-Control max-age of the test by ID, the clients revalidate it with the ETag later
+    SESSION_ACK_BATCH: int = 10  #the acks of a session websocket written to the cache at once
+    SESSION_ACK_INTERVAL: float = 5  #seconds the acks of a session may wait for the batch
+    SESSION_PREFETCH_SECONDS: float = 10  #a session takes ahead the tests which its client answers in this time
+    SESSION_MAX_PREFETCH: int = 5  #the most tests taken ahead by one session
+    SHOW_EVENTS_INSERT_BATCH: int = 5000  #rows of show_events in one multi-row insert of the cache flush
+    SHOW_EVENTS_RETENTION_MONTHS: int = 12  #the months of show_events kept by api/show_events.py
+    SHOW_EVENTS_PARTITIONS_AHEAD: int = 3  #the partitions of show_events added ahead for the next months
+    LOG_LEVEL: str = 'INFO'  #the level of the root logger of the app
+    LOG_QUEUE_SIZE: int = 10000  #records waiting for the log thread, the next ones are dropped and counted
+    LOG_RATE_LIMIT: int = 10  #records of one kind (the same event) in LOG_RATE_WINDOW, the next ones are counted
+    LOG_RATE_WINDOW: float = 10  #seconds
+    SEARCH_MAX_LIMIT: int = 50  #the most tests in one page of the search route
+    SEARCH_MAX_CONCURRENT: int = 2  #searches at once in one worker, they do not take the slots of the refills
+    SEARCH_TIMEOUT: float = 2  #seconds for one search query
+    SHUTDOWN_FLUSH_TIMEOUT: float = 20  #seconds for saving the cache on stop, less than SERVER_GRACEFUL_TIMEOUT
+    SHUTDOWN_FLUSH_CONCURRENCY: int = 4  #levels saved at once on stop
+    FALLBACK_NUMBER_OF_TESTS: int = 20  #the batch kept in the worker memory while Redis is unavailable
+    EXPORT_BATCH_SIZE: int = 1000  #rows fetched from the server-side cursor and lines sent to the client at once
+    PROFILING_ENABLED: bool = False  #the admin profiling routes are registered only when True
+    PROFILING_MAX_SECONDS: int = 60  #the upper limit for one cpu profiling session
+    PROFILING_SAMPLE_INTERVAL: float = 0.005  #seconds between two stack samples
+    PROFILING_TRACEBACK_DEPTH: int = 10  #frames stored by tracemalloc for every allocation
 
     @property
     def DB_URL(self):
+        if self.DB_ENGINE == 'sqlite':
+            return f"sqlite+aiosqlite:///{self.SQLITE_PATH}"
         return f"mysql+aiomysql://{self.DB_USER}:{self.DB_PASS}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
     
 
@@ -52,6 +52,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        render_as_batch=url.startswith('sqlite'),
     )
 
     with context.begin_transaction():
@@ -59,7 +60,9 @@ def run_migrations_offline() -> None:
 
 
 def do_run_migrations(connection: Connection) -> None:
-    context.configure(connection=connection, target_metadata=target_metadata)
+    context.configure(connection=connection, target_metadata=target_metadata,
+                      render_as_batch=connection.dialect.name == 'sqlite')
+    #SQLite can not alter constraints, batch operations recreate the table instead
 
     with context.begin_transaction():
         context.run_migrations()
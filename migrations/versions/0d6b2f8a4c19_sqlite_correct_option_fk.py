@@ -0,0 +1,45 @@
+"""SQLite correct option fk
+
+Revision ID: 0d6b2f8a4c19
+Revises: e5b90a7d3c41
+Create Date: 2026-10-20 10:12:44.305128
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0d6b2f8a4c19'
+down_revision: Union[str, None] = 'e5b90a7d3c41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _has_fk() -> bool:
+
+    """the SQLite databases created while 2b12ec7d4cd1 added the key itself have it already"""
+
+    return any(fk['name'] == 'fk_correct_option_id' for fk in sa.inspect(op.get_bind()).get_foreign_keys('questions'))
+
+
+def upgrade() -> None:
+    #MySQL got fk_correct_option_id in 2b12ec7d4cd1. SQLite can not add a constraint, the table is recreated
+    #with it, and it is checked at commit, so a question and its options can be inserted in one transaction
+    if op.get_context().dialect.name != 'sqlite' or _has_fk():
+        return
+    with op.batch_alter_table('questions') as batch_op:
+        batch_op.create_foreign_key(
+        'fk_correct_option_id', 'options',
+        ['id', 'correct_id'], ['question_id', 'option_id'],
+        deferrable=True, initially='DEFERRED'
+        )
+
+
+def downgrade() -> None:
+    if op.get_context().dialect.name != 'sqlite':
+        return
+    with op.batch_alter_table('questions') as batch_op:
+        batch_op.drop_constraint('fk_correct_option_id', type_='foreignkey')
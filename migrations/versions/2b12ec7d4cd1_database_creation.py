@@ -39,10 +39,11 @@ def upgrade() -> None:
     )
     op.create_index('ix_question_option', 'options', ['question_id', 'option_id'], unique=True)
 
-    op.create_foreign_key(
-    'fk_correct_option_id', 'questions', 'options',
-    ['id', 'correct_id'], ['question_id', 'option_id']
-    )
+    if op.get_context().dialect.name != 'sqlite':   #SQLite can not add a constraint, see 0d6b2f8a4c19
+        op.create_foreign_key(
+        'fk_correct_option_id', 'questions', 'options',
+        ['id', 'correct_id'], ['question_id', 'option_id']
+        )
     # ### end Alembic commands ###
 
 
@@ -0,0 +1,61 @@
+"""Questions fulltext
+
+Revision ID: c3f87d1b24e6
+Revises: a91d3f6c5e28
+Create Date: 2026-10-19 16:05:51.370264
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3f87d1b24e6'
+down_revision: Union[str, None] = 'a91d3f6c5e28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+#SQLite has no FULLTEXT indexes, an FTS5 table with the content of questions is used instead.
+#The triggers keep it up to date, the updates of datetime_shown do not touch it
+SQLiteUpgrade = [
+    "CREATE VIRTUAL TABLE questions_fts USING fts5(question, explanation, content='questions', content_rowid='id')",
+    "INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')",
+    """CREATE TRIGGER questions_fts_insert AFTER INSERT ON questions BEGIN
+        INSERT INTO questions_fts(rowid, question, explanation) VALUES (new.id, new.question, new.explanation);
+    END""",
+    """CREATE TRIGGER questions_fts_delete AFTER DELETE ON questions BEGIN
+        INSERT INTO questions_fts(questions_fts, rowid, question, explanation)
+        VALUES ('delete', old.id, old.question, old.explanation);
+    END""",
+    """CREATE TRIGGER questions_fts_update AFTER UPDATE OF question, explanation ON questions BEGIN
+        INSERT INTO questions_fts(questions_fts, rowid, question, explanation)
+        VALUES ('delete', old.id, old.question, old.explanation);
+        INSERT INTO questions_fts(rowid, question, explanation) VALUES (new.id, new.question, new.explanation);
+    END""",
+]
+SQLiteDowngrade = [
+    "DROP TRIGGER questions_fts_update",
+    "DROP TRIGGER questions_fts_delete",
+    "DROP TRIGGER questions_fts_insert",
+    "DROP TABLE questions_fts",
+]
+
+
+def upgrade() -> None:
+    if op.get_context().dialect.name == 'sqlite':
+        for statement in SQLiteUpgrade:
+            op.execute(statement)
+        return
+    op.create_index('ix_questions_fulltext', 'questions', ['question', 'explanation'], unique=False,
+                    mysql_prefix='FULLTEXT')
+
+
+def downgrade() -> None:
+    if op.get_context().dialect.name == 'sqlite':
+        for statement in SQLiteDowngrade:
+            op.execute(statement)
+        return
+    op.drop_index('ix_questions_fulltext', table_name='questions')
@@ -0,0 +1,51 @@
+"""Show events
+
+Revision ID: e5b90a7d3c41
+Revises: c3f87d1b24e6
+Create Date: 2026-10-19 17:21:08.640175
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b90a7d3c41'
+down_revision: Union[str, None] = 'c3f87d1b24e6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+PartitionsAhead = 3   #the months after the current one, api/show_events.py adds the next ones
+
+
+def _month_partitions(first: date, count: int) -> str:
+
+    """PARTITION p202610 VALUES LESS THAN ('2026-11-01'), ... for count months from first"""
+
+    Partitions = []
+    year, month = first.year, first.month
+    for _ in range(count):
+        next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+        Partitions.append(f"PARTITION p{year}{month:02d} VALUES LESS THAN ('{next_year}-{next_month:02d}-01')")
+        year, month = next_year, next_month
+    return ', '.join(Partitions)
+
+
+def upgrade() -> None:
+    op.create_table('show_events',
+    sa.Column('question_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('shown_at', sa.DATETIME(), nullable=False),
+    sa.PrimaryKeyConstraint('question_id', 'shown_at')
+    )
+    if op.get_context().dialect.name == 'mysql':   #a month per partition, the old months are dropped at once
+        op.execute(f"ALTER TABLE show_events PARTITION BY RANGE COLUMNS(shown_at) ("
+                   f"{_month_partitions(date.today().replace(day=1), PartitionsAhead + 1)}, "
+                   f"PARTITION pmax VALUES LESS THAN (MAXVALUE))")
+
+
+def downgrade() -> None:
+    op.drop_table('show_events')
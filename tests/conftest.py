@@ -3,10 +3,10 @@
 from typing import AsyncGenerator
 import pytest
 from httpx import AsyncClient, ASGITransport
-from api.models import Questions
+from api.models import Questions, QuestionStats, Tags, QuestionTags, ShowEvents
 from api.app import create_app, setup_cache
 from config import settings
-from sqlalchemy import update, select
+from sqlalchemy import update, select, delete
 import asyncio
 from sqlalchemy.ext.asyncio import AsyncSession,  create_async_engine, async_sessionmaker
 
@@ -159,6 +159,59 @@ async def check_datetime_in_db(for_level) -> int:
 
 
 
+async def get_question_stats(test_id) -> tuple[int, int]:
+    """get attempts and correct answers of the question from the stats table"""
+    try:
+        async with async_session_maker() as session:
+            Stats = await session.get(QuestionStats, test_id)
+        return (Stats.attempts, Stats.correct) if Stats else (0, 0)
+
+    except Exception as e:
+        pytest.fail(f"An error occurred while getting the stats from the db for checking: {e}")
+
+
+
+
+async def get_show_events(test_id, since, until) -> list:
+    """get the shows of the question from the history table between since and until"""
+    try:
+        async with async_session_maker() as session:
+            Result = await session.execute(select(ShowEvents.shown_at)
+                                           .where(ShowEvents.question_id == test_id,
+                                                  ShowEvents.shown_at.between(since, until))
+                                           .order_by(ShowEvents.shown_at))
+        return list(Result.scalars())
+
+    except Exception as e:
+        pytest.fail(f"An error occurred while getting the shows from the db for checking: {e}")
+
+
+
+
+async def set_tag(tag, for_level, number_of_tests) -> list[int]:
+    """tag the last questions of the level for testing, number_of_tests = 0 removes the tag"""
+    try:
+        async with async_session_maker() as session:
+            TagID = select(Tags.id).where(Tags.name == tag).scalar_subquery()
+            await session.execute(delete(QuestionTags).where(QuestionTags.tag_id == TagID))
+            await session.execute(delete(Tags).where(Tags.name == tag))
+            Result = await session.execute(select(Questions.id).where(Questions.level == for_level)
+                                           .order_by(Questions.id.desc()).limit(number_of_tests))
+            TestIDs = list(Result.scalars())
+            if TestIDs:
+                NewTag = Tags(name=tag)
+                session.add(NewTag)
+                await session.flush()
+                session.add_all([QuestionTags(question_id=test_id, tag_id=NewTag.id) for test_id in TestIDs])
+            await session.commit()
+        return TestIDs
+
+    except Exception as e:
+        pytest.fail(f"An error occurred while tagging the questions: {e}")
+
+
+
+
 async def _update_tests():
     """for preparing the testing db"""
     try:
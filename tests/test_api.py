@@ -1,15 +1,21 @@
 from api.schemas import GettedTests
 import json
 from typing import Tuple, Any, Generator, Optional
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 from api.models import Levels
+from api.const import TxtData
 import pytest
-from api.schemas import DataTestsToDB
+from api.schemas import DataTestsToDB, ImportedTests
 from pydantic import ValidationError
-from api.cache_utils import CacheListener
+from api.cache_utils import CacheListener, EngCache, send_cach_to_db
+from api.cache_backends import MemoryCache
+from api.admission import AdmissionLimiter
+from api.breakers import CircuitBreaker, DependencyUnavailable
+from api.log_queue import RepeatFilter
 from config import settings
 import asyncio
-from conftest import check_datetime_in_db, app
+import logging
+from conftest import check_datetime_in_db, get_question_stats, get_show_events, set_tag, app
 from httpx import AsyncClient
 
 get_data = [("NE", 200),            #the level which has questions in db
@@ -123,6 +129,25 @@ class TestEndpoints():
             assert response_code == 200
             i+=1
 
+    async def test_export_endpoint(self, ac: AsyncClient, level, questions_count_dict):
+        """The export should stream every test of the level once, in the import format"""
+
+        response = await ac.get(TxtData.ExportRoute + '?Level=' + str(level))
+        assert response.status_code == 200, (
+            f"test_export_endpoint: Expected status code 200, but got {response.status_code} when level {level}")
+        Lines = response.text.splitlines()
+        assert len(Lines) == questions_count_dict[level], (
+            f"test_export_endpoint: Expected {questions_count_dict[level]} tests, but got {len(Lines)}")
+        Exported_IDs = set()
+        for line in Lines:
+            try:
+                exported = ImportedTests.model_validate_json(line)
+            except ValidationError:
+                pytest.fail(f"test_export_endpoint: Data was not validated at level {level}: {line}")
+            assert exported.Level.value == level
+            Exported_IDs.add(exported.ID)
+        assert len(Exported_IDs) == len(Lines), "test_export_endpoint: Repeated tests in the export"
+
 class TestCache():
 
     async def test_cache_data(self, ac: AsyncClient, level):
@@ -201,7 +226,401 @@ class TestCache():
                 f"test_cache_listener: Should be updated {number_to_test/2}" 
                 f" lines in db, but updated {updated_tests} lines")
 
+
+    async def test_memory_backend_expiry(self, ac: AsyncClient, level):
+        """the in-process cache should write an expired level back to the db like the listener does"""
+
+        memory_cache = MemoryCache()
+        CacheListener(memory_cache, app)   #sets the expiry callback
+        response_code, response_dict = await get_question(ac, level)
+        response_model = GettedTests(**response_dict)
+        await post_question(ac, level, response_model.ID, datetime.now(timezone.utc).isoformat())
+
+        app_cache = app.config['EngCache'].redis
+        await memory_cache.set(level, await app_cache.get(level), ex=1)
+        await app_cache.delete(level)   #only the in-process cache has the new datetime_shown now
+        await asyncio.sleep(2)
+
+        assert await memory_cache.keys('*') == [], (
+            f"test_memory_backend_expiry: The key was not expired when level {level}")
+        updated_tests = await check_datetime_in_db(level)
+        assert updated_tests == 1, (
+            f"test_memory_backend_expiry: Should be updated 1 line in db, but updated {updated_tests} lines")
+
+
+    async def test_write_back_only_newer(self, ac: AsyncClient, level):
+        """only the shown tests should be written, and an older datetime_shown should not overwrite a newer one"""
+
+        response_code, response_dict = await get_question(ac, level)
+        test_id = GettedTests(**response_dict).ID
+        newer = datetime.now(timezone.utc)
+        older = newer.replace(year=newer.year - 1)
+        CachedList = [{"ID": test_id, "datetime_shown": older.isoformat(), "shown": True},
+                      {"ID": test_id, "datetime_shown": newer.isoformat(), "shown": True},
+                      {"ID": test_id + 1, "datetime_shown": newer.isoformat(), "shown": False}]
+
+        FlushStats = await send_cach_to_db(CachedList)
+        assert FlushStats == {"cached": 3, "dirty": 1, "written": 1}, (
+            f"test_write_back_only_newer: Unexpected write volume {FlushStats} when level {level}")
+        FlushStats = await send_cach_to_db(CachedList[:1])
+        assert FlushStats["written"] == 0, (
+            f"test_write_back_only_newer: The older datetime_shown was written when level {level}")
+        updated_tests = await check_datetime_in_db(level)
+        assert updated_tests == 1, (
+            f"test_write_back_only_newer: Should be updated 1 line in db, but updated {updated_tests} lines")
+
+
+
+    async def test_show_events(self, ac: AsyncClient, level):
+        """every show should be added to the history once, also the older one and also after a repeated flush"""
+
+        response_code, response_dict = await get_question(ac, level)
+        test_id = GettedTests(**response_dict).ID
+        newer = (datetime.now(timezone.utc) - timedelta(days=1)).replace(tzinfo=None, microsecond=0)
+        #a day ago, so the real shows of the question by the other tests are not in the window.
+        #DATETIME of MySQL has no microseconds
+        older = newer - timedelta(seconds=1)
+        for shown_at in (newer, older, newer):
+            await send_cach_to_db([{"ID": test_id, "datetime_shown": shown_at.isoformat(), "shown": True}])
+
+        Shows = await get_show_events(test_id, older, newer)
+        assert Shows == [older, newer], (
+            f"test_show_events: Expected the shows {older} and {newer}, but got {Shows} when level {level}")
+
+
+
+    async def test_flush_checkpoint(self, mocker, ac: AsyncClient, level):
+        """the levels not saved on stop should be kept in the checkpoint and saved by the next worker"""
+
+        memory_cache = MemoryCache()
+        cache_listener = CacheListener(memory_cache, app)
+        CachedList = [{"ID": (await get_question(ac, level))[1]["ID"], "shown": True,
+                       "datetime_shown": datetime.now(timezone.utc).isoformat()}]
+        await memory_cache.set(level, json.dumps(CachedList))
+        mocker.patch('api.cache_utils._write_tests',
+                     mocker.AsyncMock(side_effect=DependencyUnavailable(TxtData.DBDependency, "The db is down")))
+        await cache_listener.on_stop_app()
+        mocker.stopall()
+
+        assert len(await memory_cache.hgetall(TxtData.FlushCheckpointKey)) == 1, (
+            f"test_flush_checkpoint: The unsaved level {level} is not in the checkpoint")
+        await memory_cache.hset(TxtData.FlushCheckpointKey, mapping={"broken": json.dumps([{"ID": "broken"}])})
+        await cache_listener.recover_checkpoint()
+        assert list(await memory_cache.hgetall(TxtData.FlushCheckpointKey)) == [b"broken"], (
+            f"test_flush_checkpoint: Only the write-back which failed should stay in the checkpoint when level {level}")
+        updated_tests = await check_datetime_in_db(level)
+        assert updated_tests == 1, (
+            f"test_flush_checkpoint: Should be updated 1 line in db, but updated {updated_tests} lines")
+
     
+class TestBreakers():
+
+    async def test_breakers_route(self, ac: AsyncClient):
+        """the state of the circuit breakers should be visible"""
+
+        response = await ac.get(TxtData.BreakersRoute)
+        assert response.status_code == 200, (
+            f"test_breakers_route: Expected status code 200, but got {response.status_code}")
+        assert set(response.json()) == {TxtData.RedisDependency, TxtData.DBDependency}, (
+            f"test_breakers_route: Unexpected breakers {response.json()}")
+
+
+    async def test_redis_fallback(self, mocker, ac: AsyncClient, level):
+        """when Redis fails, a test should be served from the in-process batch and updated there"""
+
+        redis_client_test = app.config['EngCache'].redis.redis   #the client behind the circuit breaker
+        mocker.patch.object(redis_client_test, 'get', side_effect=ConnectionError("Redis is down"))
+
+        response_code, response_dict = await get_question(ac, level)
+        assert response_code == 200, (
+            f"test_redis_fallback: Expected status code 200, but got {response_code} when level {level}")
+        response_model = GettedTests(**response_dict)
+        await post_question(ac, level, response_model.ID, datetime.now(timezone.utc).isoformat())
+
+        GottenData = await app.config['FallbackCache'].redis.get(level)
+        assert any(t['shown'] for t in json.loads(GottenData)), (
+            f"test_redis_fallback: The test was not updated in the in-process batch when level {level}")
+
+
+    async def test_breaker_timeout(self, mocker):
+        """a call which takes longer than the timeout should fail as DependencyUnavailable and open the circuit"""
+
+        mocker.patch('config.settings.BREAKER_FAILURE_THRESHOLD', 2)
+        breaker = CircuitBreaker('slow', timeout=0.05, failures=(OSError,))
+        for _ in range(2):
+            with pytest.raises(DependencyUnavailable):
+                await breaker.call(asyncio.sleep, 1)
+        assert breaker.state == CircuitBreaker.Open, (
+            f"test_breaker_timeout: Expected the open circuit after the timeouts, but got {breaker.state_info()}")
+        assert await CircuitBreaker('fast', timeout=1, failures=(OSError,)).call(asyncio.sleep, 0, 'done') == 'done', (
+            "test_breaker_timeout: The call within the timeout did not return its result")
+
+
+
+class TestBatches():
+
+    async def test_batch_sizes_route(self, ac: AsyncClient, level):
+        """the first batch of a level should have the configured size and be visible in the batches route"""
+
+        await get_question(ac, level)
+        response = await ac.get(TxtData.BatchSizesRoute)
+        assert response.status_code == 200, (
+            f"test_batch_sizes_route: Expected status code 200, but got {response.status_code}")
+        Batches = {b["level"]: b for b in response.json()["levels"]}
+        assert Batches[level]["size"] == settings.NUMBER_OF_TESTS, (
+            f"test_batch_sizes_route: Expected the batch {settings.NUMBER_OF_TESTS}, but got {Batches[level]} when level {level}")
+
+
+    def test_next_batch_size(self, mocker):
+        """the batch should be sized from the averaged rate of all the workers and stay within the limits"""
+
+        for name, value in (('NUMBER_OF_TESTS', 3), ('BATCH_ADAPTIVE', True), ('BATCH_MIN_TESTS', 5),
+                            ('BATCH_MAX_TESTS', 40), ('BATCH_RATE_SMOOTHING', 0.5), ('BATCH_TTL_SHARE', 1),
+                            ('CACHE_DEFAULT_TIMEOUT', 10), ('SERVER_WORKERS', 2)):
+            mocker.patch(f'config.settings.{name}', value)
+        cache = EngCache(MemoryCache())
+        Steps = [(None, 0, 3),     #the first batch has NUMBER_OF_TESTS
+                 (10, 10, 20),     #10 shown in 10 s by 2 workers: 2 per second, used up in 10 s
+                 (0, 100, 10),     #nothing shown, the average of 2 and 0
+                 (0, 100, 5),
+                 (0, 100, 5),      #not less than BATCH_MIN_TESTS
+                 (100, 1, 40)]     #not more than BATCH_MAX_TESTS
+        now, Sizes = 1000, []
+        for shown, elapsed, _ in Steps:
+            if shown is not None:
+                cache.LevelStats['B1']["shown"] = shown
+            now += elapsed
+            mocker.patch('time.monotonic', return_value=now)
+            Sizes.append(cache.next_batch_size('B1'))
+        assert Sizes == [size for _, _, size in Steps], f"test_next_batch_size: Unexpected batch sizes {Sizes}"
+
+
+
+class TestSeen():
+
+    async def test_seen_tests_skipped(self, ac: AsyncClient, level, questions_count_dict):
+        """a user should not get the tests which the user saw, the batch of the other users should stay the same.
+        The users who saw the whole batch should share the look-ahead batch"""
+
+        EngCache = app.config['EngCache']
+        response_code, response_dict = await get_question(ac, level)
+        seen_id = response_dict["ID"]
+        await EngCache.mark_seen('learner-1', level, seen_id)
+        try:
+            response = await ac.get(f"/gettests?Level={level}&User=learner-1")
+            assert response.status_code == 200 and response.json()["ID"] != seen_id, (
+                f"test_seen_tests_skipped: The seen test {seen_id} was returned when level {level}")
+            response_code, response_dict = await get_question(ac, level)
+            assert response_dict["ID"] == seen_id, (
+                f"test_seen_tests_skipped: The rotation of the other users changed when level {level}")
+
+            BatchIDs = [t["ID"] for t in json.loads(await EngCache.redis.get(level))]
+            for user in ('learner-1', 'learner-3'):
+                await EngCache.mark_seen(user, level, *BatchIDs)
+            response = await ac.get(f"/gettests?Level={level}&User=learner-1")
+            next_id = response.json()["ID"]
+            assert response.status_code == 200 and next_id not in BatchIDs, (
+                f"test_seen_tests_skipped: A seen test was returned when the user saw the batch {BatchIDs} of level {level}")
+            assert [t["ID"] for t in json.loads(await EngCache.redis.get(level))] == BatchIDs, (
+                f"test_seen_tests_skipped: The batch of the other users changed when level {level}")
+            await ac.post("/updatestatus", json={"Level": level, "ID": next_id, "User": "learner-1"})
+            Lookahead = json.loads(await EngCache.redis.get(EngCache.lookahead_key(level)))
+            assert [t["ID"] for t in Lookahead if t["shown"]] == [next_id], (
+                f"test_seen_tests_skipped: The show of {next_id} was not written to the look-ahead batch {Lookahead}")
+            response = await ac.get(f"/gettests?Level={level}&User=learner-3")
+            assert response.json()["ID"] in [t["ID"] for t in Lookahead if not t["shown"]], (
+                f"test_seen_tests_skipped: The second user did not get a test of the look-ahead batch when level {level}")
+
+            bitmap = await EngCache.redis.get(TxtData.SeenKey.format('learner-1', level))
+            assert len(bitmap) * 8 <= questions_count_dict[level] + 8, (
+                f"test_seen_tests_skipped: The bitmap of the level {level} takes {len(bitmap)} bytes")
+        finally:
+            await EngCache.redis.delete(TxtData.SeenKey.format('learner-1', level), TxtData.SeenKey.format('learner-3', level),
+                                        TxtData.SeenBaseKey, EngCache.lookahead_key(level))
+
+
+    async def test_seen_mark_failed(self, mocker, ac: AsyncClient, level):
+        """when the bitmap can not be written, the update should still succeed, it is already saved"""
+
+        response_code, response_dict = await get_question(ac, level)
+        redis_client_test = app.config['EngCache'].redis.redis   #the client behind the circuit breaker
+        mocker.patch.object(redis_client_test, 'expire', side_effect=ConnectionError("Redis is down"))
+        response = await ac.post("/updatestatus", json={"Level": level, "ID": response_dict["ID"], "User": "learner-2",
+                                                        "datetime_shown": datetime.now(timezone.utc).isoformat()})
+        assert response.status_code == 200, (
+            f"test_seen_mark_failed: Expected status code 200, but got {response.status_code} when level {level}")
+        mocker.stopall()
+        await app.config['EngCache'].redis.delete(TxtData.SeenKey.format('learner-2', level), TxtData.SeenBaseKey)
+
+
+
+class TestTags():
+
+    async def test_tag_filter(self, ac: AsyncClient, level):
+        """only the tests with the tag should be returned, in their own rotation"""
+
+        TaggedIDs = await set_tag('test-tag', level, 2)
+        try:
+            GottenIDs = set()
+            for _ in range(2):
+                response = await ac.get(f"/gettests?Level={level}&Tag=test-tag")
+                assert response.status_code == 200, (
+                    f"test_tag_filter: Expected status code 200, but got {response.status_code} when level {level}")
+                GottenIDs.add(response.json()["ID"])
+                await ac.post("/updatestatus", json={"Level": level, "ID": response.json()["ID"], "Tag": "test-tag"})
+            assert GottenIDs == set(TaggedIDs), (
+                f"test_tag_filter: Expected the tests {TaggedIDs}, but got {GottenIDs} when level {level}")
+        finally:
+            await set_tag('test-tag', level, 0)
+
+
+
+class TestAnswers():
+
+    async def test_answer_counted(self, ac: AsyncClient, level):
+        """an answer should be checked against the cached test and counted in the stats table after the flush"""
+
+        response_code, response_dict = await get_question(ac, level)
+        test_id, correct_option_id = response_dict["ID"], response_dict["correct_option_id"]
+        attempts_before, correct_before = await get_question_stats(test_id)
+
+        for option_id, expected in ((correct_option_id, True), (correct_option_id + 100, False)):
+            response = await ac.post(TxtData.AnswerRoute, json={"Level": level, "ID": test_id, "option_id": option_id})
+            assert response.status_code == 200 and response.json()["correct"] is expected, (
+                f"test_answer_counted: Unexpected result {response.text} for the option {option_id} when level {level}")
+        await app.config['AnswerStats'].flush()
+
+        assert await get_question_stats(test_id) == (attempts_before + 2, correct_before + 1), (
+            f"test_answer_counted: The answers to the test {test_id} were not counted when level {level}")
+
+
+
+class TestByID():
+
+    async def test_etag_revalidation(self, ac: AsyncClient, level):
+        """the test by ID should have the content of the shown test and 304 should be returned for its ETag"""
+
+        response_code, response_dict = await get_question(ac, level)
+        test_id = response_dict["ID"]
+        try:
+            response = await ac.get(f"/tests/{test_id}")
+            assert response.status_code == 200 and response.json()["Question"] == response_dict["Question"], (
+                f"test_etag_revalidation: Unexpected result {response.text} for the test {test_id}")
+            response = await ac.get(f"/tests/{test_id}", headers={"If-None-Match": response.headers["ETag"]})
+            assert response.status_code == 304 and not response.content, (
+                f"test_etag_revalidation: Expected status code 304, but got {response.status_code} for the test {test_id}")
+        finally:
+            await app.config['EngCache'].redis.delete(TxtData.TestContentKey.format(test_id))
+
+
+    async def test_content_not_cached(self, ac: AsyncClient, level, mocker):
+        """the test by ID should be served from the db when its content can not be cached"""
+
+        response_code, response_dict = await get_question(ac, level)
+        test_id = response_dict["ID"]
+        await app.config['EngCache'].redis.delete(TxtData.TestContentKey.format(test_id))
+        redis_client_test = app.config['EngCache'].redis.redis   #the client behind the circuit breaker
+        mocker.patch.object(redis_client_test, 'set', side_effect=ConnectionError("Redis is down"))
+        response = await ac.get(f"/tests/{test_id}")
+        assert response.status_code == 200 and response.json()["Question"] == response_dict["Question"], (
+            f"test_content_not_cached: Unexpected result {response.text} for the test {test_id}")
+        mocker.stopall()
+
+
+
+class TestSession():
+
+    async def test_session_stream(self, level):
+        """the session should send the next test after an ack and write the ack to the cache when it ends"""
+
+        async with app.test_client().websocket(f"{TxtData.SessionRoute}?Level={level}") as ws:
+            First = (await ws.receive_json())["test"]
+            await ws.send(json.dumps({"type": "shown", "ID": First["ID"]}))
+            Second = (await ws.receive_json())["test"]
+        assert Second["ID"] != First["ID"], (
+            f"test_session_stream: The test {First['ID']} was sent again after its ack when level {level}")
+
+        for _ in range(50):   #the acks are written when the handler of the closed websocket ends
+            CachedTest = await app.config['EngCache'].find_cached_test(level, First["ID"])
+            if CachedTest and CachedTest["shown"]:
+                break
+            await asyncio.sleep(0.02)
+        assert CachedTest and CachedTest["shown"], (
+            f"test_session_stream: The ack of the test {First['ID']} was not written to the cache when level {level}")
+
+
+
+class TestSearch():
+
+    async def test_search_pages(self, ac: AsyncClient, level):
+        """the test should be found by a word of its question, the pages go by ID one after another"""
+
+        response_code, response_dict = await get_question(ac, level)
+        word = max(response_dict["Question"].split(), key=len).strip('.,?!')
+
+        FoundIDs, after = [], 0
+        for _ in range(100):   #not more than 100 pages
+            response = await ac.get(f"{TxtData.SearchRoute}?q={word}&Level={level}&after={after}&limit=1")
+            assert response.status_code == 200 and len(response.json()["tests"]) <= 1, (
+                f"test_search_pages: Unexpected result {response.text} for the word {word} when level {level}")
+            FoundIDs += [Hit["ID"] for Hit in response.json()["tests"]]
+            after = response.json()["next_after"]
+            if response_dict["ID"] in FoundIDs or after is None:
+                break
+        assert response_dict["ID"] in FoundIDs and FoundIDs == sorted(set(FoundIDs)), (
+            f"test_search_pages: The test {response_dict['ID']} was not found by the word {word}, got {FoundIDs}")
+
+
+
+class TestAdmission():
+
+    async def test_refill_shed(self, mocker, ac: AsyncClient, level):
+        """a refill which can not get a db slot within its budget should get a fast 503 with Retry-After"""
+
+        mocker.patch('config.settings.ADMISSION_QUEUE_TIMEOUT', 0.1)
+        mocker.patch('routes.db_limiter', AdmissionLimiter(0))   #every slot is taken
+
+        response = await ac.get(TxtData.GetTestRoute + '?Level=' + str(level))
+        assert response.status_code == 503, (
+            f"test_refill_shed: Expected status code 503, but got {response.status_code} when level {level}")
+        assert response.headers.get('Retry-After') == str(settings.ADMISSION_RETRY_AFTER), (
+            f"test_refill_shed: Retry-After is missing when level {level}")
+
+
+
+class TestProfiling():
+
+    @pytest.mark.parametrize("route", [TxtData.ProfileCpuRoute, TxtData.ProfileMemoryRoute])
+    async def test_profiling_disabled(self, ac: AsyncClient, level, route):
+        """the admin profiling routes should not exist when profiling is switched off"""
+
+        if settings.PROFILING_ENABLED:
+            pytest.skip("test_profiling_disabled: Profiling is switched on in the testing env")
+        response = await ac.get(route + '?Level=' + str(level))
+        assert response.status_code == 404, (
+            f"test_profiling_disabled: Expected status code 404, but got {response.status_code} for {route}")
+
+
+
+class TestLogging():
+
+    def test_repeated_records_limited(self):
+        """only LOG_RATE_LIMIT records of one event should pass in a window, the next window reports the dropped ones"""
+
+        repeat_filter = RepeatFilter(limit=3, window=60)
+        Records = [logging.LogRecord('root', logging.WARNING, __file__, 0, f"The test {i} was not updated", None, None)
+                   for i in range(6)]
+        for record in Records:
+            record.fields = {"event": "NonSuccessfulUpdate"}
+        Passed = [repeat_filter.filter(record) for record in Records]
+        assert Passed == [True] * 3 + [False] * 3, f"test_repeated_records_limited: Unexpected records passed {Passed}"
+
+        repeat_filter.window = 0   #the next record starts a new window
+        repeat_filter.filter(Records[0])
+        assert Records[0].fields["suppressed"] == 3, (
+            f"test_repeated_records_limited: The dropped records were not reported, the fields {Records[0].fields}")
+
+
 
 async def get_question(ac: AsyncClient, level) -> Tuple[int, Any]:
     """running gettests enpoint"""